@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Acceso perezoso al stack de humedales como DataArray (year, y, x) con dask,
+con chunks alineados a los bloques internos del archivo y caché de GDAL acotada.
+Requiere xarray, dask y rioxarray (GeoTIFF) o netCDF4/zarr (.nc/.zarr).
+
+    stack = abrir_stack("/ruta/stack_humedales.tif")
+    conteos = conteos_por_clase(stack).compute()   # DataArray (year, clase)
+"""
+
+import os
+
+import numpy as np
+import rasterio
+import xarray as xr
+from rasterio.env import set_gdal_config
+
+CHUNK_OBJETIVO = 1024
+CACHE_MB = 512
+
+
+def chunk_alineado(bloque, objetivo=CHUNK_OBJETIVO):
+    """Múltiplo de `bloque` más cercano a `objetivo` (al menos un bloque)."""
+    return max(1, round(objetivo / bloque)) * bloque
+
+
+def bloque_nativo(ruta):
+    """(alto, ancho) del bloque interno del GeoTIFF."""
+    with rasterio.open(ruta) as src:
+        return tuple(src.block_shapes[0])
+
+
+def configurar_cache(cache_mb=CACHE_MB):
+    set_gdal_config("GDAL_CACHEMAX", int(cache_mb))
+
+
+def _etiquetas_anio(etiquetas, anios, n):
+    if anios is not None:
+        return list(anios)
+    if etiquetas and all(str(e).isdigit() for e in etiquetas):
+        return [int(e) for e in etiquetas]
+    return list(range(1, n + 1))
+
+
+def abrir_stack(ruta, objetivo=CHUNK_OBJETIVO, anios=None, cache_mb=CACHE_MB):
+    """
+    DataArray perezoso (year, y, x) del stack en .tif, .nc o .zarr, con un
+    chunk por año y chunks espaciales alineados al bloque nativo. Los años
+    salen de `anios`, de las descripciones de banda (stack_humedales.py) o
+    de 1..n. El nodata queda en attrs["nodata"].
+    """
+    configurar_cache(cache_mb)
+    extension = os.path.splitext(ruta.rstrip("/"))[1].lower()
+    if extension in (".tif", ".tiff"):
+        import rioxarray  # noqa: F401  (registra el accesor .rio)
+
+        alto, ancho = bloque_nativo(ruta)
+        chunks = {"band": 1, "y": chunk_alineado(alto, objetivo), "x": chunk_alineado(ancho, objetivo)}
+        stack = rioxarray.open_rasterio(ruta, chunks=chunks, lock=False, cache=False)
+        nodata = stack.rio.nodata
+        etiquetas = stack.attrs.get("long_name")
+        etiquetas = [etiquetas] if isinstance(etiquetas, str) else etiquetas
+        stack = stack.rename({"band": "year"})
+        stack = stack.assign_coords(year=_etiquetas_anio(etiquetas, anios, stack.sizes["year"]))
+    else:
+        motor = "zarr" if extension == ".zarr" else None
+        datos = xr.open_dataset(ruta, engine=motor, chunks={}, mask_and_scale=False)
+        stack = datos["clase"].rename({"banda": "year"})
+        nativos = stack.encoding.get("chunksizes") or stack.encoding.get("chunks") or (1,) + stack.shape[1:]
+        stack = stack.chunk({"year": 1, "y": chunk_alineado(nativos[1], objetivo),
+                             "x": chunk_alineado(nativos[2], objetivo)})
+        nodata = stack.encoding.get("_FillValue", stack.attrs.get("_FillValue"))
+        stack = stack.assign_coords(year=_etiquetas_anio(stack["year"].values.tolist(), anios, stack.sizes["year"]))
+    stack.attrs["nodata"] = nodata
+    return stack.rename("clase")
+
+
+def _conteo_clases_chunk(bloque, n_clases, nodata):
+    """(años, 1, 1, n_clases + 1): clases 1..n por año; columna 0 = nodata o fuera de rango."""
+    conteos = np.zeros((bloque.shape[0], 1, 1, n_clases + 1), dtype=np.int64)
+    for i, capa in enumerate(bloque):
+        valido = (capa >= 1) & (capa <= n_clases)
+        if nodata is not None:
+            valido &= capa != nodata
+        conteos[i, 0, 0] = np.bincount(np.where(valido, capa, 0).ravel().astype(np.intp), minlength=n_clases + 1)
+    return conteos
+
+
+def _conteo_validos_chunk(bloque, n_clases, nodata):
+    """(1, 1, 1, n_clases + 1): clases del primer año donde todos los años son válidos (como contar_por_bloque)."""
+    valido = (bloque >= 1) & (bloque <= n_clases)
+    if nodata is not None:
+        valido &= bloque != nodata
+    valido = valido.all(axis=0)
+    conteo = np.bincount(bloque[0][valido].astype(np.intp), minlength=n_clases + 1)
+    return conteo.reshape(1, 1, 1, n_clases + 1)
+
+
+def conteos_por_clase(stack, n_clases=13):
+    """DataArray perezoso (year, clase) con los píxeles de cada clase; clase 0 = nodata o fuera de rango."""
+    datos = stack.data
+    parciales = datos.map_blocks(
+        _conteo_clases_chunk, n_clases, stack.attrs.get("nodata"), dtype=np.int64, new_axis=3,
+        chunks=(datos.chunks[0], (1,) * len(datos.chunks[1]), (1,) * len(datos.chunks[2]), (n_clases + 1,)),
+    )
+    return xr.DataArray(parciales.sum(axis=(1, 2)), dims=("year", "clase"),
+                        coords={"year": stack["year"].values, "clase": np.arange(n_clases + 1)})
+
+
+def conteos_por_bloque(stack, n_clases=13):
+    """
+    Array dask (bloques, n_clases + 1) por chunk espacial en orden fila-columna,
+    equivalente a `contar_por_bloque` con chunk_size igual al chunk del stack.
+    """
+    datos = stack.data.rechunk({0: -1})
+    n_filas, n_columnas = len(datos.chunks[1]), len(datos.chunks[2])
+    parciales = datos.map_blocks(
+        _conteo_validos_chunk, n_clases, stack.attrs.get("nodata"), dtype=np.int64, new_axis=3,
+        chunks=((1,), (1,) * n_filas, (1,) * n_columnas, (n_clases + 1,)),
+    )
+    return parciales.reshape(n_filas * n_columnas, n_clases + 1)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Asignación de id_comuna a teselas ráster en una sola pasada por conjuntos: cada
+tesela queda con la comuna (subdividida con ST_Subdivide) de mayor área de
+intersección; a igualdad, el menor objectid.
+"""
+
+import time
+
+TABLA_COMUNAS = "datos_maestros.dpa_comuna_subdere"
+TABLA_TEMPORAL = "tmp_comunas_subdivididas"
+MAX_VERTICES = 256
+
+
+def preparar_comunas(cursor, srid=32719, tabla_comunas=TABLA_COMUNAS, max_vertices=MAX_VERTICES):
+    """Crea la tabla temporal (objectid, geom) de comunas transformadas y subdivididas, con índice GiST."""
+    cursor.execute(f"""
+        DROP TABLE IF EXISTS {TABLA_TEMPORAL};
+        CREATE TEMP TABLE {TABLA_TEMPORAL} AS
+        SELECT objectid, ST_Subdivide(ST_Transform(geometria, {srid}), {max_vertices}) AS geom
+        FROM {tabla_comunas};
+        CREATE INDEX ON {TABLA_TEMPORAL} USING GIST (geom);
+        ANALYZE {TABLA_TEMPORAL};
+    """)
+
+
+def ctes_asignacion(tabla, columna_extension):
+    """CTE candidatos/areas/asignacion: (rid, objectid) de la comuna con mayor área por tesela de `tabla`."""
+    return f"""
+        candidatos AS (
+            SELECT a.rid, s.objectid, s.geom, a.{columna_extension} AS extension,
+                   min(s.objectid) OVER w = max(s.objectid) OVER w AS unica
+            FROM {tabla} a
+            JOIN {TABLA_TEMPORAL} s ON ST_Intersects(s.geom, a.{columna_extension})
+            WINDOW w AS (PARTITION BY a.rid)
+        ),
+        areas AS (
+            SELECT rid, objectid,
+                   sum(CASE
+                           WHEN unica THEN 0
+                           WHEN ST_CoveredBy(extension, geom) THEN ST_Area(extension)
+                           ELSE ST_Area(ST_Intersection(geom, extension))
+                       END) AS area
+            FROM candidatos
+            GROUP BY rid, objectid
+        ),
+        asignacion AS (
+            SELECT DISTINCT ON (rid) rid, objectid
+            FROM areas
+            ORDER BY rid, area DESC, objectid
+        )"""
+
+
+def consulta_asignacion(tabla, columna_extension, columna_comuna="id_comuna"):
+    """UPDATE que asigna a cada tesela la comuna con mayor área de intersección con `columna_extension`."""
+    return f"""
+        WITH {ctes_asignacion(tabla, columna_extension)}
+        UPDATE {tabla} a
+        SET {columna_comuna} = asignacion.objectid
+        FROM asignacion
+        WHERE a.rid = asignacion.rid;
+    """
+
+
+def asignar_comunas(conexion, tabla, columna_extension, columna_comuna="id_comuna", srid=32719,
+                    tabla_comunas=TABLA_COMUNAS, max_vertices=MAX_VERTICES):
+    """Prepara las comunas y actualiza `columna_comuna` de `tabla` en una transacción; devuelve filas actualizadas."""
+    inicio = time.perf_counter()
+    with conexion.cursor() as cursor:
+        preparar_comunas(cursor, srid, tabla_comunas, max_vertices)
+        preparacion = time.perf_counter() - inicio
+        cursor.execute(consulta_asignacion(tabla, columna_extension, columna_comuna))
+        filas = cursor.rowcount
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLA_TEMPORAL};")
+    conexion.commit()
+    print(f"{columna_comuna} asignado a {filas:,} teselas de {tabla} "
+          f"(comunas preparadas en {preparacion:,.1f} s, total {time.perf_counter() - inicio:,.1f} s)")
+    return filas
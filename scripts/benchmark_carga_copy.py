@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark local de inserción de muestras: dicts + to_postgis contra COPY desde
+columnas NumPy (carga_copy.py). Sin --dsn usa un sumidero COPY falso.
+
+    python scripts/benchmark_carga_copy.py --puntos 50000 --dsn postgresql://postgres@localhost/bench
+"""
+
+import argparse
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from carga_copy import columnas_formato_largo, copiar_columnas, copiar_puntos_servidor
+from esquema_muestreo import crear_tabla_muestreo
+
+ANIOS = list(range(2015, 2025))
+SRID = 32719
+
+
+class SumideroCopy:
+    """
+    Conexión DB-API mínima: ignora SQL y descarta (contando bytes) lo recibido
+    por COPY, o lo agrega a `archivo` si se indica. Se puede compartir entre hilos.
+    """
+
+    def __init__(self, archivo=None):
+        self.bytes_recibidos = 0
+        self.archivo = archivo
+        self.autocommit = False
+        self._lock = threading.Lock()
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def copy_expert(self, sql, archivo, size=8192):
+        while True:
+            bloque = archivo.read(1 << 20)
+            if not bloque:
+                break
+            with self._lock:
+                self.bytes_recibidos += len(bloque)
+                if self.archivo is not None:
+                    self.archivo.write(bloque)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def generar_muestras(n_puntos, semilla=0):
+    rng = np.random.RandomState(semilla)
+    filas = rng.randint(0, 89094, n_puntos)
+    columnas = rng.randint(0, 72127, n_puntos)
+    uuids = np.array([str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{r}_{c}")) for r, c in zip(filas, columnas)], dtype=object)
+    clases = np.array([f"Clase {k}" for k in rng.randint(1, 14, n_puntos)], dtype=object)
+    valores = rng.randint(1, 14, (len(ANIOS), n_puntos)).astype(np.uint8)
+    xs = 250_000 + columnas * 30.0 + 15.0
+    ys = 7_800_000 - filas * 30.0 - 15.0
+    ids = filas.astype(np.int64) * 72127 + columnas
+    return ids, uuids, clases, valores, xs, ys
+
+
+def registros_originales(ids, uuids, clases, valores, xs, ys):
+    """Reproduce la construcción de registros del muestreador antes de COPY."""
+    from shapely.geometry import Point
+
+    registros = []
+    for j in range(len(uuids)):
+        x, y = float(xs[j]), float(ys[j])
+        for i, anio in enumerate(ANIOS):
+            registros.append({
+                "uuid_muestra": uuids[j],
+                "year": anio,
+                "clase_referencia": clases[j],
+                "valor": int(valores[i, j]),
+                "x": x,
+                "y": y,
+                "geometria": Point(x, y)
+            })
+    return registros
+
+
+def cargar_to_postgis(muestras, engine, esquema, tabla):
+    import geopandas as gpd
+
+    gdf = gpd.GeoDataFrame(registros_originales(*muestras), geometry="geometria", crs=f"EPSG:{SRID}")
+    if engine is None:
+        # Sin base: mismo trabajo en Python que to_postgis (EWKB por shapely + CSV para COPY)
+        from carga_copy import buffer_csv
+        df = gdf.to_wkb(hex=True)
+        buffer_csv({c: df[c].to_numpy() for c in df.columns})
+    else:
+        gdf.to_postgis(tabla, engine, schema=esquema, if_exists="append", index=False)
+    return len(gdf)
+
+
+def cargar_copy(muestras, conexion, tabla, metodo):
+    columnas = columnas_formato_largo(*muestras, ANIOS, SRID, geometria=(metodo == "ewkb"))
+    if metodo == "ewkb":
+        return copiar_columnas(conexion, tabla, columnas)
+    return copiar_puntos_servidor(conexion, tabla, columnas, SRID)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark to_postgis vs COPY para muestreo_humedales_giz.")
+    parser.add_argument("--puntos", type=int, default=50_000, help="Puntos muestreados (filas = puntos × 10 años)")
+    parser.add_argument("--dsn", default=None, help="PostgreSQL/PostGIS desechable; sin él se usa un sumidero falso")
+    parser.add_argument("--esquema", default="public")
+    args = parser.parse_args()
+
+    muestras = generar_muestras(args.puntos)
+    filas = args.puntos * len(ANIOS)
+    print(f"Benchmark con {args.puntos:,} puntos ({filas:,} filas), destino: {'PostGIS' if args.dsn else 'sumidero COPY falso'}")
+
+    engine = None
+    if args.dsn:
+        from sqlalchemy import create_engine
+        engine = create_engine(args.dsn)
+
+    metodos = ["to_postgis", "copy_ewkb", "copy_servidor"]
+    for metodo in metodos:
+        tabla = f"benchmark_copy_{metodo}"
+        tabla_completa = f"{args.esquema}.{tabla}"
+        conexion = engine.raw_connection() if engine is not None else SumideroCopy()
+        try:
+            with conexion.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {tabla_completa};")
+            conexion.commit()
+            if metodo != "to_postgis":
+                crear_tabla_muestreo(conexion, tabla_completa, SRID)
+
+            inicio = time.perf_counter()
+            if metodo == "to_postgis":
+                insertadas = cargar_to_postgis(muestras, engine, args.esquema, tabla)
+            else:
+                insertadas = cargar_copy(muestras, conexion, tabla_completa, metodo.split("_")[1])
+            segundos = time.perf_counter() - inicio
+            print(f"{metodo:<15} {segundos:8.2f} s  {insertadas / segundos:>12,.0f} filas/s")
+
+            with conexion.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {tabla_completa};")
+            conexion.commit()
+        finally:
+            conexion.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark sintético de las rutas calientes del ETL (escaneo, muestreo,
+extracción, inserción, fusión y carga DEM) sobre datos generados. Guarda la
+mediana de cada caso en un historial JSONL y marca las regresiones respecto
+de la última ejecución con los mismos parámetros.
+
+    python scripts/benchmark_etl.py --alto 4096 --ancho 4096 --nodata 0.3
+    python scripts/benchmark_etl.py --dsn postgresql://postgres@localhost/bench --estricto
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from benchmark_carga_copy import SumideroCopy
+from carga_copy import columnas_muestreo, copiar_muestras
+from carga_raster import cargar_raster
+from esquema_muestreo import crear_tabla_muestreo, crear_tabla_muestreo_compacta
+from extraccion_valores import coordenadas_centro, iterar_valores_por_ventana
+from instrumentacion import DIRECTORIO_METRICAS
+from muestreo_bloques import (
+    asignar_muestras_por_bloque, contar_por_bloque, escanear_candidatos, muestrear_estratificado,
+    muestrear_por_conteos, uuids_deterministas,
+)
+
+CASOS = ("escaneo", "muestreo", "extraccion", "insercion", "fusion_dem", "carga_dem")
+RESULTADOS = os.path.join(os.path.dirname(DIRECTORIO_METRICAS), "benchmarks", "benchmark_etl.jsonl")
+N_CLASES = 13
+NODATA_STACK = 0
+NODATA_DEM = -9999
+SRID = 32719
+PARCHE = 64  # lado en píxeles de los parches de clase y de nodata
+
+
+# ==========================
+# DATOS SINTÉTICOS
+# ==========================
+
+def _parches(rng, alto, ancho, fraccion):
+    """Máscara (alto, ancho) con parches PARCHE×PARCHE marcados con probabilidad `fraccion`."""
+    celdas = rng.random_sample((-(-alto // PARCHE), -(-ancho // PARCHE))) < fraccion
+    return np.kron(celdas, np.ones((PARCHE, PARCHE), dtype=bool))[:alto, :ancho]
+
+
+def generar_stack(ruta, alto, ancho, bandas, bloque, fraccion_nodata, compresion="deflate", semilla=0):
+    """
+    Stack Byte (bandas, alto, ancho) con clases 1..13 en parches que cambian
+    ~10 % por año y nodata en parches comunes a todas las bandas.
+    """
+    perfil = {
+        "driver": "GTiff", "width": ancho, "height": alto, "count": bandas, "dtype": "uint8",
+        "nodata": NODATA_STACK, "crs": f"EPSG:{SRID}", "tiled": True, "blockxsize": bloque, "blockysize": bloque,
+        "transform": rasterio.Affine(30.0, 0, 250_000, 0, -30.0, 7_800_000),
+    }
+    if compresion != "none":
+        perfil["compress"] = compresion
+    with rasterio.open(ruta, "w", **perfil) as dst:
+        for row_off in range(0, alto, bloque):
+            filas = min(bloque, alto - row_off)
+            rng = np.random.RandomState(np.random.SeedSequence(semilla, spawn_key=(row_off,)).generate_state(4))
+            nodata = _parches(rng, filas, ancho, fraccion_nodata)
+            clases = np.kron(rng.randint(1, N_CLASES + 1, (-(-filas // PARCHE), -(-ancho // PARCHE))),
+                             np.ones((PARCHE, PARCHE), dtype=np.uint8))[:filas, :ancho].astype(np.uint8)
+            datos = np.empty((bandas, filas, ancho), dtype=np.uint8)
+            for banda in range(bandas):
+                cambios = rng.random_sample((filas, ancho)) < 0.1
+                clases = np.where(cambios, rng.randint(1, N_CLASES + 1, (filas, ancho)), clases).astype(np.uint8)
+                datos[banda] = np.where(nodata, NODATA_STACK, clases)
+            dst.write(datos, window=Window(0, row_off, ancho, filas))
+    return ruta
+
+
+def generar_teselas_dem(directorio, n_lado, tamano, fraccion_nodata, semilla=0):
+    """n_lado × n_lado teselas DEM contiguas de `tamano` px (5 m) con relieve suave, ruido y parches nodata."""
+    rng = np.random.RandomState(semilla)
+    yy, xx = np.mgrid[0:tamano, 0:tamano].astype(np.float32)
+    rutas = []
+    for i in range(n_lado):
+        for j in range(n_lado):
+            relieve = 1500 + 800 * np.sin((xx + j * tamano) / 700.0) * np.cos((yy + i * tamano) / 900.0)
+            datos = (relieve + rng.normal(0, 5, relieve.shape)).astype(np.int16)
+            datos[_parches(rng, tamano, tamano, fraccion_nodata)] = NODATA_DEM
+            ruta = os.path.join(directorio, f"dem_{i}_{j}.tif")
+            with rasterio.open(ruta, "w", driver="GTiff", width=tamano, height=tamano, count=1, dtype="int16",
+                               nodata=NODATA_DEM, crs=f"EPSG:{SRID}", tiled=True, blockxsize=256, blockysize=256,
+                               transform=rasterio.Affine(5.0, 0, 300_000 + j * tamano * 5.0,
+                                                         0, -5.0, 6_300_000 - i * tamano * 5.0)) as dst:
+                dst.write(datos, 1)
+            rutas.append(ruta)
+    return rutas
+
+
+# ==========================
+# CASOS
+# ==========================
+
+class Contexto:
+    """Parámetros y resultados intermedios compartidos entre casos (el muestreo usa el escaneo, etc.)."""
+
+    def __init__(self, args, directorio):
+        self.args = args
+        self.directorio = directorio
+        self.bandas_idx = list(range(1, args.bandas + 1))
+        self.anios = list(range(2015, 2015 + args.bandas))
+        self.nombres_clase = np.array([f"Clase {k}" for k in range(N_CLASES + 1)], dtype=object)
+        self.stack = None
+        self.teselas = None
+        self.dem = None
+
+    def conectar(self):
+        if self.args.dsn:
+            import psycopg2
+            return psycopg2.connect(self.args.dsn)
+        return self.sumidero
+
+    def tabla(self, nombre):
+        return f"public.benchmark_etl_{nombre}"
+
+
+def caso_escaneo(ctx):
+    with rasterio.open(ctx.stack) as src:
+        if ctx.args.modo == "conteos":
+            ctx.conteos = contar_por_bloque(src, ctx.bandas_idx, ctx.args.chunk, src.nodata)
+            return int(ctx.conteos.sum())
+        ctx.candidatos = escanear_candidatos(src, ctx.bandas_idx, ctx.args.chunk, src.nodata)
+        return sum(len(indices) for indices in ctx.candidatos.values())
+
+
+def caso_muestreo(ctx):
+    entropia = np.random.SeedSequence(0).entropy
+    rng = np.random.RandomState(np.random.SeedSequence(entropia).generate_state(4))
+    if ctx.args.modo == "conteos":
+        asignacion = asignar_muestras_por_bloque(ctx.conteos, ctx.args.porcentaje, rng)
+        with rasterio.open(ctx.stack) as src:
+            ctx.clases, ctx.planos = muestrear_por_conteos(src, ctx.bandas_idx, ctx.args.chunk, src.nodata,
+                                                           asignacion, entropia)
+    else:
+        ctx.clases, ctx.planos = muestrear_estratificado(ctx.candidatos, ctx.args.porcentaje, rng)
+    return len(ctx.planos)
+
+
+def caso_extraccion(ctx):
+    with rasterio.open(ctx.stack) as src:
+        filas, columnas = np.divmod(ctx.planos, src.width)
+        ctx.lotes = []
+        for _, idx, valores in iterar_valores_por_ventana(src, filas, columnas, ctx.bandas_idx, ctx.args.chunk):
+            xs, ys = coordenadas_centro(src.transform, filas[idx], columnas[idx])
+            ctx.lotes.append((idx, valores, xs, ys))
+    return len(ctx.planos)
+
+
+def preparar_insercion(ctx):
+    """Tabla de salida vacía (con --dsn) antes de cada repetición; no se mide."""
+    if not ctx.args.dsn:
+        return
+    conexion = ctx.conectar()
+    try:
+        tabla = ctx.tabla(f"muestreo_{ctx.args.formato}")
+        with conexion.cursor() as cursor:
+            cursor.execute(f"DROP VIEW IF EXISTS {ctx.tabla('muestreo_largo_vista')}; DROP TABLE IF EXISTS {tabla};")
+        conexion.commit()
+        if ctx.args.formato == "compacto":
+            crear_tabla_muestreo_compacta(conexion, tabla, ctx.tabla("clases"), ctx.tabla("muestreo_largo_vista"),
+                                          SRID, ctx.anios, {k: f"Clase {k}" for k in range(1, N_CLASES + 1)})
+        else:
+            crear_tabla_muestreo(conexion, tabla, SRID)
+    finally:
+        conexion.close()
+
+
+def caso_insercion(ctx):
+    """Lotes de ~--lote filas, como el acumulador de [5/7], con un COPY y un commit por lote."""
+    filas_por_punto = 1 if ctx.args.formato == "compacto" else len(ctx.anios)
+    tabla = ctx.tabla(f"muestreo_{ctx.args.formato}")
+    ancho = ctx.ancho
+    conexion = ctx.conectar()
+    insertadas = 0
+    try:
+        lote, filas_lote = [], 0
+        for i, elemento in enumerate(ctx.lotes):
+            lote.append(elemento)
+            filas_lote += len(elemento[0]) * filas_por_punto
+            if filas_lote < ctx.args.lote and i < len(ctx.lotes) - 1:
+                continue
+            idx = np.concatenate([l[0] for l in lote])
+            filas, columnas = np.divmod(ctx.planos[idx], ancho)
+            datos = columnas_muestreo(
+                ctx.args.formato, ctx.planos[idx], uuids_deterministas(filas, columnas), ctx.clases[idx],
+                np.concatenate([l[1] for l in lote], axis=1), np.concatenate([l[2] for l in lote]),
+                np.concatenate([l[3] for l in lote]), ctx.anios, SRID, ctx.nombres_clase,
+                geometria=(ctx.args.geometria == "ewkb")
+            )
+            insertadas += copiar_muestras(conexion, tabla, datos, SRID, ctx.args.geometria)
+            lote, filas_lote = [], 0
+    finally:
+        conexion.close()
+    return insertadas
+
+
+def caso_fusion_dem(ctx):
+    from fusion_dem import fusionar
+
+    ctx.dem = fusionar(ctx.teselas, os.path.join(ctx.directorio, "dem_fusionado.tif"), modo="cog")
+    with rasterio.open(ctx.dem) as src:
+        return src.width * src.height
+
+
+def caso_carga_dem(ctx):
+    estadisticas = cargar_raster(ctx.dem, ctx.tabla("dem"), ctx.conectar, srid=SRID, tamano_tesela=256,
+                                 nodata_defecto=NODATA_DEM, workers=ctx.args.workers, conexiones=ctx.args.conexiones,
+                                 extension_valores=True, intervalo_progreso=float("inf"))
+    return estadisticas["teselas"]
+
+
+FUNCIONES = {
+    "escaneo": (caso_escaneo, None), "muestreo": (caso_muestreo, None), "extraccion": (caso_extraccion, None),
+    "insercion": (caso_insercion, preparar_insercion), "fusion_dem": (caso_fusion_dem, None),
+    "carga_dem": (caso_carga_dem, None),
+}
+DEPENDENCIAS = {"muestreo": ["escaneo"], "extraccion": ["escaneo", "muestreo"],
+                "insercion": ["escaneo", "muestreo", "extraccion"]}
+
+
+def medir(ctx, caso, repeticiones):
+    funcion, preparar = FUNCIONES[caso]
+    tiempos, filas = [], 0
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar(ctx)
+        inicio = time.perf_counter()
+        filas = funcion(ctx)
+        tiempos.append(time.perf_counter() - inicio)
+    mediana = statistics.median(tiempos)
+    return {"segundos": round(mediana, 4), "minimo": round(min(tiempos), 4), "filas": filas,
+            "filas_por_segundo": round(filas / mediana, 1) if mediana else None}
+
+
+# ==========================
+# HISTORIAL
+# ==========================
+
+def version_codigo():
+    try:
+        salida = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        return salida.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parametros(args):
+    """Parámetros que definen un caso comparable (el destino cuenta; la ruta del sumidero no)."""
+    claves = ("alto", "ancho", "bandas", "bloque", "compresion", "nodata", "chunk", "modo", "porcentaje",
+              "formato", "geometria", "lote", "teselas_dem", "tamano_dem", "workers", "conexiones")
+    datos = {clave: getattr(args, clave) for clave in claves}
+    datos["destino"] = "postgis" if args.dsn else "sumidero"
+    return datos
+
+
+def ultima_ejecucion(ruta, params):
+    if not os.path.exists(ruta):
+        return None
+    anterior = None
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            registro = json.loads(linea)
+            if registro.get("parametros") == params:
+                anterior = registro
+    return anterior
+
+
+def comparar(casos, anterior, umbral):
+    """Imprime la tabla de resultados contra `anterior` y devuelve los casos con regresión."""
+    regresiones = []
+    print(f"{'caso':<11} {'mediana s':>10} {'mín. s':>9} {'filas':>12} {'filas/s':>12} {'anterior s':>11} {'cambio':>8}")
+    for caso, r in casos.items():
+        previo = (anterior or {}).get("casos", {}).get(caso)
+        cambio = marca = ""
+        if previo and previo["segundos"]:
+            relativo = r["segundos"] / previo["segundos"] - 1
+            cambio = f"{relativo:+.1%}"
+            if relativo > umbral:
+                marca = "  REGRESIÓN"
+                regresiones.append(caso)
+        filas_s = f"{r['filas_por_segundo']:,.0f}" if r["filas_por_segundo"] else "-"
+        previo_s = f"{previo['segundos']:.3f}" if previo else "-"
+        print(f"{caso:<11} {r['segundos']:>10.3f} {r['minimo']:>9.3f} {r['filas']:>12,} {filas_s:>12} "
+              f"{previo_s:>11} {cambio:>8}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sintético de escaneo, muestreo, extracción, "
+                                                 "inserción y fusión/carga DEM.")
+    parser.add_argument("--casos", nargs="+", choices=CASOS, default=list(CASOS))
+    parser.add_argument("--alto", type=int, default=4096, help="Filas del stack sintético")
+    parser.add_argument("--ancho", type=int, default=4096, help="Columnas del stack sintético")
+    parser.add_argument("--bandas", type=int, default=10, help="Bandas (años) del stack")
+    parser.add_argument("--bloque", type=int, default=256, help="Bloque interno del GeoTIFF (teselado)")
+    parser.add_argument("--compresion", choices=["deflate", "lzw", "none"], default="deflate")
+    parser.add_argument("--nodata", type=float, default=0.3, help="Fracción aproximada de nodata (stack y DEM)")
+    parser.add_argument("--chunk", type=int, default=1024, help="chunk_size del muestreo (como en el ETL)")
+    parser.add_argument("--modo", choices=["conteos", "candidatos"], default="conteos")
+    parser.add_argument("--porcentaje", type=float, default=0.01)
+    parser.add_argument("--formato", choices=["largo", "compacto"], default="largo")
+    parser.add_argument("--geometria", choices=["ewkb", "servidor"], default="ewkb")
+    parser.add_argument("--lote", type=int, default=500_000, help="Filas por COPY en la inserción")
+    parser.add_argument("--teselas-dem", type=int, default=2, help="Teselas DEM por lado (total = teselas²)")
+    parser.add_argument("--tamano-dem", type=int, default=2048, help="Píxeles por lado de cada tesela DEM")
+    parser.add_argument("--workers", type=int, default=4, help="Procesos de cargar_raster")
+    parser.add_argument("--conexiones", type=int, default=4, help="Conexiones COPY de cargar_raster")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--dsn", default=None, help="PostgreSQL/PostGIS desechable; sin él se usa un sumidero COPY")
+    parser.add_argument("--sumidero", default=None,
+                        help="Archivo donde escribir lo enviado por COPY (sin --dsn; con carga_dem, --conexiones 1)")
+    parser.add_argument("--resultados", default=RESULTADOS, help="Historial JSONL de ejecuciones")
+    parser.add_argument("--umbral", type=float, default=0.10, help="Aumento relativo de la mediana que es regresión")
+    parser.add_argument("--estricto", action="store_true", help="Terminar con código 1 si hay regresiones")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio de datos sintéticos")
+    args = parser.parse_args()
+
+    casos = [caso for caso in CASOS if caso in args.casos or any(caso in DEPENDENCIAS.get(c, []) for c in args.casos)]
+    if args.sumidero and not args.dsn and args.conexiones > 1 and "carga_dem" in casos:
+        # Los COPY de cada conexión llegan en trozos y se intercalarían en el mismo archivo
+        parser.error("--sumidero con carga_dem requiere --conexiones 1")
+    directorio = tempfile.mkdtemp(prefix="benchmark_etl_")
+    archivo_sumidero = open(args.sumidero, "w") if args.sumidero and not args.dsn else None
+    ctx = Contexto(args, directorio)
+    ctx.sumidero = SumideroCopy(archivo_sumidero)
+    ctx.ancho = args.ancho
+    resultados = {}
+    try:
+        if {"escaneo", "muestreo", "extraccion", "insercion"} & set(casos):
+            inicio = time.perf_counter()
+            ctx.stack = generar_stack(os.path.join(directorio, "stack.tif"), args.alto, args.ancho, args.bandas,
+                                      args.bloque, args.nodata, args.compresion)
+            print(f"Stack sintético {args.bandas}×{args.alto}×{args.ancho} (bloque {args.bloque}, {args.compresion}, "
+                  f"nodata ~{args.nodata:.0%}) generado en {time.perf_counter() - inicio:,.1f} s")
+        if {"fusion_dem", "carga_dem"} & set(casos):
+            ctx.teselas = generar_teselas_dem(directorio, args.teselas_dem, args.tamano_dem, args.nodata)
+            ctx.dem = ctx.teselas[0]
+            print(f"{len(ctx.teselas)} teselas DEM de {args.tamano_dem}×{args.tamano_dem} generadas")
+        print(f"Destino: {'PostGIS' if args.dsn else 'sumidero COPY ' + (args.sumidero or 'falso')}, "
+              f"{args.repeticiones} repeticiones por caso")
+
+        for caso in casos:
+            if caso == "fusion_dem":
+                try:
+                    import osgeo  # noqa: F401
+                except ImportError:
+                    print("fusion_dem omitido: GDAL (osgeo) no está instalado; carga_dem usa la primera tesela")
+                    continue
+            # Los casos pedidos sólo como dependencia se ejecutan una vez, sin registrarse
+            repeticiones = args.repeticiones if caso in args.casos else 1
+            resultado = medir(ctx, caso, repeticiones)
+            if caso in args.casos:
+                resultados[caso] = resultado
+    finally:
+        if archivo_sumidero is not None:
+            archivo_sumidero.close()
+        if args.dsn:
+            conexion = ctx.conectar()
+            try:
+                with conexion.cursor() as cursor:
+                    cursor.execute(f"DROP VIEW IF EXISTS {ctx.tabla('muestreo_largo_vista')}; "
+                                   + " ".join(f"DROP TABLE IF EXISTS {ctx.tabla(nombre)};" for nombre in
+                                              ("muestreo_largo", "muestreo_compacto", "clases", "dem")))
+                conexion.commit()
+            finally:
+                conexion.close()
+        if args.conservar:
+            print(f"Datos sintéticos en {directorio}")
+        else:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    params = parametros(args)
+    anterior = ultima_ejecucion(args.resultados, params)
+    regresiones = comparar(resultados, anterior, args.umbral)
+    if anterior:
+        print(f"Comparado con {anterior['fecha']} (versión {anterior.get('version') or '?'}), umbral {args.umbral:.0%}")
+    else:
+        print("Sin ejecución previa con estos parámetros; esta queda como referencia.")
+
+    registro = {"fecha": datetime.now().isoformat(timespec="seconds"), "version": version_codigo(),
+                "maquina": platform.node(), "cpus": os.cpu_count(), "repeticiones": args.repeticiones,
+                "parametros": params, "casos": resultados, "regresiones": regresiones}
+    os.makedirs(os.path.dirname(os.path.abspath(args.resultados)), exist_ok=True)
+    with open(args.resultados, "a", encoding="utf-8") as archivo:
+        archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    print(f"Resultados agregados a {args.resultados}")
+    if regresiones and args.estricto:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark local de fusión de teselas DEM (fusion_dem.py) en modo cog, vrt y jp2:
+tiempo de fusión y de carga, tamaño en disco y diferencia con las teselas originales.
+
+    python scripts/benchmark_fusion_dem.py --teselas 3 --tamano 2048
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+from osgeo import gdal, osr
+
+from fusion_dem import MODOS_FUSION, EXTENSIONES_FUSION, fusionar
+
+NODATA = -9999
+SRID = 32719
+TESELA_CARGA = 256
+
+
+def generar_teselas(directorio, n_lado, tamano, formato="GTiff", semilla=0):
+    """n_lado × n_lado teselas contiguas de `tamano` px con relieve suave, ruido y una esquina nodata."""
+    rng = np.random.RandomState(semilla)
+    driver_mem = gdal.GetDriverByName("MEM")
+    driver = gdal.GetDriverByName(formato)
+    extension = ".jp2" if formato == "JP2OpenJPEG" else ".tif"
+    rutas = []
+    yy, xx = np.mgrid[0:tamano, 0:tamano].astype(np.float32)
+    for i in range(n_lado):
+        for j in range(n_lado):
+            relieve = 1500 + 800 * np.sin((xx + j * tamano) / 700.0) * np.cos((yy + i * tamano) / 900.0)
+            datos = (relieve + rng.normal(0, 5, relieve.shape)).astype(np.int16)
+            if i == 0 and j == 0:
+                datos[: tamano // 4, : tamano // 4] = NODATA
+            mem = driver_mem.Create("", tamano, tamano, 1, gdal.GDT_Int16)
+            mem.SetGeoTransform((300_000 + j * tamano * 5.0, 5.0, 0, 6_300_000 - i * tamano * 5.0, 0, -5.0))
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(SRID)
+            mem.SetProjection(srs.ExportToWkt())
+            banda = mem.GetRasterBand(1)
+            banda.SetNoDataValue(NODATA)
+            banda.WriteArray(datos)
+            ruta = os.path.join(directorio, f"tesela_{i}_{j}{extension}")
+            driver.CreateCopy(ruta, mem, options=["TILED=YES"] if formato == "GTiff" else [])
+            rutas.append(ruta)
+    return rutas
+
+
+def leer_en_teselas(ruta, tamano=TESELA_CARGA):
+    """Lee todo el ráster en bloques tamano×tamano; devuelve el número de bloques leídos."""
+    ds = gdal.Open(ruta)
+    banda = ds.GetRasterBand(1)
+    bloques = 0
+    for yoff in range(0, ds.RasterYSize, tamano):
+        for xoff in range(0, ds.RasterXSize, tamano):
+            banda.ReadAsArray(xoff, yoff, min(tamano, ds.RasterXSize - xoff), min(tamano, ds.RasterYSize - yoff))
+            bloques += 1
+    return bloques
+
+
+def cargar_postgis(ruta, tabla, dsn):
+    url = urlparse(dsn)
+    env = os.environ.copy()
+    if url.password:
+        env["PGPASSWORD"] = url.password
+    comando = (f"raster2pgsql -d -s {SRID} -I -C -M -t {TESELA_CARGA}x{TESELA_CARGA} -N {NODATA} \"{ruta}\" {tabla}"
+               f" | psql -q -h {url.hostname} -p {url.port or 5432} -d {url.path.lstrip('/')}"
+               f" -U {url.username} -w -v ON_ERROR_STOP=1 > /dev/null")
+    subprocess.run(comando, shell=True, check=True, env=env)
+
+
+def borrar_tabla(tabla, dsn):
+    subprocess.run(["psql", dsn, "-q", "-c", f"DROP TABLE IF EXISTS {tabla};"], check=True)
+
+
+def diferencia_maxima(ruta, ruta_referencia):
+    a = gdal.Open(ruta).GetRasterBand(1).ReadAsArray().astype(np.float64)
+    b = gdal.Open(ruta_referencia).GetRasterBand(1).ReadAsArray().astype(np.float64)
+    validos = b != NODATA
+    return float(np.abs(a[validos] - b[validos]).max())
+
+
+def tamano_en_disco(ruta, rutas_fuente, modo):
+    # El modo vrt no escribe ráster: lo que se lee son las teselas fuente
+    rutas = rutas_fuente if modo == "vrt" else [ruta]
+    return sum(os.path.getsize(r) for r in rutas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de fusión de DEM: COG vs VRT vs JP2 Byte.")
+    parser.add_argument("--teselas", type=int, default=2, help="Teselas por lado (total = teselas²)")
+    parser.add_argument("--tamano", type=int, default=2048, help="Píxeles por lado de cada tesela")
+    parser.add_argument("--formato-fuente", choices=["GTiff", "JP2OpenJPEG"], default="GTiff",
+                        help="Formato de las teselas sintéticas (JP2OpenJPEG reproduce las fuentes del geoportal)")
+    parser.add_argument("--hilos", default="ALL_CPUS", help="GDAL_NUM_THREADS / NUM_THREADS")
+    parser.add_argument("--dsn", default=None, help="PostgreSQL/PostGIS desechable para medir raster2pgsql")
+    parser.add_argument("--modos", nargs="+", choices=MODOS_FUSION, default=list(MODOS_FUSION))
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    directorio = tempfile.mkdtemp(prefix="benchmark_fusion_")
+    try:
+        rutas = generar_teselas(directorio, args.teselas, args.tamano, args.formato_fuente)
+        referencia = fusionar(rutas, os.path.join(directorio, "referencia.vrt"), modo="vrt")
+        print(f"Benchmark con {len(rutas)} teselas de {args.tamano}×{args.tamano} ({args.formato_fuente}), "
+              f"carga: {'raster2pgsql → PostGIS' if args.dsn else 'lectura en teselas 256×256'}")
+        print(f"{'modo':<6} {'fusión':>10} {'carga':>10} {'MB':>10} {'dif. máx.':>10}")
+
+        for modo in args.modos:
+            ruta = os.path.join(directorio, f"fusion_{modo}{EXTENSIONES_FUSION[modo]}")
+            inicio = time.perf_counter()
+            fusionar(rutas, ruta, modo=modo, hilos=args.hilos)
+            segundos_fusion = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            if args.dsn:
+                tabla = f"public.benchmark_fusion_{modo}"
+                cargar_postgis(ruta, tabla, args.dsn)
+                segundos_carga = time.perf_counter() - inicio
+                borrar_tabla(tabla, args.dsn)
+            else:
+                leer_en_teselas(ruta)
+                segundos_carga = time.perf_counter() - inicio
+
+            megas = tamano_en_disco(ruta, rutas, modo) / 1e6
+            print(f"{modo:<6} {segundos_fusion:9.2f}s {segundos_carga:9.2f}s {megas:10.1f} "
+                  f"{diferencia_maxima(ruta, referencia):10.1f}")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Carga masiva en PostgreSQL/PostGIS con COPY ... FROM STDIN desde columnas NumPy.
+
+Reemplaza el flujo lista de dicts -> Point -> GeoDataFrame.to_postgis. La
+geometría se escribe como EWKB hexadecimal armado directamente desde los
+arrays x/y, o se construye en el servidor con ST_SetSRID(ST_MakePoint(x, y)).
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+# Punto 2D little-endian con SRID: orden de bytes, tipo (0x20000001), SRID, x, y
+EWKB_PUNTO = np.dtype([("orden", "u1"), ("tipo", "<u4"), ("srid", "<u4"), ("x", "<f8"), ("y", "<f8")])
+EWKB_TIPO_PUNTO_SRID = 0x20000001
+
+
+def ewkb_hex_puntos(xs, ys, srid):
+    """Array de strings EWKB hexadecimales (uno por punto), sin pasar por shapely."""
+    buffer = np.empty(len(xs), dtype=EWKB_PUNTO)
+    buffer["orden"] = 1
+    buffer["tipo"] = EWKB_TIPO_PUNTO_SRID
+    buffer["srid"] = srid
+    buffer["x"] = xs
+    buffer["y"] = ys
+    hexadecimal = buffer.tobytes().hex().upper().encode("ascii")
+    return np.frombuffer(hexadecimal, dtype=f"S{2 * EWKB_PUNTO.itemsize}").astype(str)
+
+
+def columnas_formato_largo(ids, uuids, clases, valores, xs, ys, anios, srid, geometria=True):
+    """
+    Expande n puntos y valores (años, n) a n * años filas con el esquema de
+    muestreo_humedales_giz (una fila por punto y año).
+    """
+    n_anios = len(anios)
+    columnas = {
+        "uuid_muestra": np.repeat(uuids, n_anios),
+        "id_pixel": np.repeat(ids, n_anios),
+        "year": np.tile(np.asarray(anios, dtype=np.int64), len(uuids)),
+        "clase_referencia": np.repeat(clases, n_anios),
+        "valor": np.asarray(valores).T.reshape(-1).astype(np.int64),
+        "x": np.repeat(xs, n_anios),
+        "y": np.repeat(ys, n_anios),
+    }
+    if geometria:
+        columnas["geometria"] = np.repeat(ewkb_hex_puntos(xs, ys, srid), n_anios)
+    return columnas
+
+
+def columnas_formato_compacto(ids, uuids, clases, valores, xs, ys, srid, geometria=True):
+    """
+    Una fila por punto: código de clase smallint y los valores anuales (años, n)
+    como literal de arreglo smallint[] ("{v1,v2,...}").
+    """
+    columnas = {
+        "uuid_muestra": uuids,
+        "id_pixel": ids,
+        "clase": np.asarray(clases, dtype=np.int16),
+        "valores": np.array(["{" + ",".join(map(str, fila)) + "}" for fila in np.asarray(valores).T.tolist()],
+                            dtype=object),
+        "x": xs,
+        "y": ys,
+    }
+    if geometria:
+        columnas["geometria"] = ewkb_hex_puntos(xs, ys, srid)
+    return columnas
+
+
+def columnas_muestreo(formato, ids, uuids, clases, valores, xs, ys, anios, srid, nombres_clase, geometria=True):
+    """Columnas para COPY según el formato de salida ("largo" o "compacto"); `clases` son códigos."""
+    if formato == "compacto":
+        return columnas_formato_compacto(ids, uuids, clases, valores, xs, ys, srid, geometria)
+    return columnas_formato_largo(ids, uuids, nombres_clase[clases], valores, xs, ys, anios, srid, geometria)
+
+
+def buffer_csv(columnas):
+    """Serializa un dict ordenado {columna: array} a CSV en memoria; devuelve (buffer, filas)."""
+    df = pd.DataFrame(columnas, copy=False)
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer, len(df)
+
+
+def copiar_columnas(conexion, tabla, columnas, confirmar=True):
+    """COPY en formato CSV de las columnas en `tabla`; devuelve filas copiadas."""
+    buffer, filas = buffer_csv(columnas)
+    with conexion.cursor() as cursor:
+        cursor.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    if confirmar:
+        conexion.commit()
+    return filas
+
+
+def copiar_puntos_servidor(conexion, tabla, columnas, srid, columna_geometria="geometria", confirmar=True):
+    """
+    COPY de las columnas (incluidas x e y) a una tabla temporal y luego
+    INSERT ... SELECT armando la geometría con ST_SetSRID(ST_MakePoint(x, y)).
+    """
+    nombres = ", ".join(columnas)
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS _copy_puntos ON COMMIT DROP AS
+            SELECT {nombres} FROM {tabla} WITH NO DATA;
+        """)
+        buffer, filas = buffer_csv(columnas)
+        cursor.copy_expert(f"COPY _copy_puntos ({nombres}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"""
+            INSERT INTO {tabla} ({nombres}, {columna_geometria})
+            SELECT {nombres}, ST_SetSRID(ST_MakePoint(x, y), {srid}) FROM _copy_puntos;
+            DROP TABLE _copy_puntos;
+        """)
+    if confirmar:
+        conexion.commit()
+    return filas
+
+
+def copiar_muestras(conexion, tabla, columnas, srid, metodo_geometria="ewkb", confirmar=True):
+    """
+    Inserta columnas de muestreo con la geometría en EWKB ("ewkb") o armada en el
+    servidor ("servidor"). Con confirmar=False el commit queda a cargo del llamador.
+    """
+    if metodo_geometria == "ewkb":
+        return copiar_columnas(conexion, tabla, columnas, confirmar)
+    return copiar_puntos_servidor(conexion, tabla, columnas, srid, confirmar=confirmar)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Carga de rásteres a PostGIS sin raster2pgsql: teselas WKB por COPY en paralelo.
+
+Un pool de procesos corta y serializa teselas por franjas, varios hilos las
+cargan con COPY y al final se replica `raster2pgsql -I -C -M -F -N <nodata>`.
+El rid es la posición de la tesela en orden fila-columna sobre todo el ráster:
+las teselas sin datos se omiten y dejan huecos en la numeración (raster2pgsql
+numera seguido). Con `extension_valores` se carga también la huella de los
+píxeles con datos en raster_valued_extent.
+"""
+
+import io
+import multiprocessing as mp
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio import features
+from rasterio.windows import Window
+from shapely.geometry import MultiPolygon, Polygon, shape
+
+# Tipos de píxel del formato WKB de PostGIS raster
+TIPOS_PIXEL = {
+    np.dtype("int8"): 3, np.dtype("uint8"): 4, np.dtype("int16"): 5, np.dtype("uint16"): 6,
+    np.dtype("int32"): 7, np.dtype("uint32"): 8, np.dtype("float32"): 10, np.dtype("float64"): 11,
+}
+TIENE_NODATA = 0x40
+
+# Estado de cada proceso trabajador, fijado por _iniciar_trabajador
+_src = None
+_config = None
+
+
+def valor_nodata(dtype, nodata):
+    """Nodata representable en `dtype` (los enteros fuera de rango se recortan, como raster2pgsql)."""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        nodata = min(max(nodata, info.min), info.max)
+    return np.array(nodata, dtype=dtype)
+
+
+def tesela_wkb(datos, nodatas, transform, col_off, row_off, srid):
+    """WKB (little endian) de una tesela (bandas, alto, ancho) con su esquina en (row_off, col_off)."""
+    n_bandas, alto, ancho = datos.shape
+    ip_x = transform.c + col_off * transform.a + row_off * transform.b
+    ip_y = transform.f + col_off * transform.d + row_off * transform.e
+    partes = [struct.pack("<BHHddddddiHH", 1, 0, n_bandas, transform.a, transform.e, ip_x, ip_y,
+                          transform.b, transform.d, srid, ancho, alto)]
+    for banda, nodata in zip(datos, nodatas):
+        dtype = banda.dtype.newbyteorder("<")
+        partes.append(struct.pack("<B", TIPOS_PIXEL[dtype] | TIENE_NODATA))
+        partes.append(nodata.astype(dtype).tobytes())
+        partes.append(np.ascontiguousarray(banda, dtype=dtype).tobytes())
+    return b"".join(partes)
+
+
+def mascara_valores(datos, nodatas):
+    """Píxeles (alto, ancho) con dato en al menos una banda."""
+    validos = np.zeros(datos.shape[1:], dtype=bool)
+    for banda, nodata in zip(datos, nodatas):
+        # NaN != NaN: con nodata NaN hay que buscar los píxeles que no lo son
+        validos |= ~np.isnan(banda) if np.isnan(nodata) else banda != nodata
+    return validos
+
+
+def extension_valores(validos, transform, srid, tolerancia=0.0):
+    """EWKB hex (MULTIPOLYGON) de los píxeles válidos de una tesela con su `transform`, o None si no hay."""
+    if not validos.any():
+        return None
+    alto, ancho = validos.shape
+    if validos.all():
+        geometria = Polygon([transform * (0, 0), transform * (ancho, 0), transform * (ancho, alto), transform * (0, alto)])
+    else:
+        partes = [shape(g) for g, _ in features.shapes(validos.astype(np.uint8), mask=validos, transform=transform)]
+        geometria = shapely.union_all(partes)
+        if tolerancia:
+            geometria = geometria.simplify(tolerancia, preserve_topology=True)
+    if isinstance(geometria, Polygon):
+        geometria = MultiPolygon([geometria])
+    return shapely.to_wkb(shapely.set_srid(geometria, srid), hex=True, include_srid=True)
+
+
+def extension_valores_sql(columna="rast"):
+    """
+    Equivalente en el servidor de `extension_valores` (banda 1, tolerancia de un
+    píxel) para tablas cargadas con raster2pgsql.
+    """
+    return f"ST_Multi(ST_SimplifyPreserveTopology(ST_Polygon({columna}, 1), ST_PixelWidth({columna})))"
+
+
+def tesela_vacia_sql(columna="rast"):
+    """Condición de las teselas sin datos, que cargar_raster omite y raster2pgsql conserva."""
+    return f"ST_BandIsNoData({columna}, 1, TRUE)"
+
+
+def _iniciar_trabajador(ruta, config):
+    global _src, _config
+    _src = rasterio.open(ruta)
+    _config = config
+
+
+def _procesar_franja(row_off):
+    """
+    Filas COPY 'rid\\twkb_hex\\tfilename[\\textension]' de una franja de teselas;
+    devuelve (texto, cargadas, vacías).
+    """
+    tamano, srid = _config["tamano_tesela"], _config["srid"]
+    width, height = _src.width, _src.height
+    alto = min(tamano, height - row_off)
+    datos = _src.read(window=Window(0, row_off, width, alto))
+    nodatas = [valor_nodata(datos.dtype, nd if nd is not None else _config["nodata_defecto"])
+               for nd in _src.nodatavals]
+    teselas_por_fila = -(-width // tamano)
+    primer_rid = (row_off // tamano) * teselas_por_fila + 1
+
+    tolerancia = _config["simplificar"] * abs(_src.transform.a)
+    filas, vacias = [], 0
+    for j, col_off in enumerate(range(0, width, tamano)):
+        tesela = datos[:, :, col_off:col_off + tamano]
+        validos = mascara_valores(tesela, nodatas)
+        if not _config["conservar_vacias"] and not validos.any():
+            vacias += 1
+            continue
+        wkb = tesela_wkb(tesela, nodatas, _src.transform, col_off, row_off, srid)
+        fila = f"{primer_rid + j}\t{wkb.hex()}\t{_config['filename']}"
+        if _config["extension_valores"]:
+            transform = _src.transform * rasterio.Affine.translation(col_off, row_off)
+            fila += "\t" + (extension_valores(validos, transform, srid, tolerancia) or "\\N")
+        filas.append(fila + "\n")
+    return "".join(filas), len(filas), vacias
+
+
+def crear_tabla_raster(conexion, tabla, srid=None, extension_valores=False):
+    """Tabla nueva (rid, rast, filename) como `raster2pgsql -d -F`, más raster_valued_extent si se pide."""
+    extension = f", raster_valued_extent geometry(MULTIPOLYGON, {srid})" if extension_valores else ""
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {tabla};
+            CREATE TABLE {tabla} (rid SERIAL PRIMARY KEY, rast RASTER, filename TEXT{extension});
+        """)
+    conexion.commit()
+
+
+def finalizar_tabla_raster(conexion, tabla, indice=True, restricciones=True, vacuum=True):
+    """Secuencia de rid, índice GiST (-I), restricciones (-C) y VACUUM ANALYZE (-M)."""
+    esquema, _, nombre = tabla.rpartition(".")
+    with conexion.cursor() as cursor:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{tabla}', 'rid'), "
+                       f"COALESCE((SELECT max(rid) FROM {tabla}), 1));")
+        if indice:
+            cursor.execute(f"CREATE INDEX ON {tabla} USING GIST (ST_ConvexHull(rast));")
+        if restricciones:
+            cursor.execute("SELECT AddRasterConstraints(%s, %s, 'rast', TRUE, TRUE, TRUE, TRUE, TRUE, TRUE, "
+                           "FALSE, TRUE, TRUE, TRUE, TRUE, TRUE);", (esquema or "public", nombre))
+    conexion.commit()
+    if vacuum:
+        autocommit = conexion.autocommit
+        conexion.autocommit = True
+        try:
+            with conexion.cursor() as cursor:
+                cursor.execute(f"VACUUM ANALYZE {tabla};")
+        finally:
+            conexion.autocommit = autocommit
+
+
+def _escribir_copias(cola, conectar, tabla, columnas, resultados):
+    """Hilo escritor: COPY de cada bloque de la cola hasta recibir None; confirma al final."""
+    conexion, error, filas = None, None, 0
+    try:
+        conexion = conectar()
+        while True:
+            bloque = cola.get()
+            if bloque is None:
+                break
+            if error is not None:
+                continue  # seguir vaciando para no bloquear al productor
+            try:
+                with conexion.cursor() as cursor:
+                    cursor.copy_expert(f"COPY {tabla} ({columnas}) FROM STDIN", io.StringIO(bloque))
+                filas += bloque.count("\n")
+            except Exception as e:
+                error = e
+        if error is None:
+            conexion.commit()
+    except Exception as e:
+        error = e
+    finally:
+        if conexion is not None:
+            conexion.close()
+        resultados.append((filas, error))
+
+
+def cargar_raster(ruta, tabla, conectar, srid, tamano_tesela=256, nodata_defecto=-9999, workers=4,
+                  conexiones=4, conservar_vacias=False, extension_valores=False, simplificar=1.0, indice=True,
+                  restricciones=True, vacuum=True, intervalo_progreso=10.0):
+    """
+    Carga `ruta` en `tabla` (que se recrea) con `conexiones` COPY simultáneos.
+    `conectar()` devuelve una conexión psycopg2 nueva. Con `extension_valores`
+    se carga la huella de los píxeles con datos, simplificada con una
+    tolerancia de `simplificar` píxeles (0 = sin simplificar). Devuelve un
+    dict con teselas cargadas, vacías omitidas, segundos y teselas por segundo.
+    """
+    with rasterio.open(ruta) as src:
+        height = src.height
+    conexion = conectar()
+    try:
+        crear_tabla_raster(conexion, tabla, srid, extension_valores)
+    finally:
+        conexion.close()
+
+    config = {"tamano_tesela": tamano_tesela, "srid": srid, "nodata_defecto": nodata_defecto,
+              "conservar_vacias": conservar_vacias, "filename": os.path.basename(ruta),
+              "extension_valores": extension_valores, "simplificar": simplificar}
+    columnas = "rid, rast, filename" + (", raster_valued_extent" if extension_valores else "")
+    cola = queue.Queue(maxsize=2 * conexiones)
+    resultados = []
+    inicio = ultimo_reporte = time.perf_counter()
+    cargadas = vacias = 0
+    try:
+        # El pool se crea antes que los hilos escritores para no bifurcar con conexiones abiertas
+        with mp.get_context("fork").Pool(workers, initializer=_iniciar_trabajador, initargs=(ruta, config)) as pool:
+            escritores = [threading.Thread(target=_escribir_copias,
+                                           args=(cola, conectar, tabla, columnas, resultados))
+                          for _ in range(conexiones)]
+            for escritor in escritores:
+                escritor.start()
+            try:
+                for texto, n, n_vacias in pool.imap(_procesar_franja, range(0, height, tamano_tesela)):
+                    if n:
+                        cola.put(texto)
+                    cargadas += n
+                    vacias += n_vacias
+                    ahora = time.perf_counter()
+                    if ahora - ultimo_reporte >= intervalo_progreso:
+                        print(f"Teselas enviadas: {cargadas:,} ({cargadas / (ahora - inicio):,.0f} teselas/s)")
+                        ultimo_reporte = ahora
+            finally:
+                for _ in escritores:
+                    cola.put(None)
+                for escritor in escritores:
+                    escritor.join()
+
+        errores = [error for _, error in resultados if error is not None]
+        if errores:
+            raise RuntimeError(f"Fallaron {len(errores)} conexión(es) COPY cargando {tabla}: {errores[0]}")
+    except BaseException:
+        # Cada escritor confirma por su cuenta: si uno falla, los demás ya confirmaron y, con los huecos de
+        # rid por diseño, una tabla a medias no se distinguiría de una completa; se borra.
+        conexion = conectar()
+        try:
+            with conexion.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {tabla};")
+            conexion.commit()
+        finally:
+            conexion.close()
+        raise
+    segundos = time.perf_counter() - inicio
+
+    conexion = conectar()
+    try:
+        finalizar_tabla_raster(conexion, tabla, indice, restricciones, vacuum)
+    finally:
+        conexion.close()
+    print(f"Ráster cargado en {tabla}: {cargadas:,} teselas ({vacias:,} vacías omitidas) "
+          f"en {segundos:,.1f} s, {cargadas / segundos if segundos else 0:,.0f} teselas/s")
+    return {"teselas": cargadas, "vacias": vacias, "segundos": segundos,
+            "teselas_por_segundo": cargadas / segundos if segundos else 0.0}
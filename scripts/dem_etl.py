@@ -4,10 +4,21 @@ import subprocess
 from urllib.parse import urlparse
 import psycopg2
 from dotenv import dotenv_values
+from asignacion_comunas import asignar_comunas
+from carga_raster import cargar_raster, extension_valores_sql, tesela_vacia_sql
+from resumen_dem import crear_overviews, actualizar_resumen
+from instrumentacion import crear_instrumentacion
 
 # Cargar configuración del entorno
 config = dotenv_values("/home/dps_chanar/.env")
 
+TABLE_NAME = "medio_fisico.dem_antofagasta"
+# Carga a PostGIS: "python" (carga_raster.py, como dem_multi_etl.py) o "raster2pgsql" (tubería anterior).
+# Con las dos, raster_valued_extent es la huella de los píxeles con datos y no quedan teselas vacías.
+RASTER_LOADER = "python"
+LOAD_WORKERS = 4
+LOAD_CONNECTIONS = 4
+
 def download_file(url, destination):
     print(f"Descargando archivo desde {url}...")
     response = requests.get(url, stream=True)
@@ -51,8 +62,20 @@ def run_raster2pgsql(jp2_path):
     subprocess.run(raster2pgsql_cmd, shell=True, check=True, env=env)
     print("Comando ejecutado exitosamente, verifique la base de datos para confirmar la creación de la tabla.")
 
+def connect():
+    return psycopg2.connect(dbname=config['DB_NAME_P'], user=config['DB_USER_P'], password=config['DB_PASSWORD_P'], host=config['DB_HOST_P'])
+
+def load_raster(jp2_path):
+    """Equivale a run_raster2pgsql (-s 32719 -I -C -M -F -t 256x256 -N -9999) con COPY en paralelo."""
+    if RASTER_LOADER == "raster2pgsql":
+        run_raster2pgsql(jp2_path)
+        return None
+    stats = cargar_raster(jp2_path, TABLE_NAME, connect, srid=32719, tamano_tesela=256, nodata_defecto=-9999,
+                          workers=LOAD_WORKERS, conexiones=LOAD_CONNECTIONS, extension_valores=True)
+    return stats["teselas"]
+
 def update_table_with_geometries():
-    connection = psycopg2.connect(dbname=config['DB_NAME_P'], user=config['DB_USER_P'], password=config['DB_PASSWORD_P'], host=config['DB_HOST_P'])
+    connection = connect()
     try:
         with connection.cursor() as cursor:
             # RENAME, ADD COLUMN, and UPDATE operations with commits after each significant step.
@@ -65,35 +88,28 @@ def update_table_with_geometries():
             cursor.execute("""
                 ALTER TABLE medio_fisico.dem_antofagasta ADD COLUMN id_comuna INTEGER;
                 ALTER TABLE medio_fisico.dem_antofagasta ADD COLUMN tile_extent geometry(POLYGON, 32719);
-                ALTER TABLE medio_fisico.dem_antofagasta ADD COLUMN raster_valued_extent geometry(MULTIPOLYGON, 32719);
+                ALTER TABLE medio_fisico.dem_antofagasta ADD COLUMN IF NOT EXISTS raster_valued_extent geometry(MULTIPOLYGON, 32719);
             """)
             connection.commit()
             print("Columns added successfully.")
 
-            cursor.execute("""
+            # raster2pgsql conserva las teselas sin datos y no trae la huella de los píxeles válidos
+            cursor.execute(f"DELETE FROM medio_fisico.dem_antofagasta WHERE {tesela_vacia_sql('geometria_raster')};")
+            cursor.execute(f"""
                 UPDATE medio_fisico.dem_antofagasta
                 SET
                     tile_extent = ST_ConvexHull(geometria_raster),
-                    raster_valued_extent = ST_Multi(ST_Envelope(geometria_raster));
+                    raster_valued_extent = COALESCE(raster_valued_extent, {extension_valores_sql('geometria_raster')});
             """)
             connection.commit()
             print("Geometry columns updated successfully.")
 
-            cursor.execute("""
-                UPDATE medio_fisico.dem_antofagasta
-                SET id_comuna = (
-                    SELECT c.objectid
-                    FROM datos_maestros.dpa_comuna_subdere c
-                    WHERE ST_Intersects(ST_Transform(c.geometria, 32719), ST_ConvexHull(ST_Transform(geometria_raster, 32719)))
-                    ORDER BY ST_Area(ST_Intersection(ST_Transform(c.geometria, 32719), ST_ConvexHull(ST_Transform(geometria_raster, 32719)))) DESC
-                    LIMIT 1
-                );
-            """)
-            connection.commit()
+            asignar_comunas(connection, "medio_fisico.dem_antofagasta", "raster_valued_extent")
             print("id_comuna updated successfully.")
     except psycopg2.Error as e:
         print(f"Error during database operation: {e}")
         connection.rollback()
+        raise
     finally:
         connection.close()
         print("Database connection closed.")
@@ -104,14 +120,29 @@ def main():
     directory = "/home/dps_chanar/etl_raster"
     rar_path = os.path.join(directory, rar_filename)
     os.makedirs(directory, exist_ok=True)
+    metrics = crear_instrumentacion("dem_etl")
     try:
-        download_file(rar_url, rar_path)
+        with metrics.etapa("descarga"):
+            download_file(rar_url, rar_path)
         rar_path = ensure_rar_extension(rar_path)
-        jp2_path = extract_jp2_with_7z(rar_path, directory)
-        run_raster2pgsql(jp2_path)
-        update_table_with_geometries()
+        with metrics.etapa("extraccion"):
+            jp2_path = extract_jp2_with_7z(rar_path, directory)
+        with metrics.etapa("carga") as record:
+            record["filas"] = load_raster(jp2_path)
+        with metrics.etapa("finalizacion"):
+            update_table_with_geometries()
+        with metrics.etapa("overviews"):
+            crear_overviews(connect, "medio_fisico.dem_antofagasta")
+        with metrics.etapa("resumen") as record:
+            connection = connect()
+            try:
+                record["filas"] = actualizar_resumen(connection, "medio_fisico.dem_antofagasta")
+            finally:
+                connection.close()
     except Exception as e:
         print(f"El proceso falló: {e}")
+    finally:
+        metrics.cerrar()
 
 if __name__ == "__main__":
     main()
@@ -1,147 +1,238 @@
 import os
-import requests
-from osgeo import gdal
+import time
 import subprocess
 from urllib.parse import urlparse
 import psycopg2
 from dotenv import dotenv_values
+from descargas import crear_sesion, Manifiesto, NOMBRE_MANIFIESTO, descargar_reanudando
+from etapas_etl import ejecutar_etapas, resumen_tiempos
+from extraccion_archivos import extraer_rasters, existe_ruta
+from fusion_dem import fusionar, EXTENSIONES_FUSION
+from carga_raster import cargar_raster, extension_valores_sql, tesela_vacia_sql
+from asignacion_comunas import asignar_comunas
+from finalizacion_dem import finalizar_tabla_dem
+from resumen_dem import crear_overviews, actualizar_resumen
+from instrumentacion import crear_instrumentacion
 
 # Cargar configuración del entorno
 config = dotenv_values("/home/dps_chanar/.env")
 
-def download_file(url, destination):
-    print(f"Descargando archivo desde {url}...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    with open(destination, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
-    print(f"Archivo descargado y guardado en {destination}")
-
-def ensure_rar_extension(rar_path):
-    if not os.path.exists(rar_path):
-        return rar_path
-    if not rar_path.endswith('.rar'):
-        rar_path_with_extension = rar_path + '.rar'
-        os.rename(rar_path, rar_path_with_extension)
-        print(f"Renombrado a {rar_path_with_extension}")
-        return rar_path_with_extension
-    return rar_path
+# Hilos por etapa del pipeline descarga → extracción → fusión → carga → finalización → overviews → resumen
+# (geometrías → comunas en vez de finalización con FINALIZE_MODE = "update")
+STAGE_LIMITS = {"descarga": 3, "extraccion": 2, "fusion": 1, "carga": 2, "finalizacion": 1, "geometrias": 1, "comunas": 1,
+                "overviews": 1, "resumen": 1}
+# Archivos RAR anidados extraídos en paralelo dentro de cada región
+EXTRACT_WORKERS = 4
+# Leer los JP2 directamente desde el archivo (GDAL /vsi) en vez de extraerlos
+READ_FROM_ARCHIVE = True
+# Salida de merge_rasters: "cog", "vrt" o "jp2" (ver fusion_dem.py)
+MERGE_MODE = "cog"
+# Carga a PostGIS: "python" (carga_raster.py, COPY en paralelo) o "raster2pgsql" (tubería anterior)
+RASTER_LOADER = "python"
+LOAD_WORKERS = 4
+LOAD_CONNECTIONS = 4
+# "ctas": carga en {tabla}_carga y una sola reescritura con CREATE TABLE AS (finalizacion_dem.py);
+# "update": ALTER + UPDATE sobre la tabla cargada (modo anterior)
+FINALIZE_MODE = "ctas"
+# Overviews o_<factor>_<tabla> creados en paralelo tras la carga (ver resumen_dem.py); () los desactiva
+OVERVIEW_FACTORS = (4, 16, 64)
+
+def rar_destination(url, directory):
+    rar_filename = os.path.basename(urlparse(url).path)
+    if not rar_filename.endswith('.rar'):
+        rar_filename += '.rar'
+    return os.path.join(directory, rar_filename)
 
 def extract_all_rars(rar_path, extract_to):
-    print(f"Extrayendo archivos desde {rar_path} en {extract_to} con 7z...")
-    jp2_paths = []
-    
-    # Listar contenido del archivo RAR
-    list_cmd = ['7z', 'l', rar_path]
-    result = subprocess.run(list_cmd, capture_output=True, text=True, check=True)
-    
-    # Identificar y manejar RARs internos y archivos JP2
-    for line in result.stdout.splitlines():
-        if line.strip().endswith('.rar'):
-            inner_rar = line.split()[-1]
-            inner_rar_path = os.path.join(extract_to, inner_rar)
-            extract_cmd = ['7z', 'x', rar_path, f'-o{extract_to}', inner_rar]
-            subprocess.run(extract_cmd, check=True)
-            jp2_paths.extend(extract_all_rars(inner_rar_path, extract_to))  # Llamada recursiva
-        elif line.strip().endswith('.jp2'):
-            jp2_filename = line.split()[-1]
-            extract_cmd = ['7z', 'x', rar_path, f'-o{extract_to}', jp2_filename]
-            subprocess.run(extract_cmd, check=True)
-            jp2_paths.append(os.path.join(extract_to, jp2_filename))
-    
-    return jp2_paths
-
-def merge_rasters(raster_paths, output_path):
-    print(f"Fusionando rásteres en {output_path}...")
-
-    # Abrir los rásteres y crear una lista de ellos
-    rasters = [gdal.Open(raster_path) for raster_path in raster_paths]
-
-    # Configurar opciones para la fusión
-    vrt_options = gdal.BuildVRTOptions(resampleAlg='nearest', addAlpha=False)
-    vrt = gdal.BuildVRT('/vsimem/merged.vrt', [r.GetDescription() for r in rasters], options=vrt_options)
-
-    # Configurar opciones para la escritura final del ráster fusionado
-    translate_options = gdal.TranslateOptions(format='JP2OpenJPEG', outputType=gdal.GDT_Byte)
-    gdal.Translate(output_path, vrt, options=translate_options)
-
-    # Limpiar recursos
-    vrt = None
-    for r in rasters:
-        r = None
+    # Un listado (7z l -slt) y una extracción por archivo; los JP2 se leen vía /vsirar/ si GDAL lo soporta
+    return extraer_rasters(rar_path, extract_to, extension='.jp2', workers=EXTRACT_WORKERS, usar_vsi=READ_FROM_ARCHIVE)
 
+def merge_rasters(raster_paths, output_path, mode=None):
+    # cog: GeoTIFF teselado sin pérdida con overviews; vrt: sin archivo intermedio; jp2: salida Byte anterior
+    mode = mode or MERGE_MODE
+    print(f"Fusionando rásteres en {output_path} (modo {mode})...")
+    fusionar(raster_paths, output_path, modo=mode)
     print(f"Fusión completada: {output_path}")
     return output_path
 
-def run_raster2pgsql(jp2_path, table_name):
-    raster2pgsql_cmd = f"raster2pgsql -s 32719 -I -C -M -F -t 256x256 -N -9999 \"{jp2_path}\" {table_name} | psql -h {config['DB_HOST']} -d {config['DB_NAME']} -U {config['DB_USER']} -w"
+def run_raster2pgsql(raster_path, table_name):
+    raster2pgsql_cmd = f"raster2pgsql -d -s 32719 -I -C -M -F -t 256x256 -N -9999 \"{raster_path}\" {table_name} | psql -h {config['DB_HOST']} -d {config['DB_NAME']} -U {config['DB_USER']} -w"
     env = os.environ.copy()
     env['PGPASSWORD'] = config['DB_PASSWORD']
     print(f"Ejecutando comando: {raster2pgsql_cmd}")
     subprocess.run(raster2pgsql_cmd, shell=True, check=True, env=env)
     print(f"Ráster cargado en la tabla {table_name}.")
 
+def connect():
+    return psycopg2.connect(dbname=config['DB_NAME'], user=config['DB_USER'], password=config['DB_PASSWORD'], host=config['DB_HOST'])
+
+def staging_table(table_name):
+    return f"{table_name}_carga"
+
+def load_raster(raster_path, table_name, final=True):
+    """
+    Equivale a run_raster2pgsql (-d -s 32719 -I -C -M -F -t 256x256 -N -9999) con COPY en paralelo.
+    Con final=False la tabla es de paso: sin índice, restricciones ni VACUUM.
+    """
+    if RASTER_LOADER == "raster2pgsql":
+        run_raster2pgsql(raster_path, table_name)
+        return {}
+    stats = cargar_raster(raster_path, table_name, connect, srid=32719, tamano_tesela=256, nodata_defecto=-9999,
+                          workers=LOAD_WORKERS, conexiones=LOAD_CONNECTIONS,
+                          extension_valores=True, indice=final, restricciones=final, vacuum=final)
+    return {"teselas": stats["teselas"]}
+
 def update_table_with_geometries(table_name):
-    connection = psycopg2.connect(dbname=config['DB_NAME'], user=config['DB_USER'], password=config['DB_PASSWORD'], host=config['DB_HOST'])
+    start = time.perf_counter()
+    connection = connect()
     try:
         with connection.cursor() as cursor:
             cursor.execute(f"""
                 ALTER TABLE {table_name} RENAME COLUMN rast TO geometria_raster;
                 ALTER TABLE {table_name} ADD COLUMN id_comuna INTEGER;
                 ALTER TABLE {table_name} ADD COLUMN tile_extent geometry(POLYGON, 32719);
-                ALTER TABLE {table_name} ADD COLUMN raster_valued_extent geometry(MULTIPOLYGON, 32719);
+                ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS raster_valued_extent geometry(MULTIPOLYGON, 32719);
             """)
             connection.commit()
             print(f"Columnas agregadas exitosamente en {table_name}.")
 
+            # Con raster2pgsql quedan teselas sin datos y falta la huella de los píxeles válidos
+            cursor.execute(f"DELETE FROM {table_name} WHERE {tesela_vacia_sql('geometria_raster')};")
             cursor.execute(f"""
                 UPDATE {table_name}
                 SET
                     tile_extent = ST_ConvexHull(geometria_raster),
-                    raster_valued_extent = ST_Multi(ST_ConvexHull(geometria_raster));
+                    raster_valued_extent = COALESCE(raster_valued_extent, {extension_valores_sql('geometria_raster')});
             """)
             connection.commit()
             print(f"Columnas de geometría actualizadas exitosamente en {table_name}.")
             
             cursor.execute(f"""
-                CREATE INDEX IF NOT EXISTS idx_{table_name}_raster_valued_extent ON {table_name} USING GIST (raster_valued_extent);
+                CREATE INDEX IF NOT EXISTS idx_{table_name.split('.')[-1]}_raster_valued_extent ON {table_name} USING GIST (raster_valued_extent);
             """)
             connection.commit()
             print(f"Índice GIST agregado exitosamente en {table_name}.")
-            
-            cursor.execute(f"""
-                WITH intersections AS (
-                    SELECT a.rid, c.objectid,
-                           ST_Intersection(ST_Transform(c.geometria, 32719), a.raster_valued_extent) AS intersection
-                    FROM {table_name} a
-                    JOIN datos_maestros.dpa_comuna_subdere c
-                    ON ST_Intersects(ST_Transform(c.geometria, 32719), a.raster_valued_extent)
-                    WHERE ST_Area(ST_Intersection(ST_Transform(c.geometria, 32719), a.raster_valued_extent)) IS NOT NULL
-                )
-                UPDATE {table_name} a
-                SET id_comuna = (
-                    SELECT i.objectid
-                    FROM intersections i
-                    WHERE i.rid = a.rid
-                    ORDER BY ST_Area(i.intersection) DESC
-                    LIMIT 1
-                )
-                WHERE EXISTS (
-                    SELECT 1
-                    FROM intersections i
-                    WHERE i.rid = a.rid
-                );
-            """)
-            connection.commit()
-            print(f"id_comuna actualizado exitosamente en {table_name}.")
+            print(f"[finalización] {table_name} (modo update, sin comunas) en {time.perf_counter() - start:,.1f} s")
     except psycopg2.Error as e:
         print(f"Error durante la operación en la base de datos: {e}")
         connection.rollback()
+        raise
     finally:
         connection.close()
         print("Conexión a la base de datos cerrada.")
 
+def assign_comunas(table_name):
+    connection = connect()
+    try:
+        asignar_comunas(connection, table_name, "raster_valued_extent")
+    except psycopg2.Error as e:
+        print(f"Error durante la asignación de comunas: {e}")
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def finalize_table(table_name):
+    connection = connect()
+    try:
+        finalizar_tabla_dem(connection, staging_table(table_name), table_name, srid=32719,
+                            extension_cargada=RASTER_LOADER == "python")
+    except psycopg2.Error as e:
+        print(f"Error durante la finalización de {table_name}: {e}")
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def build_overviews(table_name):
+    if not OVERVIEW_FACTORS:
+        return {"overviews": []}
+    return {"overviews": crear_overviews(connect, table_name, OVERVIEW_FACTORS)}
+
+def refresh_summary(table_name):
+    # Sólo se recalculan las filas de esta región en medio_fisico.dem_resumen_comunas
+    connection = connect()
+    try:
+        return {"comunas_resumidas": actualizar_resumen(connection, table_name)}
+    except psycopg2.Error as e:
+        print(f"Error actualizando el resumen de {table_name}: {e}")
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def instrumented(metrics, name, function, rows_key=None):
+    # Métricas por región y etapa (pared, CPU, RSS, bytes y filas/s); rows_key toma las filas del resultado
+    def run(job):
+        with metrics.etapa(name, region=job["table"]) as record:
+            result = function(job)
+            if rows_key:
+                record["filas"] = (result or {}).get(rows_key)
+        return result
+    return run
+
+def build_stages(directory, metrics):
+    session = crear_sesion(STAGE_LIMITS["descarga"])
+    manifest = Manifiesto(os.path.join(directory, NOMBRE_MANIFIESTO))
+
+    def download(job):
+        # Siempre se consulta: el manifiesto omite la descarga si el archivo no cambió
+        rar_path = descargar_reanudando(job["url"], rar_destination(job["url"], directory), session, manifest)
+        return {"rar_path": rar_path, "sha256": manifest.obtener(job["url"]).get("sha256")}
+
+    def extract(job):
+        return {"jp2_paths": extract_all_rars(job["rar_path"], directory)}
+
+    def merge(job):
+        if job["merge"]:
+            merged_raster_path = os.path.join(directory, f"{job['table']}_merged{EXTENSIONES_FUSION[MERGE_MODE]}")
+            return {"raster_path": merge_rasters(job["jp2_paths"], merged_raster_path)}
+        return {"raster_path": job["jp2_paths"][0]}  # Asumimos que solo hay un archivo JP2 por tabla
+
+    def load(job):
+        if FINALIZE_MODE == "ctas":
+            return load_raster(job["raster_path"], staging_table(job["table"]), final=False)
+        return load_raster(job["raster_path"], job["table"])
+
+    def finalize(job):
+        finalize_table(job["table"])
+
+    def geometries(job):
+        update_table_with_geometries(job["table"])
+
+    def comunas(job):
+        assign_comunas(job["table"])
+
+    def overviews(job):
+        return build_overviews(job["table"])
+
+    def summary(job):
+        return refresh_summary(job["table"])
+
+    stages = [
+        {"nombre": "descarga", "funcion": download, "siempre": True},
+        {"nombre": "extraccion", "funcion": extract, "vigente": lambda job: all(map(existe_ruta, job["jp2_paths"]))},
+        {"nombre": "fusion", "funcion": merge, "vigente": lambda job: "raster_path" in job and existe_ruta(job["raster_path"])},
+        {"nombre": "carga", "funcion": load},
+    ]
+    if FINALIZE_MODE == "ctas":
+        stages.append({"nombre": "finalizacion", "funcion": finalize})
+    else:
+        stages += [
+            {"nombre": "geometrias", "funcion": geometries},
+            {"nombre": "comunas", "funcion": comunas},
+        ]
+    # Se rehacen sólo si una etapa anterior de la región dio un resultado nuevo (región recargada)
+    stages += [
+        {"nombre": "overviews", "funcion": overviews},
+        {"nombre": "resumen", "funcion": summary},
+    ]
+    for stage in stages:
+        stage["concurrencia"] = STAGE_LIMITS[stage["nombre"]]
+        stage["funcion"] = instrumented(metrics, stage["nombre"], stage["funcion"],
+                                        rows_key={"carga": "teselas", "resumen": "comunas_resumidas"}.get(stage["nombre"]))
+    return stages
+
 def main():
     # Configuración de URLs y nombres de tablas
     raster_configs = [
@@ -151,32 +242,15 @@ def main():
     ]
     directory = "/home/dps_chanar/etl_raster"
     os.makedirs(directory, exist_ok=True)
-    
-    for raster_config in raster_configs:
-        try:
-            rar_url = raster_config["url"]
-            table_name = raster_config["table"]
-            merge_required = raster_config["merge"]
-            rar_filename = os.path.basename(urlparse(rar_url).path)
-            rar_path = os.path.join(directory, rar_filename)
-            
-            # Proceso de descarga y descompresión
-            download_file(rar_url, rar_path)
-            rar_path = ensure_rar_extension(rar_path)
-            jp2_paths = extract_all_rars(rar_path, directory)
-            
-            # Fusión de rásteres si es necesario
-            if merge_required:
-                merged_raster_path = os.path.join(directory, f"{table_name}_merged.jp2")
-                jp2_path = merge_rasters(jp2_paths, merged_raster_path)
-            else:
-                jp2_path = jp2_paths[0]  # Asumimos que solo hay un archivo JP2 por tabla
-            
-            # Carga en la base de datos
-            run_raster2pgsql(jp2_path, table_name)
-            update_table_with_geometries(table_name)
-        except Exception as e:
-            print(f"El proceso falló para {table_name}: {e}")
+
+    # Las regiones avanzan por etapas en paralelo; el estado permite retomar tras un fallo
+    metrics = crear_instrumentacion("dem_multi_etl")
+    stages = build_stages(directory, metrics)
+    start = time.perf_counter()
+    timings = ejecutar_etapas(raster_configs, stages, os.path.join(directory, "dem_multi_etl_estado.json"),
+                              clave=lambda job: job["table"])
+    print(resumen_tiempos(timings, stages, time.perf_counter() - start))
+    metrics.cerrar()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Descargas HTTP concurrentes y reanudables para los ETL de DEM: sesión con
+reintentos, retoma con Range sobre `<destino>.part` y un manifiesto por
+directorio (ETag, tamaño, SHA-256) para no repetir descargas.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+TAMANO_BLOQUE = 1024 * 1024  # lectura de red; un corte pierde a lo sumo un bloque
+BUFFER_ESCRITURA = 8 * 1024 * 1024
+NOMBRE_MANIFIESTO = "descargas_manifest.json"
+
+
+def crear_sesion(conexiones=4, reintentos=5, espera=1.0):
+    """Sesión con pool de `conexiones` por host y reintentos en 429/5xx y errores de conexión."""
+    reintento = Retry(total=reintentos, backoff_factor=espera, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["HEAD", "GET"], raise_on_status=False)
+    adaptador = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones, max_retries=reintento)
+    sesion = requests.Session()
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+
+class Manifiesto:
+    """Registro JSON url -> {ruta, etag, last_modified, tamano, sha256}, seguro entre hilos."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._entradas = {}
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as archivo:
+                self._entradas = json.load(archivo)
+
+    def obtener(self, url):
+        with self._lock:
+            return dict(self._entradas.get(url, {}))
+
+    def actualizar(self, url, **campos):
+        with self._lock:
+            self._entradas.setdefault(url, {}).update(campos)
+            temporal = f"{self.ruta}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(self._entradas, archivo, indent=2, sort_keys=True)
+            os.replace(temporal, self.ruta)
+
+
+def sha256_archivo(ruta, tamano_bloque=TAMANO_BLOQUE):
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def metadatos_remotos(sesion, url, timeout=60):
+    """ETag, Last-Modified y tamaño según HEAD; vacío si el servidor no responde HEAD."""
+    try:
+        respuesta = sesion.head(url, allow_redirects=True, timeout=timeout)
+    except requests.RequestException:
+        return {}
+    if respuesta.status_code >= 400:
+        return {}
+    tamano = respuesta.headers.get("Content-Length")
+    return {
+        "etag": respuesta.headers.get("ETag"),
+        "last_modified": respuesta.headers.get("Last-Modified"),
+        "tamano": int(tamano) if tamano is not None else None,
+    }
+
+
+def tamano_esperado(respuesta):
+    """Tamaño total del recurso según Content-Range (206) o Content-Length (200)."""
+    if respuesta.status_code == 206:
+        total = respuesta.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    tamano = respuesta.headers.get("Content-Length")
+    return int(tamano) if tamano is not None and "Content-Encoding" not in respuesta.headers else None
+
+
+def esta_vigente(entrada, remoto, destino, verificar_checksum=True):
+    """True si el archivo local corresponde a lo registrado y el servidor no informa cambios."""
+    if not entrada or not os.path.exists(destino):
+        return False
+    if os.path.getsize(destino) != entrada.get("tamano"):
+        return False
+    if remoto.get("tamano") is not None and remoto["tamano"] != entrada.get("tamano"):
+        return False
+    if remoto.get("etag") and entrada.get("etag") and remoto["etag"] != entrada["etag"]:
+        return False
+    if verificar_checksum and entrada.get("sha256") and sha256_archivo(destino) != entrada["sha256"]:
+        return False
+    return True
+
+
+def _completar(url, parcial, destino, manifiesto, etag, last_modified, sha256):
+    """Renombra el `.part` terminado a `destino` y lo registra en el manifiesto."""
+    tamano = os.path.getsize(parcial)
+    os.replace(parcial, destino)
+    if manifiesto is not None:
+        manifiesto.actualizar(url, ruta=destino, etag=etag, last_modified=last_modified, tamano=tamano,
+                              sha256=sha256, etag_parcial=None, last_modified_parcial=None)
+    print(f"Archivo descargado y guardado en {destino}")
+    return destino
+
+
+def descargar(url, destino, sesion=None, manifiesto=None, tamano_bloque=TAMANO_BLOQUE,
+              verificar_checksum=True, timeout=60):
+    """
+    Descarga `url` en `destino` reanudando un `.part` previo si el servidor lo
+    permite. Con `manifiesto` se omite si ya está vigente. Devuelve `destino`.
+    """
+    sesion = sesion or crear_sesion(1)
+    remoto = metadatos_remotos(sesion, url, timeout)
+    entrada = manifiesto.obtener(url) if manifiesto is not None else {}
+    if esta_vigente(entrada, remoto, destino, verificar_checksum):
+        print(f"Sin cambios, se omite la descarga de {url} ({destino})")
+        return destino
+
+    parcial = f"{destino}.part"
+    offset = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+    validador = entrada.get("etag_parcial") or entrada.get("last_modified_parcial")
+    cabeceras = {}
+    if offset and validador:
+        cabeceras = {"Range": f"bytes={offset}-", "If-Range": validador}
+
+    print(f"Descargando archivo desde {url}" + (f" (retomando en {offset:,} bytes)..." if cabeceras else "..."))
+    with sesion.get(url, stream=True, headers=cabeceras, timeout=timeout) as respuesta:
+        if respuesta.status_code == 416 and cabeceras:
+            # El .part ya estaba entero (la corrida anterior se cortó antes de renombrarlo) o no calza
+            total = respuesta.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                print(f"El parcial de {url} ya estaba completo ({offset:,} bytes)")
+                return _completar(url, parcial, destino, manifiesto,
+                                  respuesta.headers.get("ETag") or remoto.get("etag") or entrada.get("etag_parcial"),
+                                  remoto.get("last_modified") or entrada.get("last_modified_parcial"),
+                                  sha256_archivo(parcial, tamano_bloque))
+            print(f"Rango no satisfacible para el parcial de {url}; se descarga de cero")
+            os.remove(parcial)
+            return descargar(url, destino, sesion, manifiesto, tamano_bloque, verificar_checksum, timeout)
+        respuesta.raise_for_status()
+        if respuesta.status_code != 206:
+            offset = 0  # sin rangos o el recurso cambió: empezar de cero
+        esperado = tamano_esperado(respuesta) or remoto.get("tamano")
+        etag = respuesta.headers.get("ETag") or remoto.get("etag")
+        last_modified = respuesta.headers.get("Last-Modified") or remoto.get("last_modified")
+        if manifiesto is not None:
+            manifiesto.actualizar(url, etag_parcial=etag, last_modified_parcial=last_modified)
+
+        digest = hashlib.sha256()
+        if offset:
+            with open(parcial, "rb") as archivo:
+                for bloque in iter(lambda: archivo.read(tamano_bloque), b""):
+                    digest.update(bloque)
+        with open(parcial, "ab" if offset else "wb", buffering=BUFFER_ESCRITURA) as archivo:
+            for bloque in respuesta.iter_content(chunk_size=tamano_bloque):
+                archivo.write(bloque)
+                digest.update(bloque)
+
+    tamano = os.path.getsize(parcial)
+    if esperado is not None and tamano != esperado:
+        raise IOError(f"Descarga incompleta de {url}: {tamano:,} de {esperado:,} bytes (se retomará)")
+    return _completar(url, parcial, destino, manifiesto, etag, last_modified, digest.hexdigest())
+
+
+def descargar_reanudando(url, destino, sesion=None, manifiesto=None, intentos=3, **opciones):
+    """`descargar` con reintentos que retoman desde el `.part` cuando la conexión se corta a mitad."""
+    for intento in range(1, intentos + 1):
+        try:
+            return descargar(url, destino, sesion, manifiesto, **opciones)
+        except (requests.RequestException, IOError) as e:
+            if intento == intentos:
+                raise
+            print(f"Descarga de {url} interrumpida ({e}); reintento {intento} de {intentos - 1}...")
+
+
+def descargar_todos(tareas, directorio, workers=3, verificar_checksum=True, intentos=3):
+    """
+    Descarga en paralelo `tareas` [(url, destino)] con una sesión compartida y el
+    manifiesto de `directorio`. Devuelve {url: destino o excepción}.
+    """
+    sesion = crear_sesion(workers)
+    manifiesto = Manifiesto(os.path.join(directorio, NOMBRE_MANIFIESTO))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futuros = {url: pool.submit(descargar_reanudando, url, destino, sesion, manifiesto, intentos,
+                                    verificar_checksum=verificar_checksum)
+                   for url, destino in tareas}
+    resultados = {}
+    for url, futuro in futuros.items():
+        try:
+            resultados[url] = futuro.result()
+        except Exception as e:
+            resultados[url] = e
+    return resultados
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+DDL de las tablas de salida del muestreo de humedales, en formato largo (una
+fila por punto y año) o compacto (una fila por punto con los valores en un
+smallint[]). Las tablas nuevas se particionan y se cargan sin índices;
+`crear_indices_muestreo` los construye después en paralelo por partición.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _particionada(cursor, tabla):
+    """True/False según `tabla` esté particionada, o None si no existe."""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (tabla,))
+    fila = cursor.fetchone()
+    return None if fila is None else fila[0] == "p"
+
+
+def particiones(conexion, tabla):
+    """Particiones de `tabla` (la propia tabla si no está particionada)."""
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass "
+                       "ORDER BY 1;", (tabla,))
+        nombres = [fila[0] for fila in cursor.fetchall()]
+    conexion.commit()
+    return nombres or [tabla]
+
+
+def _crear_particiones(cursor, tabla, valores):
+    """Una partición `<tabla>_<valor>` por valor y una por defecto para valores imprevistos."""
+    for valor in valores:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {tabla}_{valor} PARTITION OF {tabla} FOR VALUES IN ({valor});")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {tabla}_otros PARTITION OF {tabla} DEFAULT;")
+
+
+def crear_tabla_muestreo(conexion, tabla, srid, anios=None):
+    """
+    Crea la tabla en formato largo con los mismos tipos que generaba to_postgis.
+    Con `anios`, si la tabla no existe se crea particionada por año, con
+    rand_key y sin índices (ver `crear_indices_muestreo`); una tabla ya
+    particionada no se toca.
+    """
+    nombre = tabla.split(".")[-1]
+    with conexion.cursor() as cursor:
+        particionada = _particionada(cursor, tabla)
+        if anios is not None and particionada is None:
+            cursor.execute(f"""
+                CREATE TABLE {tabla} (
+                    uuid_muestra TEXT,
+                    year BIGINT NOT NULL,
+                    clase_referencia TEXT,
+                    valor BIGINT,
+                    x DOUBLE PRECISION,
+                    y DOUBLE PRECISION,
+                    geometria geometry(POINT, {srid}),
+                    id_pixel BIGINT,
+                    rand_key DOUBLE PRECISION DEFAULT random()
+                ) PARTITION BY LIST (year);
+            """)
+            _crear_particiones(cursor, tabla, anios)
+        elif not particionada:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabla} (
+                    uuid_muestra TEXT,
+                    year BIGINT,
+                    clase_referencia TEXT,
+                    valor BIGINT,
+                    x DOUBLE PRECISION,
+                    y DOUBLE PRECISION,
+                    geometria geometry(POINT, {srid}),
+                    id_pixel BIGINT
+                );
+                ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS id_pixel BIGINT;
+                CREATE INDEX IF NOT EXISTS idx_{nombre}_geometria ON {tabla} USING GIST (geometria);
+            """)
+    conexion.commit()
+
+
+def crear_tabla_clases(conexion, tabla_clases, pixel_class_map):
+    """Tabla de referencia código -> etiqueta de clase (se actualiza si cambian las etiquetas)."""
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabla_clases} (
+                codigo SMALLINT PRIMARY KEY,
+                nombre TEXT NOT NULL
+            );
+        """)
+        cursor.executemany(f"""
+            INSERT INTO {tabla_clases} (codigo, nombre) VALUES (%s, %s)
+            ON CONFLICT (codigo) DO UPDATE SET nombre = EXCLUDED.nombre;
+        """, sorted(pixel_class_map.items()))
+    conexion.commit()
+
+
+def crear_tabla_muestreo_compacta(conexion, tabla, tabla_clases, vista_larga, srid, anios, pixel_class_map,
+                                  particionar=False):
+    """
+    Crea la tabla compacta (una fila por punto), la tabla de clases y la vista
+    `vista_larga` con las columnas del formato largo. Con `particionar`, si la
+    tabla no existe se crea particionada por clase, con rand_key y sin índices.
+    """
+    nombre = tabla.split(".")[-1]
+    crear_tabla_clases(conexion, tabla_clases, pixel_class_map)
+    lista_anios = ", ".join(str(anio) for anio in anios)
+    with conexion.cursor() as cursor:
+        particionada = _particionada(cursor, tabla)
+        if particionar and particionada is None:
+            cursor.execute(f"""
+                CREATE TABLE {tabla} (
+                    uuid_muestra TEXT,
+                    clase SMALLINT NOT NULL REFERENCES {tabla_clases} (codigo),
+                    valores SMALLINT[],
+                    x DOUBLE PRECISION,
+                    y DOUBLE PRECISION,
+                    geometria geometry(POINT, {srid}),
+                    id_pixel BIGINT,
+                    rand_key DOUBLE PRECISION DEFAULT random()
+                ) PARTITION BY LIST (clase);
+            """)
+            _crear_particiones(cursor, tabla, sorted(pixel_class_map))
+        elif not particionada:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabla} (
+                    uuid_muestra TEXT,
+                    clase SMALLINT REFERENCES {tabla_clases} (codigo),
+                    valores SMALLINT[],
+                    x DOUBLE PRECISION,
+                    y DOUBLE PRECISION,
+                    geometria geometry(POINT, {srid}),
+                    id_pixel BIGINT
+                );
+                ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS id_pixel BIGINT;
+                CREATE INDEX IF NOT EXISTS idx_{nombre}_geometria ON {tabla} USING GIST (geometria);
+            """)
+        cursor.execute(f"""
+            CREATE OR REPLACE VIEW {vista_larga} AS
+            SELECT
+                m.uuid_muestra,
+                a.year::BIGINT AS year,
+                c.nombre AS clase_referencia,
+                a.valor::BIGINT AS valor,
+                m.x,
+                m.y,
+                m.geometria,
+                m.id_pixel
+            FROM {tabla} m
+            JOIN {tabla_clases} c ON c.codigo = m.clase
+            CROSS JOIN LATERAL unnest(ARRAY[{lista_anios}], m.valores) AS a(year, valor);
+        """)
+    conexion.commit()
+
+
+def completar_id_pixel(conexion, tabla, transform, width):
+    """
+    Rellena id_pixel en filas antiguas (sin la columna) a partir de x, y, que son
+    centros de píxel. Reescribe la tabla una vez; pensado para migrar datos previos.
+    """
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {tabla}
+            SET id_pixel = floor((y - {transform.f}) / {transform.e})::BIGINT * {width}
+                         + floor((x - {transform.c}) / {transform.a})::BIGINT
+            WHERE id_pixel IS NULL;
+        """)
+        filas = cursor.rowcount
+    conexion.commit()
+    return filas
+
+
+def agregar_clave_aleatoria(conexion, tabla, compacta=False):
+    """
+    Agrega rand_key (random() por defecto, también para las filas que se inserten
+    después) y el índice btree que usa el muestreo de los violines. En una tabla
+    existente reescribe la tabla una vez.
+    """
+    nombre = tabla.split(".")[-1]
+    columnas = "clase, rand_key" if compacta else "year, clase_referencia, rand_key"
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS rand_key DOUBLE PRECISION DEFAULT random();
+            CREATE INDEX IF NOT EXISTS idx_{nombre}_rand_key ON {tabla} ({columnas});
+        """)
+    conexion.commit()
+
+
+# ==========================
+# ÍNDICES POSTERIORES A LA CARGA
+# ==========================
+
+def indices_muestreo(compacta=False):
+    """{sufijo: (método, columnas)} de los índices secundarios de la tabla de muestreo."""
+    indices = {
+        "id_pixel": ("BRIN", "id_pixel"),  # se inserta por bloques: id_pixel sigue el orden físico
+        "geometria": ("GIST", "geometria"),
+        "rand_key": ("BTREE", "clase, rand_key" if compacta else "year, clase_referencia, rand_key"),
+    }
+    if not compacta:
+        indices["valor"] = ("BTREE", "clase_referencia, valor")
+    return indices
+
+
+def eliminar_indices_muestreo(conexion, tabla, compacta=False):
+    """Borra los índices secundarios (en una tabla particionada, también los de cada partición) antes de cargar."""
+    # Borrar el índice padre arrastra los de las particiones adjuntas, pero no los que quedaron sin adjuntar
+    # (p. ej. si crear_indices_muestreo se cortó antes de crear los de la tabla padre)
+    nombres = [tabla] + [particion for particion in particiones(conexion, tabla) if particion != tabla]
+    with conexion.cursor() as cursor:
+        for relacion in nombres:
+            esquema, _, nombre = relacion.rpartition(".")
+            prefijo = f"{esquema}." if esquema else ""
+            for sufijo in indices_muestreo(compacta):
+                cursor.execute(f"DROP INDEX IF EXISTS {prefijo}idx_{nombre}_{sufijo};")
+    conexion.commit()
+
+
+def _indexar_particion(conectar, particion, indices, memoria):
+    """Índices y ANALYZE de una partición con su propia conexión; devuelve la partición."""
+    nombre = particion.split(".")[-1]
+    conexion = conectar()
+    try:
+        with conexion.cursor() as cursor:
+            if memoria:
+                cursor.execute("SET maintenance_work_mem = %s;", (memoria,))
+            for sufijo, (metodo, columnas) in indices.items():
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{nombre}_{sufijo} ON {particion} "
+                               f"USING {metodo} ({columnas});")
+                conexion.commit()
+            cursor.execute(f"ANALYZE {particion};")
+        conexion.commit()
+    finally:
+        conexion.close()
+    return particion
+
+
+def crear_indices_muestreo(conectar, tabla, compacta=False, workers=4, memoria="1GB"):
+    """
+    Construye los índices de `indices_muestreo` y analiza cada partición, con
+    `workers` conexiones de `conectar()` en paralelo. En una tabla particionada
+    los índices de la tabla padre se crean al final y adoptan los de las
+    particiones sin reconstruirlos.
+    """
+    conexion = conectar()
+    try:
+        nombres = particiones(conexion, tabla)
+        with conexion.cursor() as cursor:
+            cursor.execute("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 "
+                           "AND NOT attisdropped;", (tabla,))
+            existentes = {fila[0] for fila in cursor.fetchall()}
+        conexion.commit()
+    finally:
+        conexion.close()
+    # Tablas previas pueden no tener rand_key (ver agregar_clave_aleatoria)
+    indices = {sufijo: (metodo, columnas) for sufijo, (metodo, columnas) in indices_muestreo(compacta).items()
+               if all(columna.strip() in existentes for columna in columnas.split(","))}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda particion: _indexar_particion(conectar, particion, indices, memoria), nombres))
+    if nombres == [tabla]:
+        return nombres
+
+    nombre = tabla.split(".")[-1]
+    conexion = conectar()
+    try:
+        with conexion.cursor() as cursor:
+            for sufijo, (metodo, columnas) in indices.items():
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{nombre}_{sufijo} ON {tabla} USING {metodo} ({columnas});")
+            # Estadísticas de la tabla padre sin volver a muestrear cada partición (PostgreSQL 17+)
+            if conexion.server_version >= 170000:
+                cursor.execute(f"ANALYZE ONLY {tabla};")
+        conexion.commit()
+    finally:
+        conexion.close()
+    return nombres
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Planificador por etapas para ETL de varias regiones: cada etapa tiene su cola
+acotada y sus hilos, y el estado de cada (trabajo, etapa) se guarda en JSON
+para saltar al reiniciar las etapas ya completadas.
+
+Una etapa es un dict {nombre, funcion, concurrencia, vigente?, siempre?};
+`funcion(trabajo)` devuelve un dict (serializable) que se agrega al trabajo.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+
+class EstadoEtapas:
+    """Estado persistente clave -> etapa -> {estado, resultado, segundos, error}, seguro entre hilos."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._estado = {}
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as archivo:
+                self._estado = json.load(archivo)
+
+    def obtener(self, clave, etapa):
+        with self._lock:
+            return dict(self._estado.get(clave, {}).get(etapa, {}))
+
+    def registrar(self, clave, etapa, **campos):
+        with self._lock:
+            self._estado.setdefault(clave, {})[etapa] = campos
+            temporal = f"{self.ruta}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(self._estado, archivo, indent=2, sort_keys=True)
+            os.replace(temporal, self.ruta)
+
+
+def _completada(etapa, previo, trabajo):
+    if previo.get("estado") != "ok" or trabajo.get("_reejecutar") or etapa.get("siempre"):
+        return False
+    vigente = etapa.get("vigente")
+    return vigente is None or vigente({**trabajo, **previo["resultado"]})
+
+
+def ejecutar_etapas(trabajos, etapas, ruta_estado, clave, capacidad=1):
+    """
+    Pasa cada trabajo (dict) por las etapas en orden. `clave(trabajo)` identifica
+    al trabajo en el estado; `capacidad` es el tamaño de cada cola entre etapas.
+    Un trabajo que falla no sigue a las etapas siguientes. Devuelve los tiempos
+    [{clave, etapa, estado, segundos}] ("ok", "omitida" o "error").
+    """
+    estado = EstadoEtapas(ruta_estado)
+    colas = [queue.Queue(maxsize=capacidad) for _ in etapas]
+    activos = [etapa["concurrencia"] for etapa in etapas]
+    tiempos = []
+    lock = threading.Lock()
+
+    def trabajador(i):
+        etapa = etapas[i]
+        nombre = etapa["nombre"]
+        while True:
+            trabajo = colas[i].get()
+            if trabajo is None:
+                break
+            k = clave(trabajo)
+            previo = estado.obtener(k, nombre)
+            if _completada(etapa, previo, trabajo):
+                trabajo.update(previo["resultado"])
+                registro = {"clave": k, "etapa": nombre, "estado": "omitida", "segundos": 0.0}
+            else:
+                print(f"[{nombre}] Iniciando {k}...")
+                inicio = time.perf_counter()
+                try:
+                    resultado = etapa["funcion"](trabajo) or {}
+                except Exception as e:
+                    segundos = time.perf_counter() - inicio
+                    print(f"[{nombre}] El proceso falló para {k}: {e}")
+                    estado.registrar(k, nombre, estado="error", error=str(e), segundos=segundos)
+                    with lock:
+                        tiempos.append({"clave": k, "etapa": nombre, "estado": "error", "segundos": segundos})
+                    continue
+                segundos = time.perf_counter() - inicio
+                if previo.get("resultado") != resultado:
+                    trabajo["_reejecutar"] = True  # las etapas siguientes dependen de un resultado nuevo
+                trabajo.update(resultado)
+                estado.registrar(k, nombre, estado="ok", resultado=resultado, segundos=segundos)
+                registro = {"clave": k, "etapa": nombre, "estado": "ok", "segundos": segundos}
+                print(f"[{nombre}] {k} completado en {segundos:,.1f} s")
+            with lock:
+                tiempos.append(registro)
+            if i + 1 < len(etapas):
+                colas[i + 1].put(trabajo)
+
+        # El último hilo de la etapa cierra la siguiente
+        with lock:
+            activos[i] -= 1
+            ultimo = activos[i] == 0
+        if ultimo and i + 1 < len(etapas):
+            for _ in range(etapas[i + 1]["concurrencia"]):
+                colas[i + 1].put(None)
+
+    hilos = [threading.Thread(target=trabajador, args=(i,), name=f"{etapa['nombre']}-{j}")
+             for i, etapa in enumerate(etapas) for j in range(etapa["concurrencia"])]
+    for hilo in hilos:
+        hilo.start()
+    for trabajo in trabajos:
+        colas[0].put(dict(trabajo))
+    for _ in range(etapas[0]["concurrencia"]):
+        colas[0].put(None)
+    for hilo in hilos:
+        hilo.join()
+    return tiempos
+
+
+def resumen_tiempos(tiempos, etapas, segundos_totales=None):
+    """Tabla de texto con segundos por trabajo y etapa, totales por etapa y tiempo de pared."""
+    nombres = [etapa["nombre"] for etapa in etapas]
+    claves = list(dict.fromkeys(t["clave"] for t in tiempos))
+    celdas = {(t["clave"], t["etapa"]): t for t in tiempos}
+    ancho = max([len("Total etapa")] + [len(k) for k in claves])
+
+    def celda(t):
+        if t is None:
+            return "-"
+        if t["estado"] == "omitida":
+            return "omitida"
+        return f"{t['segundos']:,.1f}" + (" ERROR" if t["estado"] == "error" else "")
+
+    lineas = [f"{'Región':<{ancho}}  " + "  ".join(f"{n:>14}" for n in nombres)]
+    for k in claves:
+        lineas.append(f"{k:<{ancho}}  " + "  ".join(f"{celda(celdas.get((k, n))):>14}" for n in nombres))
+    totales = {n: sum(t["segundos"] for t in tiempos if t["etapa"] == n) for n in nombres}
+    lineas.append(f"{'Total etapa':<{ancho}}  " + "  ".join(f"{totales[n]:>14,.1f}" for n in nombres))
+    suma = sum(totales.values())
+    if segundos_totales is not None:
+        lineas.append(f"Tiempo de pared: {segundos_totales:,.1f} s; suma de etapas: {suma:,.1f} s "
+                      f"(solapamiento {suma / segundos_totales if segundos_totales else 0:,.2f}x)")
+    return "\n".join(lineas)
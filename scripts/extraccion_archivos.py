@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción de rásteres desde archivos comprimidos (RAR, 7z, ZIP, TAR) para los
+ETL de DEM: un `7z l -slt` y un `7z x` por archivo, anidados en paralelo y, con
+`usar_vsi`, rutas virtuales de GDAL en vez de copiar a disco.
+"""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from osgeo import gdal
+
+PREFIJOS_VSI = {".zip": "/vsizip/", ".tar": "/vsitar/", ".rar": "/vsirar/", ".7z": "/vsi7z/"}
+EXTENSIONES_ARCHIVO = tuple(PREFIJOS_VSI)
+
+
+def parsear_listado_slt(salida):
+    """Miembros [{ruta, carpeta, tamano}] de la salida de `7z l -slt` (bloques tras la línea '----------')."""
+    miembros, actual, en_miembros = [], {}, False
+    for linea in salida.splitlines():
+        if not en_miembros:
+            en_miembros = linea.strip() == "----------"
+            continue
+        if not linea.strip():
+            if actual:
+                miembros.append(actual)
+                actual = {}
+            continue
+        clave, separador, valor = linea.partition(" = ")
+        if separador:
+            actual[clave.strip()] = valor
+    if actual:
+        miembros.append(actual)
+    return [{"ruta": m["Path"], "carpeta": m.get("Folder") == "+" or "D" in m.get("Attributes", "")[:1],
+             "tamano": int(m["Size"]) if m.get("Size", "").isdigit() else None}
+            for m in miembros if "Path" in m]
+
+
+def listar_archivo(ruta_archivo):
+    resultado = subprocess.run(["7z", "l", "-slt", ruta_archivo], capture_output=True, text=True, check=True)
+    return parsear_listado_slt(resultado.stdout)
+
+
+def extraer_miembros(ruta_archivo, miembros, destino):
+    """Extrae `miembros` (rutas dentro del archivo) en `destino` con una sola llamada a 7z."""
+    if not miembros:
+        return []
+    subprocess.run(["7z", "x", "-y", f"-o{destino}", ruta_archivo, "--", *miembros],
+                   check=True, stdout=subprocess.DEVNULL)
+    return [os.path.join(destino, miembro) for miembro in miembros]
+
+
+def ruta_vsi(ruta_archivo, miembro):
+    """Ruta virtual GDAL del miembro, o None si la extensión no tiene sistema /vsi asociado."""
+    prefijo = PREFIJOS_VSI.get(os.path.splitext(ruta_archivo)[1].lower())
+    if prefijo is None:
+        return None
+    return f"{prefijo}{os.path.abspath(ruta_archivo)}/{miembro}"
+
+
+def existe_ruta(ruta):
+    """os.path.exists que también entiende rutas /vsi de GDAL."""
+    if ruta.startswith("/vsi"):
+        return gdal.VSIStatL(ruta) is not None
+    return os.path.exists(ruta)
+
+
+def extraer_rasters(ruta_archivo, destino, extension=".jp2", workers=4, usar_vsi=True):
+    """
+    Rutas de todos los rásteres `extension` del archivo y de sus archivos
+    anidados, en el orden del listado. Los anidados se extraen a `destino`.
+    """
+    print(f"Extrayendo archivos desde {ruta_archivo} en {destino} con 7z...")
+    miembros = [m for m in listar_archivo(ruta_archivo) if not m["carpeta"]]
+    rasters = [m["ruta"] for m in miembros if m["ruta"].lower().endswith(extension)]
+    anidados = [m["ruta"] for m in miembros if m["ruta"].lower().endswith(EXTENSIONES_ARCHIVO)]
+
+    rutas_rasters = {}
+    if usar_vsi:
+        for miembro in rasters:
+            virtual = ruta_vsi(ruta_archivo, miembro)
+            if virtual is not None and gdal.VSIStatL(virtual) is not None:
+                rutas_rasters[miembro] = virtual
+    a_extraer = [m for m in rasters if m not in rutas_rasters] + anidados
+    extraidos = dict(zip(a_extraer, extraer_miembros(ruta_archivo, a_extraer, destino)))
+    rutas_rasters.update({m: extraidos[m] for m in rasters if m not in rutas_rasters})
+
+    rutas = [rutas_rasters[m] for m in rasters]
+    if anidados:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            internos = pool.map(lambda m: extraer_rasters(extraidos[m], destino, extension, workers, usar_vsi),
+                                anidados)
+            for rutas_internas in internos:
+                rutas.extend(rutas_internas)
+    return rutas
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción multibanda por ventanas para puntos muestreados del stack.
+
+Los puntos se agrupan por la ventana chunk_size×chunk_size que los contiene;
+cada ventana se lee una sola vez con todas las bandas y los valores se
+recogen con indexación de NumPy.
+"""
+
+import logging
+
+import numpy as np
+from rasterio.windows import Window
+
+from muestreo_bloques import indice_bloque
+
+
+def agrupar_por_ventana(filas, columnas, width, chunk_size):
+    """Índices de los puntos agrupados por ventana, en orden fila-columna de ventanas."""
+    claves = indice_bloque(filas, columnas, width, chunk_size)
+    orden = np.argsort(claves, kind="stable")
+    claves_ordenadas = claves[orden]
+    cortes = np.flatnonzero(np.diff(claves_ordenadas)) + 1
+    return np.split(orden, cortes)
+
+
+def iterar_valores_por_ventana(src, filas, columnas, bandas_idx, chunk_size):
+    """
+    Genera (bloque, idx, valores) por ventana, con `bloque` su índice global,
+    `idx` los índices de los puntos y `valores` un array (bandas, len(idx)).
+    Las ventanas que fallan al leerse se registran y se omiten.
+    """
+    width, height = src.width, src.height
+    for idx in agrupar_por_ventana(filas, columnas, width, chunk_size):
+        if idx.size == 0:
+            continue
+        row_off = int(filas[idx[0]] // chunk_size) * chunk_size
+        col_off = int(columnas[idx[0]] // chunk_size) * chunk_size
+        win = Window(col_off, row_off,
+                     min(chunk_size, width - col_off),
+                     min(chunk_size, height - row_off))
+        try:
+            datos = src.read(bandas_idx, window=win)
+        except Exception as e:
+            logging.warning(f"[!] Error leyendo ventana ({row_off}, {col_off}) con {idx.size:,} puntos: {e}")
+            continue
+        bloque = int(indice_bloque(filas[idx[0]], columnas[idx[0]], width, chunk_size))
+        yield bloque, idx, datos[:, filas[idx] - row_off, columnas[idx] - col_off]
+
+
+def extraer_valores(src, filas, columnas, bandas_idx, chunk_size):
+    """Valores (bandas, puntos) de todos los puntos; las ventanas ilegibles quedan en nodata."""
+    relleno = src.nodata if src.nodata is not None else 0
+    valores = np.full((len(bandas_idx), len(filas)), relleno, dtype=src.dtypes[0])
+    for _, idx, valores_ventana in iterar_valores_por_ventana(src, filas, columnas, bandas_idx, chunk_size):
+        valores[:, idx] = valores_ventana
+    return valores
+
+
+def coordenadas_centro(transform, filas, columnas):
+    """Coordenadas (x, y) del centro de cada píxel a partir de la transformación afín."""
+    c = columnas + 0.5
+    r = filas + 0.5
+    xs = transform.a * c + transform.b * r + transform.c
+    ys = transform.d * c + transform.e * r + transform.f
+    return xs, ys
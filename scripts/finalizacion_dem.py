@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Finalización de tablas DEM en una sola reescritura: un CREATE TABLE AS desde la
+tabla de paso calcula geometrías e id_comuna, y en una transacción reemplaza
+la tabla final, sin los ALTER + UPDATE que la inflaban.
+"""
+
+import time
+
+from asignacion_comunas import preparar_comunas, ctes_asignacion, TABLA_TEMPORAL
+from carga_raster import extension_valores_sql, tesela_vacia_sql
+
+
+def _partes(tabla):
+    esquema, _, nombre = tabla.rpartition(".")
+    return esquema or "public", nombre
+
+
+def consulta_tabla_final(tabla_carga, tabla_nueva, srid=32719, extension_cargada=False):
+    """
+    CREATE TABLE AS con la tabla DEM terminada a partir de la tabla de paso.
+    Con `extension_cargada`, raster_valued_extent viene de la carga (huella de
+    los píxeles con datos, ver carga_raster.py); si no (raster2pgsql), se
+    calcula aquí y se descartan las teselas sin datos, como en cargar_raster.
+    """
+    extension = "raster_valued_extent" if extension_cargada else extension_valores_sql("rast")
+    filtro = "" if extension_cargada else f"WHERE NOT {tesela_vacia_sql('rast')}"
+    # `teselas` sólo lleva geometrías: se materializa al usarse dos veces y no debe copiar rast.
+    # Sin ORDER BY: la carga ya inserta en orden de rid y la clave primaria cubre las búsquedas.
+    return f"""
+        CREATE TABLE {tabla_nueva} AS
+        WITH teselas AS (
+            SELECT rid, ST_ConvexHull(rast) AS tile_extent, {extension} AS raster_valued_extent
+            FROM {tabla_carga}
+            {filtro}
+        ),
+        {ctes_asignacion("teselas", "raster_valued_extent")}
+        SELECT c.rid,
+               c.rast AS geometria_raster,
+               c.filename,
+               asignacion.objectid::INTEGER AS id_comuna,
+               t.tile_extent::geometry(POLYGON, {srid}) AS tile_extent,
+               t.raster_valued_extent::geometry(MULTIPOLYGON, {srid}) AS raster_valued_extent
+        FROM {tabla_carga} c
+        JOIN teselas t ON t.rid = c.rid
+        LEFT JOIN asignacion ON asignacion.rid = c.rid;
+    """
+
+
+def finalizar_tabla_dem(conexion, tabla_carga, tabla, srid=32719, extension_cargada=False):
+    """
+    Construye `tabla` desde `tabla_carga` (que se borra al final) y devuelve
+    los segundos de cada paso. Si algo falla antes del reemplazo, la tabla
+    de paso queda intacta para reintentar.
+    """
+    esquema, nombre = _partes(tabla)
+    tabla_nueva = f"{esquema}.{nombre}_nueva"
+    indices = {
+        f"{nombre}_nueva_pkey": f"{nombre}_pkey",
+        f"{nombre}_nueva_geometria_raster_gist": f"{nombre}_geometria_raster_gist",
+        f"{nombre}_nueva_raster_valued_extent_gist": f"{nombre}_raster_valued_extent_gist",
+    }
+    tiempos = {}
+    inicio = paso = time.perf_counter()
+
+    def marcar(nombre_paso):
+        nonlocal paso
+        ahora = time.perf_counter()
+        tiempos[nombre_paso] = ahora - paso
+        print(f"[finalización] {tabla}: {nombre_paso} en {tiempos[nombre_paso]:,.1f} s")
+        paso = ahora
+
+    with conexion.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {tabla_nueva};")
+        preparar_comunas(cursor, srid)
+        marcar("comunas")
+        cursor.execute(consulta_tabla_final(tabla_carga, tabla_nueva, srid, extension_cargada))
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLA_TEMPORAL};")
+        marcar("create table as")
+
+        nombres = list(indices)
+        cursor.execute(f"""
+            ALTER TABLE {tabla_nueva} ADD CONSTRAINT {nombres[0]} PRIMARY KEY (rid);
+            CREATE INDEX {nombres[1]} ON {tabla_nueva} USING GIST (ST_ConvexHull(geometria_raster));
+            CREATE INDEX {nombres[2]} ON {tabla_nueva} USING GIST (raster_valued_extent);
+        """)
+        marcar("índices")
+        cursor.execute("SELECT AddRasterConstraints(%s, %s, 'geometria_raster');", (esquema, f"{nombre}_nueva"))
+        marcar("restricciones")
+
+        cursor.execute(f"DROP TABLE IF EXISTS {tabla};")
+        cursor.execute(f"ALTER TABLE {tabla_nueva} RENAME TO {nombre};")
+        for temporal, final in indices.items():
+            cursor.execute(f"ALTER INDEX {esquema}.{temporal} RENAME TO {final};")
+        cursor.execute(f"DROP TABLE {tabla_carga};")
+    conexion.commit()
+    marcar("reemplazo")
+
+    autocommit = conexion.autocommit
+    conexion.autocommit = True
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(f"VACUUM ANALYZE {tabla};")
+    finally:
+        conexion.autocommit = autocommit
+    marcar("vacuum analyze")
+    print(f"[finalización] {tabla} lista en {time.perf_counter() - inicio:,.1f} s")
+    return tiempos
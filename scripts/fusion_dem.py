@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Fusión de teselas DEM con GDAL para los ETL de DEM: cog (GeoTIFF optimizado con
+el tipo y nodata de las fuentes), vrt (sin ráster intermedio) o jp2 (salida
+Byte anterior, sólo para comparar).
+"""
+
+import os
+
+from osgeo import gdal
+
+MODOS_FUSION = ("cog", "vrt", "jp2")
+EXTENSIONES_FUSION = {"cog": ".tif", "vrt": ".vrt", "jp2": ".jp2"}
+OPCIONES_COG = [
+    "COMPRESS=DEFLATE", "PREDICTOR=YES", "BLOCKSIZE=512", "BIGTIFF=IF_SAFER",
+    "OVERVIEWS=AUTO", "OVERVIEW_RESAMPLING=AVERAGE",
+]
+
+
+def configurar_hilos(hilos="ALL_CPUS"):
+    gdal.SetConfigOption("GDAL_NUM_THREADS", str(hilos))
+
+
+def construir_vrt(rutas, ruta_vrt):
+    """Mosaico VRT de `rutas` conservando tipo y nodata; con CRS distintos, VRT de warp al CRS de la primera."""
+    fuentes = [gdal.Open(ruta) for ruta in rutas]
+    proyecciones = {fuente.GetProjection() for fuente in fuentes}
+    nodata = fuentes[0].GetRasterBand(1).GetNoDataValue()
+    if len(proyecciones) == 1:
+        opciones = gdal.BuildVRTOptions(resampleAlg="nearest", addAlpha=False)
+        vrt = gdal.BuildVRT(ruta_vrt, rutas, options=opciones)
+    else:
+        opciones = gdal.WarpOptions(format="VRT", dstSRS=fuentes[0].GetProjection(), resampleAlg="near",
+                                    multithread=True, warpOptions=["NUM_THREADS=ALL_CPUS"],
+                                    srcNodata=nodata, dstNodata=nodata)
+        vrt = gdal.Warp(ruta_vrt, rutas, options=opciones)
+    fuentes = None
+    return vrt
+
+
+def fusionar(rutas, ruta_salida, modo="cog", hilos="ALL_CPUS"):
+    """Fusiona `rutas` en `ruta_salida` según `modo` (ver MODOS_FUSION) y devuelve la ruta."""
+    if modo not in MODOS_FUSION:
+        raise ValueError(f"Modo de fusión desconocido: {modo}")
+    configurar_hilos(hilos)
+    if modo == "vrt":
+        vrt = construir_vrt(rutas, ruta_salida)
+        vrt.FlushCache()
+        vrt = None
+        return ruta_salida
+
+    ruta_vrt = f"/vsimem/{os.path.basename(ruta_salida)}.vrt"
+    vrt = construir_vrt(rutas, ruta_vrt)
+    if modo == "cog":
+        opciones = gdal.TranslateOptions(format="COG", creationOptions=OPCIONES_COG + [f"NUM_THREADS={hilos}"])
+    else:
+        opciones = gdal.TranslateOptions(format="JP2OpenJPEG", outputType=gdal.GDT_Byte)
+    gdal.Translate(ruta_salida, vrt, options=opciones)
+    vrt = None
+    gdal.Unlink(ruta_vrt)
+    return ruta_salida
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Índice persistente de clases por bloque del stack de humedales
+(`<stack>.tif.clases_<chunk>.npz`), con los conteos de `contar_por_bloque` y
+por banda; se invalida si cambian el raster, el tamaño de bloque o las bandas.
+
+    python scripts/indice_clases.py /ruta/stack_humedales.tif --workers 8
+"""
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+
+import numpy as np
+import rasterio
+
+from muestreo_bloques import iterar_ventanas, mascara_validez_bandas
+
+VERSION_INDICE = 1
+
+# Estado de cada proceso trabajador, fijado por _iniciar_trabajador
+_src = None
+_config = None
+
+
+def ruta_indice(input_tif, chunk_size):
+    return f"{input_tif}.clases_{chunk_size}.npz"
+
+
+def firma_archivo(ruta):
+    """(mtime en ns, tamaño en bytes) del archivo, usados para invalidar el índice."""
+    estado = os.stat(ruta)
+    return estado.st_mtime_ns, estado.st_size
+
+
+def contar_clases_bloque(stack, nodata, n_clases=13):
+    """Conteos del bloque: (n_clases + 1) válidos en todas las bandas y (bandas, n_clases + 1) por banda."""
+    validez_bandas = mascara_validez_bandas(stack, nodata, 1, n_clases)
+    validez = validez_bandas.all(axis=0)
+    conteo = np.bincount(stack[0][validez].astype(np.int64), minlength=n_clases + 1)
+    por_banda = np.empty((stack.shape[0], n_clases + 1), dtype=np.int64)
+    for i in range(stack.shape[0]):
+        por_banda[i] = np.bincount(stack[i][validez_bandas[i]].astype(np.int64), minlength=n_clases + 1)
+        por_banda[i, 0] = validez_bandas[i].size - validez_bandas[i].sum()
+    return conteo, por_banda
+
+
+def contar_clases_franja(src, bandas_idx, chunk_size, nodata, n_clases=13, row_start=0, row_stop=None,
+                         progreso=None):
+    """Conteos de todos los bloques de la franja [row_start, row_stop) en una sola lectura por bloque."""
+    ventanas = list(iterar_ventanas(src.width, src.height, chunk_size, row_start, row_stop))
+    conteos = np.zeros((len(ventanas), n_clases + 1), dtype=np.int32)
+    conteos_banda = np.zeros((len(ventanas), len(bandas_idx), n_clases + 1), dtype=np.int32)
+    for i, win in enumerate(progreso(ventanas) if progreso else ventanas):
+        stack = src.read(bandas_idx, window=win)
+        conteos[i], conteos_banda[i] = contar_clases_bloque(stack, nodata, n_clases)
+    return conteos, conteos_banda
+
+
+def _iniciar_trabajador(input_tif, config):
+    global _src, _config
+    _src = rasterio.open(input_tif)
+    _config = config
+
+
+def _contar_franja(franja):
+    row_start, row_stop = franja
+    return contar_clases_franja(_src, _config["bandas_idx"], _config["chunk_size"], _src.nodata,
+                                _config["n_clases"], row_start=row_start, row_stop=row_stop)
+
+
+def construir_indice(input_tif, bandas_idx, chunk_size, n_clases=13, workers=1, progreso=None):
+    """
+    Recorre el stack una vez y devuelve el índice como dict de arrays. Con
+    workers > 1 reparte franjas de filas entre procesos; `progreso` envuelve el
+    iterador de ventanas (un proceso) o de franjas (varios).
+    """
+    from muestreo_paralelo import FRANJAS_POR_PROCESO, dividir_franjas
+
+    mtime_ns, tamano = firma_archivo(input_tif)
+    with rasterio.open(input_tif) as src:
+        width, height, nodata = src.width, src.height, src.nodata
+        if workers <= 1:
+            conteos, conteos_banda = contar_clases_franja(src, bandas_idx, chunk_size, nodata, n_clases,
+                                                          progreso=progreso)
+
+    if workers > 1:
+        franjas = dividir_franjas(height, chunk_size, workers * FRANJAS_POR_PROCESO)
+        config = {"bandas_idx": list(bandas_idx), "chunk_size": chunk_size, "n_clases": n_clases}
+        ctx = mp.get_context("fork")
+        with ctx.Pool(workers, initializer=_iniciar_trabajador, initargs=(input_tif, config)) as pool:
+            resultados = pool.imap(_contar_franja, franjas)
+            partes = [next(resultados) for _ in (progreso(franjas) if progreso else franjas)]
+        conteos = np.concatenate([c for c, _ in partes])
+        conteos_banda = np.concatenate([b for _, b in partes])
+
+    return {
+        "version": VERSION_INDICE, "mtime_ns": mtime_ns, "tamano": tamano,
+        "width": width, "height": height, "chunk_size": chunk_size,
+        "bandas": np.asarray(bandas_idx, dtype=np.int64),
+        "nodata": np.nan if nodata is None else float(nodata),
+        "conteos": conteos, "conteos_banda": conteos_banda,
+    }
+
+
+def guardar_indice(indice, ruta):
+    """Escribe el .npz en un temporal y lo renombra, para no dejar índices a medias."""
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as archivo:
+        np.savez_compressed(archivo, **indice)
+    os.replace(temporal, ruta)
+
+
+def cargar_indice(input_tif, chunk_size, bandas_idx=None, ruta=None):
+    """Índice vigente para `input_tif`, o None si no existe o quedó desactualizado."""
+    ruta = ruta or ruta_indice(input_tif, chunk_size)
+    if not os.path.exists(ruta):
+        return None
+    with np.load(ruta) as datos:
+        indice = {clave: datos[clave] for clave in datos.files}
+    mtime_ns, tamano = firma_archivo(input_tif)
+    vigente = (
+        int(indice["version"]) == VERSION_INDICE
+        and int(indice["mtime_ns"]) == mtime_ns and int(indice["tamano"]) == tamano
+        and int(indice["chunk_size"]) == chunk_size
+        and (bandas_idx is None or np.array_equal(indice["bandas"], bandas_idx))
+    )
+    if not vigente:
+        logging.info(f"[i] Índice de clases desactualizado: {ruta}")
+        return None
+    indice["conteos"] = indice["conteos"].astype(np.int64)
+    return indice
+
+
+def obtener_indice(input_tif, bandas_idx, chunk_size, n_clases=13, workers=1, progreso=None,
+                   reconstruir=False, ruta=None):
+    """Carga el índice vigente o lo construye y lo guarda junto al raster."""
+    ruta = ruta or ruta_indice(input_tif, chunk_size)
+    indice = None if reconstruir else cargar_indice(input_tif, chunk_size, bandas_idx, ruta)
+    if indice is not None:
+        logging.info(f"[i] Índice de clases cargado desde {ruta}")
+        return indice
+    logging.info(f"[i] Construyendo índice de clases por bloque en {ruta}...")
+    indice = construir_indice(input_tif, bandas_idx, chunk_size, n_clases, workers, progreso)
+    guardar_indice(indice, ruta)
+    indice["conteos"] = indice["conteos"].astype(np.int64)
+    return indice
+
+
+def bloques_con_datos(indice):
+    """Bool por bloque: True si tiene al menos un píxel válido en todas las bandas."""
+    return indice["conteos"].sum(axis=1) > 0
+
+
+def distribucion_por_banda(indice):
+    """Píxeles por clase y banda en todo el raster (bandas, n_clases + 1); columna 0 = nodata."""
+    return indice["conteos_banda"].sum(axis=0, dtype=np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice de clases por bloque de un stack multibanda.")
+    parser.add_argument("input_tif")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--bandas", type=int, nargs="+", default=None, help="Bandas 1-based (por defecto, todas)")
+    parser.add_argument("--n-clases", type=int, default=13)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--forzar", action="store_true", help="Reconstruir aunque el índice esté vigente")
+    args = parser.parse_args()
+
+    with rasterio.open(args.input_tif) as src:
+        bandas_idx = args.bandas or list(range(1, src.count + 1))
+    indice = obtener_indice(args.input_tif, bandas_idx, args.chunk_size, args.n_clases, args.workers,
+                            reconstruir=args.forzar)
+
+    con_datos = bloques_con_datos(indice)
+    print(f"Bloques: {len(con_datos):,} ({int(con_datos.sum()):,} con datos válidos)")
+    print(f"Píxeles válidos en todas las bandas: {int(indice['conteos'].sum()):,}")
+    for banda, conteo in zip(indice["bandas"], distribucion_por_banda(indice)):
+        print(f"Banda {banda}: nodata {conteo[0]:,} · " + " ".join(f"{c}:{n:,}" for c, n in enumerate(conteo) if c and n))
+
+
+if __name__ == "__main__":
+    main()
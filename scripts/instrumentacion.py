@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas por etapa para los ETL: cada etapa deja una línea JSON (tiempo, CPU,
+RSS pico, bytes de disco, filas) en `<metricas>/<script>.jsonl` y puede
+perfilarse con cProfile o py-spy. Configuración por argumentos o por
+ETL_METRICAS, ETL_PERFILAR y ETL_PERFILADOR.
+"""
+
+import atexit
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+DIRECTORIO_METRICAS = "/home/dps_chanar/etl_raster/logs/metricas"
+PERFILADORES = ("cprofile", "py-spy")
+# Un solo cProfile activo por proceso: las etapas que corren a la vez en otros hilos no se perfilan
+_lock_perfil = threading.Lock()
+
+
+def _contadores_io():
+    """Bytes leídos/escritos en disco por el proceso, o None si /proc/self/io no está disponible."""
+    try:
+        with open("/proc/self/io") as archivo:
+            campos = dict(linea.split(": ") for linea in archivo.read().splitlines())
+        return int(campos["read_bytes"]), int(campos["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _instantanea():
+    propio = resource.getrusage(resource.RUSAGE_SELF)
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "pared": time.perf_counter(),
+        "cpu": propio.ru_utime + propio.ru_stime,
+        "cpu_hijos": hijos.ru_utime + hijos.ru_stime,
+        "io": _contadores_io(),
+    }
+
+
+def _diferencia(antes, despues):
+    delta = {
+        "segundos": despues["pared"] - antes["pared"],
+        "cpu_segundos": despues["cpu"] - antes["cpu"],
+        "cpu_hijos_segundos": despues["cpu_hijos"] - antes["cpu_hijos"],
+        "bytes_leidos": None, "bytes_escritos": None,
+    }
+    if antes["io"] is not None and despues["io"] is not None:
+        delta["bytes_leidos"] = despues["io"][0] - antes["io"][0]
+        delta["bytes_escritos"] = despues["io"][1] - antes["io"][1]
+    return delta
+
+
+def _rss_pico_mb():
+    """RSS máximo del proceso y de sus hijos terminados, en MB (ru_maxrss está en KB en Linux)."""
+    propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(propio / 1024, 1), round(hijos / 1024, 1)
+
+
+class Instrumentacion:
+    """Registro de etapas seguro entre hilos; `etapa()` y `medir_iterador()` producen las líneas JSON."""
+
+    def __init__(self, script, ruta=None, perfilar=None, perfilador="cprofile"):
+        self.script = script
+        self.ruta = ruta
+        self.perfilar = perfilar
+        self.perfilador = perfilador
+        self.ejecucion = f"{script}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.registros = []
+        self._lock = threading.Lock()
+        self._perfiles = 0
+        self._cerrada = False
+        self._inicio = time.perf_counter()
+        if ruta:
+            os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        atexit.register(self.cerrar)
+
+    def _escribir(self, registro):
+        with self._lock:
+            if self.ruta:
+                with open(self.ruta, "a", encoding="utf-8") as archivo:
+                    archivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+
+    def _registrar(self, nombre, delta, filas, estado, error, etiquetas):
+        rss, rss_hijos = _rss_pico_mb()
+        registro = {
+            "tipo": "etapa", "ejecucion": self.ejecucion, "script": self.script, "etapa": nombre,
+            "fin": datetime.now().isoformat(timespec="seconds"), **etiquetas,
+            **{clave: round(valor, 3) if isinstance(valor, float) else valor for clave, valor in delta.items()},
+            "rss_pico_mb": rss, "rss_pico_hijos_mb": rss_hijos,
+            "filas": filas,
+            "filas_por_segundo": round(filas / delta["segundos"], 1) if filas and delta["segundos"] else None,
+            "estado": estado,
+        }
+        if error is not None:
+            registro["error"] = error
+        with self._lock:
+            self.registros.append(registro)
+        self._escribir(registro)
+        return registro
+
+    def _ruta_perfil(self, nombre, extension):
+        with self._lock:
+            self._perfiles += 1
+            n = self._perfiles
+        directorio = os.path.dirname(os.path.abspath(self.ruta)) if self.ruta else DIRECTORIO_METRICAS
+        return os.path.join(directorio, f"{self.ejecucion}.{nombre}.{n}{extension}")
+
+    @contextmanager
+    def _perfil(self, nombre):
+        if nombre != self.perfilar:
+            yield
+            return
+        if self.perfilador == "py-spy":
+            if shutil.which("py-spy") is None:
+                logging.warning("[métricas] py-spy no está en el PATH; la etapa no se perfila")
+                yield
+                return
+            ruta = self._ruta_perfil(nombre, ".svg")
+            proceso = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--subprocesses",
+                                        "--output", ruta], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                yield
+            finally:
+                proceso.send_signal(signal.SIGINT)  # py-spy escribe el flamegraph al recibir SIGINT
+                proceso.wait()
+                logging.info(f"[métricas] Flamegraph de {nombre}: {ruta}")
+            return
+        if not _lock_perfil.acquire(blocking=False):
+            logging.warning(f"[métricas] Ya hay un cProfile activo en otro hilo; {nombre} no se perfila")
+            yield
+            return
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            _lock_perfil.release()
+            ruta = self._ruta_perfil(nombre, ".prof")
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            perfil.dump_stats(ruta)
+            texto = io.StringIO()
+            pstats.Stats(perfil, stream=texto).sort_stats("cumulative").print_stats(30)
+            with open(f"{os.path.splitext(ruta)[0]}.txt", "w", encoding="utf-8") as archivo:
+                archivo.write(texto.getvalue())
+            logging.info(f"[métricas] Perfil de {nombre}: {ruta}")
+
+    @contextmanager
+    def etapa(self, nombre, filas=None, **etiquetas):
+        """
+        Mide el bloque `with`. Entrega un dict donde fijar `filas` (u otras
+        etiquetas) antes de salir; las excepciones se registran y se relanzan.
+        """
+        datos = {"filas": filas}
+        antes = _instantanea()
+        estado, error = "ok", None
+        try:
+            with self._perfil(nombre):
+                yield datos
+        except BaseException as e:
+            estado, error = "error", repr(e)
+            raise
+        finally:
+            filas = datos.pop("filas")
+            self._registrar(nombre, _diferencia(antes, _instantanea()), filas, estado, error,
+                            {**etiquetas, **datos})
+
+    def medir_iterador(self, nombre, iterable, filas=None, **etiquetas):
+        """
+        Recorre `iterable` midiendo sólo el tiempo dentro de cada next() (p. ej. la
+        lectura de ventanas entre inserciones); `filas(item)` cuenta filas por
+        elemento. Registra una sola línea al agotarse.
+        """
+        acumulado = None
+        total = 0
+        iterador = iter(iterable)
+        while True:
+            antes = _instantanea()
+            try:
+                item = next(iterador)
+            except StopIteration:
+                break
+            finally:
+                delta = _diferencia(antes, _instantanea())
+                if acumulado is None:
+                    acumulado = delta
+                else:
+                    for clave, valor in delta.items():
+                        if valor is not None and acumulado[clave] is not None:
+                            acumulado[clave] += valor
+            if filas is not None:
+                total += filas(item)
+            yield item
+        self._registrar(nombre, acumulado, total if filas is not None else None, "ok", None, etiquetas)
+
+    def resumen(self):
+        """Agregado por etapa: veces, segundos, CPU, filas, filas/s, MB leídos/escritos y RSS pico."""
+        with self._lock:
+            registros = list(self.registros)
+        etapas = {}
+        for r in registros:
+            e = etapas.setdefault(r["etapa"], {"etapa": r["etapa"], "veces": 0, "segundos": 0.0, "cpu_segundos": 0.0,
+                                               "filas": 0, "mb_leidos": 0.0, "mb_escritos": 0.0,
+                                               "rss_pico_mb": 0.0, "errores": 0})
+            e["veces"] += 1
+            e["segundos"] += r["segundos"]
+            e["cpu_segundos"] += r["cpu_segundos"] + r["cpu_hijos_segundos"]
+            e["filas"] += r["filas"] or 0
+            e["mb_leidos"] += (r["bytes_leidos"] or 0) / 1e6
+            e["mb_escritos"] += (r["bytes_escritos"] or 0) / 1e6
+            e["rss_pico_mb"] = max(e["rss_pico_mb"], r["rss_pico_mb"], r["rss_pico_hijos_mb"])
+            e["errores"] += r["estado"] != "ok"
+        for e in etapas.values():
+            e["filas_por_segundo"] = round(e["filas"] / e["segundos"], 1) if e["filas"] and e["segundos"] else None
+        return list(etapas.values())
+
+    def tabla_resumen(self, etapas=None):
+        etapas = self.resumen() if etapas is None else etapas
+        ancho = max([len("etapa")] + [len(e["etapa"]) for e in etapas])
+        lineas = [f"{'etapa':<{ancho}} {'veces':>5} {'pared s':>9} {'CPU s':>9} {'filas':>12} {'filas/s':>10} "
+                  f"{'MB leídos':>10} {'MB escritos':>11} {'RSS MB':>8}"]
+        for e in etapas:
+            filas_s = f"{e['filas_por_segundo']:,.0f}" if e["filas_por_segundo"] else "-"
+            lineas.append(f"{e['etapa']:<{ancho}} {e['veces']:>5} {e['segundos']:>9,.1f} {e['cpu_segundos']:>9,.1f} "
+                          f"{e['filas']:>12,} {filas_s:>10} {e['mb_leidos']:>10,.1f} {e['mb_escritos']:>11,.1f} "
+                          f"{e['rss_pico_mb']:>8,.0f}" + (f"  ({e['errores']} con error)" if e["errores"] else ""))
+        lineas.append(f"Tiempo total de la ejecución: {time.perf_counter() - self._inicio:,.1f} s")
+        return "\n".join(lineas)
+
+    def cerrar(self):
+        """Escribe la línea de resumen e imprime la tabla (una sola vez; también se llama al salir)."""
+        if self._cerrada:
+            return
+        self._cerrada = True
+        etapas = self.resumen()
+        if not etapas:
+            return
+        self._escribir({"tipo": "resumen", "ejecucion": self.ejecucion, "script": self.script,
+                        "segundos": round(time.perf_counter() - self._inicio, 3), "etapas": etapas})
+        texto = self.tabla_resumen(etapas)
+        print(texto)
+        logging.info("[métricas] Resumen por etapa:\n" + texto)
+
+
+def agregar_argumentos(parser):
+    """--metricas, --perfilar y --perfilador para scripts con argparse."""
+    parser.add_argument("--metricas", default=None,
+                        help="Directorio o archivo .jsonl de métricas por etapa (\"0\" desactiva)")
+    parser.add_argument("--perfilar", default=None, metavar="ETAPA", help="Etapa a perfilar")
+    parser.add_argument("--perfilador", choices=PERFILADORES, default=None,
+                        help="cprofile (hilo de la etapa) o py-spy (proceso e hijos, flamegraph)")
+
+
+def crear_instrumentacion(script, args=None):
+    """Instrumentacion configurada por `args` (agregar_argumentos) o, en su defecto, por el entorno."""
+    destino = getattr(args, "metricas", None) or os.environ.get("ETL_METRICAS", DIRECTORIO_METRICAS)
+    perfilar = getattr(args, "perfilar", None) or os.environ.get("ETL_PERFILAR")
+    perfilador = getattr(args, "perfilador", None) or os.environ.get("ETL_PERFILADOR", "cprofile")
+    if destino == "0":
+        ruta = None
+    elif destino.endswith(".jsonl"):
+        ruta = destino
+    else:
+        ruta = os.path.join(destino, f"{script}.jsonl")
+    return Instrumentacion(script, ruta, perfilar, perfilador)
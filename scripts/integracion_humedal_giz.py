@@ -6,18 +6,31 @@ Christian Chacón · agosto 2025
 """
 
 import os
-import uuid
+import argparse
 import numpy as np
-import geoalchemy2
 import rasterio
-from rasterio.windows import Window
-from shapely.geometry import Point
-import geopandas as gpd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 from dotenv import dotenv_values
 from tqdm import tqdm
-from collections import defaultdict
 import logging
+from muestreo_bloques import (
+    escanear_candidatos, muestrear_estratificado,
+    contar_por_bloque, asignar_muestras_por_bloque, muestrear_por_conteos, uuids_deterministas, indice_bloque
+)
+from extraccion_valores import iterar_valores_por_ventana, coordenadas_centro
+from carga_copy import columnas_muestreo, copiar_muestras
+from esquema_muestreo import (
+    crear_tabla_muestreo, crear_tabla_muestreo_compacta, completar_id_pixel, eliminar_indices_muestreo,
+    crear_indices_muestreo
+)
+from progreso_muestreo import (
+    crear_tabla_progreso, cargar_bloques_completados, registrar_bloques, cargar_pixeles_existentes, filtrar_nuevos,
+    obtener_entropia
+)
+from muestreo_paralelo import ejecutar_muestreo_paralelo
+from indice_clases import obtener_indice, bloques_con_datos
+from puntos_control import PuntosControl, directorio_puntos_control
+from instrumentacion import agregar_argumentos, crear_instrumentacion
 
 # ==========================
 # [1] CONFIGURACIÓN GENERAL
@@ -30,20 +43,66 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+parser = argparse.ArgumentParser(description="Muestreo estratificado por bloques desde el stack de humedales.")
+parser.add_argument("--modo", choices=["candidatos", "conteos"], default="candidatos",
+                    help="candidatos: guarda todos los índices válidos; "
+                         "conteos: dos pasadas, la memoria escala con el tamaño de la muestra")
+parser.add_argument("--porcentaje", type=float, default=0.10, help="Fracción de píxeles a muestrear por clase")
+parser.add_argument("--semilla", type=int, default=None, help="Semilla para muestras reproducibles")
+parser.add_argument("--geometria", choices=["ewkb", "servidor"], default="ewkb",
+                    help="ewkb: geometría armada en Python como EWKB hex; "
+                         "servidor: ST_SetSRID(ST_MakePoint(x, y)) en PostgreSQL")
+parser.add_argument("--formato", choices=["largo", "compacto"], default="largo",
+                    help="largo: una fila por punto y año; compacto: una fila por punto con valores smallint[], "
+                         "tabla de clases y vista en formato largo")
+parser.add_argument("--sin-deduplicar", action="store_true",
+                    help="No leer id_pixel existentes; reanudar sólo con la tabla de progreso")
+parser.add_argument("--migrar-id-pixel", action="store_true",
+                    help="Completar id_pixel desde x, y en filas insertadas antes de existir la columna")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Procesos para muestrear por franjas de filas (>1 usa siempre el modo conteos)")
+parser.add_argument("--escritores", type=int, default=2, help="Escritores COPY en modo paralelo")
+parser.add_argument("--sin-indice", action="store_true",
+                    help="No usar el índice de clases por bloque (.npz junto al stack); escanear el raster")
+parser.add_argument("--reconstruir-indice", action="store_true",
+                    help="Reconstruir el índice de clases por bloque aunque esté vigente")
+parser.add_argument("--sin-particionar", action="store_true",
+                    help="Crear la tabla de salida sin particionar (por defecto: por año en formato largo, "
+                         "por clase en compacto); una tabla existente se conserva como está")
+parser.add_argument("--conservar-indices", action="store_true",
+                    help="No borrar los índices antes de cargar (p. ej. al reanudar con pocos puntos pendientes)")
+parser.add_argument("--workers-indices", type=int, default=4,
+                    help="Particiones indexadas y analizadas en paralelo después de la carga")
+parser.add_argument("--puntos-control", default=None,
+                    help="Directorio de puntos de control entre etapas (por defecto <stack>.puntos_control)")
+parser.add_argument("--sin-puntos-control", action="store_true",
+                    help="No guardar ni reutilizar escaneo, muestreo y valores extraídos en disco")
+agregar_argumentos(parser)
+args = parser.parse_args()
+metricas = crear_instrumentacion("integracion_humedal_giz", args)
+
 logging.info("[1/7] Cargando configuración...")
 
 input_tif = os.path.expanduser("/home/dps_chanar/raster_data/humedales_giz/stack_humedales.tif")
 env = dotenv_values(os.path.expanduser("/home/dps_chanar/.env"))
 pg_url = f"postgresql://{env['DB_USER_P']}:{env['DB_PASSWORD_P']}@{env['DB_HOST_P']}/{env['DB_NAME_P']}"
 engine = create_engine(pg_url)
-output_table = "ecos_acuatico_continental.muestreo_humedales_giz"
+formato_salida = args.formato
+tabla_larga = "ecos_acuatico_continental.muestreo_humedales_giz"
+tabla_compacta = "ecos_acuatico_continental.muestreo_humedales_giz_compacto"
+tabla_clases = "ecos_acuatico_continental.clases_humedales_giz"
+vista_larga = "ecos_acuatico_continental.muestreo_humedales_giz_largo"
+output_table = tabla_compacta if formato_salida == "compacto" else tabla_larga
 
 anios = list(range(2015, 2025))
 bandas_idx = list(range(1, 11))  # rasterio is 1-based
 chunk_size = 1024
-porcentaje = 0.10
+porcentaje = args.porcentaje
+modo_muestreo = args.modo
 valores_validos = set(range(1, 14))
 bloque_insercion = 500_000
+semilla = args.semilla
+metodo_geometria = args.geometria
 
 pixel_class_map = {
     1: "Superficie agrícola", 2: "Superficie arbórea", 3: "Superficie herbácea",
@@ -53,6 +112,37 @@ pixel_class_map = {
     11: "Turberas Sphagnosas y/o Pulvinadas", 12: "Vegas y mallines",
     13: "Cuerpos de agua continental"
 }
+nombres_clase = np.array([pixel_class_map.get(k, f"Clase {k}") for k in range(max(pixel_class_map) + 1)],
+                         dtype=object)
+
+
+def crear_tablas_salida(engine):
+    conexion = engine.raw_connection()
+    try:
+        if formato_salida == "compacto":
+            crear_tabla_muestreo_compacta(conexion, output_table, tabla_clases, vista_larga, epsg, anios,
+                                          pixel_class_map, particionar=not args.sin_particionar)
+        else:
+            crear_tabla_muestreo(conexion, output_table, epsg, anios=None if args.sin_particionar else anios)
+        crear_tabla_progreso(conexion, output_table)
+        if not args.conservar_indices:
+            eliminar_indices_muestreo(conexion, output_table, compacta=(formato_salida == "compacto"))
+        if args.migrar_id_pixel:
+            logging.info("[2.5/7] Completando id_pixel en filas previas desde x, y...")
+            filas = completar_id_pixel(conexion, output_table, transform, width)
+            logging.info(f"[2.5/7] Filas migradas: {filas:,}")
+    finally:
+        conexion.close()
+
+
+def indexar_salida():
+    """Índices y ANALYZE por partición después de la carga (ver esquema_muestreo.py)."""
+    logging.info(f"[7/7] Creando índices y analizando {output_table} con {args.workers_indices} conexiones...")
+    with metricas.etapa("indices", workers=args.workers_indices) as metrica:
+        indexadas = crear_indices_muestreo(engine.raw_connection, output_table,
+                                           compacta=(formato_salida == "compacto"), workers=args.workers_indices)
+        metrica["particiones"] = len(indexadas)
+    logging.info(f"[7/7] Índices listos en {len(indexadas)} partición(es).")
 
 # ==========================
 # [2] LEER METADATOS
@@ -63,161 +153,259 @@ logging.info("[2/7] Leyendo metadatos del stack...")
 with rasterio.open(input_tif) as src:
     nodata = src.nodata
     width, height = src.width, src.height
+    transform = src.transform
     crs = src.crs
     epsg = crs.to_epsg()
 
+n_bloques = -(-height // chunk_size) * -(-width // chunk_size)
+
 logging.info(f"[2/7] Stack multibanda detectado con tamaño {height}x{width}, nodata={nodata}, EPSG={epsg}")
 
 # ==========================
-# [3] PROCESAMIENTO POR BLOQUES
+# [2.2/7] ÍNDICE DE CLASES POR BLOQUE
 # ==========================
 
-logging.info("[3/7] Buscando píxeles válidos por bloque...")
-
-candidatos_por_clase = defaultdict(list)
+indice_clases = None
+if not args.sin_indice:
+    logging.info("[2.2/7] Cargando índice de clases por bloque...")
+    with metricas.etapa("indice"):
+        indice_clases = obtener_indice(input_tif, bandas_idx, chunk_size, workers=args.workers,
+                                       reconstruir=args.reconstruir_indice,
+                                       progreso=lambda tareas: tqdm(tareas, desc="Índice de clases"))
+    logging.info(f"[2.2/7] Bloques con datos válidos: {int(bloques_con_datos(indice_clases).sum()):,} "
+                 f"de {n_bloques:,}; píxeles válidos: {int(indice_clases['conteos'].sum()):,}")
 
-with rasterio.open(input_tif) as src:
-    for row_off in tqdm(range(0, height, chunk_size), desc="Filas"):
-        for col_off in range(0, width, chunk_size):
-            win = Window(col_off, row_off,
-                         min(chunk_size, width - col_off),
-                         min(chunk_size, height - row_off))
-
-            bloques = [src.read(bidx, window=win) for bidx in bandas_idx]
-            stack = np.stack(bloques, axis=0)
-            validez = ((stack != nodata) & np.isfinite(stack) & (stack >= 1) & (stack <= 13)).all(axis=0)
-            base = bloques[0]
-            rows, cols = np.where(validez)
-
-            for r, c in zip(rows, cols):
-                clase_base = int(base[r, c])
-                if clase_base in valores_validos:
-                    abs_row = row_off + r
-                    abs_col = col_off + c
-                    candidatos_por_clase[clase_base].append((abs_row, abs_col))
+# ==========================
+# [2.5/7] REANUDACIÓN
+# ==========================
 
-logging.info("[3/7] Índices válidos por clase recopilados.")
+logging.info("[2.5/7] Consultando bloques completados y píxeles ya insertados...")
+
+crear_tablas_salida(engine)
+conexion = engine.raw_connection()
+try:
+    bloques_completados = cargar_bloques_completados(conexion, output_table, chunk_size, n_bloques)
+    entropia = np.random.SeedSequence(semilla).entropy
+    if semilla is None:
+        # Sin --semilla se reutiliza la entropía de la corrida que empezó la tabla, para reanudar la misma muestra
+        entropia = obtener_entropia(conexion, output_table, chunk_size, entropia)
+    if args.sin_deduplicar:
+        pixeles_existentes = np.empty(0, dtype=np.int64)
+    else:
+        pixeles_existentes = cargar_pixeles_existentes(
+            conexion, output_table, anio=None if formato_salida == "compacto" else anios[0]
+        )
+finally:
+    conexion.close()
+
+# Puntos de control en disco (sólo modo secuencial): reutilizan escaneo, muestreo y valores ya extraídos
+puntos_control = None
+if args.workers <= 1 and not args.sin_puntos_control:
+    puntos_control = PuntosControl(
+        args.puntos_control or directorio_puntos_control(input_tif), input_tif,
+        {"chunk_size": chunk_size, "bandas": bandas_idx, "modo": modo_muestreo, "porcentaje": porcentaje,
+         "semilla": semilla, "entropia": str(entropia)}
+    )
+    logging.info(f"[2.5/7] Puntos de control en {puntos_control.directorio}; "
+                 f"etapas registradas: {', '.join(puntos_control.manifiesto['etapas']) or 'ninguna'}")
+
+logging.info(f"[2.5/7] Bloques completados: {int(bloques_completados.sum()):,} de {n_bloques:,}; "
+             f"píxeles ya insertados: {len(pixeles_existentes):,}; semilla efectiva: {entropia}")
 
 # ==========================
-# [4] MUESTREO ESTRATIFICADO
+# [3-6/7] MODO PARALELO POR FRANJAS
 # ==========================
 
-logging.info("[4/7] Muestreo aleatorio estratificado por clase (10%)...")
+if args.workers > 1:
+    engine.dispose()  # no heredar conexiones abiertas a los procesos hijos
+
+    logging.info(f"[3-6/7] Muestreo paralelo con {args.workers} procesos y {args.escritores} escritores COPY...")
+    with metricas.etapa("muestreo_paralelo", workers=args.workers, escritores=args.escritores) as metrica:
+        contador_insertados = ejecutar_muestreo_paralelo(
+            input_tif, pg_url, output_table, epsg,
+            config={
+                "bandas_idx": bandas_idx, "chunk_size": chunk_size, "nodata": nodata, "anios": anios,
+                "bloque_insercion": bloque_insercion, "formato": formato_salida, "nombres_clase": nombres_clase,
+                "entropia": entropia, "bloques_completados": bloques_completados,
+                "pixeles_existentes": pixeles_existentes,
+            },
+            porcentaje=porcentaje, workers=args.workers, escritores=args.escritores,
+            metodo_geometria=metodo_geometria,
+            progreso=lambda tareas: tqdm(tareas, desc="Franjas"),
+            conteos=None if indice_clases is None else indice_clases["conteos"]
+        )
+        metrica["filas"] = contador_insertados
+    indexar_salida()
+    logging.info(f"[7/7] Muestreo completo. Total registros insertados: {contador_insertados:,}")
+    logging.info("[7/7] Proceso finalizado exitosamente.")
+    metricas.cerrar()
+    raise SystemExit(0)
 
-muestras_idx = []
-for clase, lista_indices in candidatos_por_clase.items():
-    total = len(lista_indices)
-    if total == 0:
-        continue
-    n_sample = max(1, int(round(total * porcentaje)))
-    seleccion = np.random.choice(range(total), size=n_sample, replace=False)
-    for idx in seleccion:
-        row, col = lista_indices[idx]
-        muestras_idx.append((clase, row, col))
+# ==========================
+# [3] PROCESAMIENTO POR BLOQUES
+# ==========================
 
-logging.info(f"[4/7] Total puntos muestreados: {len(muestras_idx):,}")
+muestreo_registrado = puntos_control is not None and puntos_control.completa("muestreo")
+
+if muestreo_registrado:
+    logging.info("[3/7] Muestra registrada en los puntos de control; se omite el escaneo.")
+elif puntos_control is not None and puntos_control.completa("escaneo"):
+    logging.info("[3/7] Escaneo tomado de los puntos de control (mapeado en memoria).")
+    if modo_muestreo == "conteos":
+        conteos_bloque = puntos_control.abrir("escaneo")["conteos"]
+    else:
+        candidatos_por_clase = puntos_control.abrir_candidatos()
+else:
+    with rasterio.open(input_tif) as src, metricas.etapa("escaneo", modo=modo_muestreo):
+        if modo_muestreo == "conteos":
+            if indice_clases is not None:
+                logging.info("[3/7] Conteos por bloque y clase tomados del índice (sin pasada de conteo).")
+                conteos_bloque = indice_clases["conteos"]
+            else:
+                logging.info("[3/7] Contando píxeles válidos por bloque y clase...")
+                conteos_bloque = contar_por_bloque(src, bandas_idx, chunk_size, nodata,
+                                                   progreso=lambda ventanas: tqdm(ventanas, desc="Conteo bloques"))
+            logging.info(f"[3/7] Píxeles válidos contados: {int(conteos_bloque.sum()):,} "
+                         f"en {int((conteos_bloque.sum(axis=1) > 0).sum()):,} bloques con datos.")
+        else:
+            logging.info("[3/7] Buscando píxeles válidos por bloque...")
+            candidatos_por_clase = escanear_candidatos(
+                src, bandas_idx, chunk_size, nodata, progreso=lambda filas: tqdm(filas, desc="Filas"),
+                con_datos=None if indice_clases is None else bloques_con_datos(indice_clases)
+            )
+            logging.info("[3/7] Índices válidos por clase recopilados.")
+    if puntos_control is not None:
+        if modo_muestreo == "conteos":
+            puntos_control.guardar("escaneo", conteos=conteos_bloque)
+        else:
+            puntos_control.guardar_candidatos(candidatos_por_clase)
 
 # ==========================
-# [4.5] UUIDs YA INSERTADOS
+# [4] MUESTREO ESTRATIFICADO
 # ==========================
 
-def obtener_uuids_existentes(engine, tabla_completa):
-    esquema, tabla = tabla_completa.split(".")
-    with engine.connect() as conn:
-        try:
-            existe = conn.execute(text(f"""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_schema = :esquema AND table_name = :tabla
+logging.info(f"[4/7] Muestreo aleatorio estratificado por clase ({porcentaje:.0%}, modo {modo_muestreo})...")
+
+if muestreo_registrado:
+    columnas_muestra = puntos_control.abrir("muestreo")
+    muestras_clase, muestras_planas = columnas_muestra["clases"], columnas_muestra["planos"]
+    logging.info("[4/7] Muestra tomada de los puntos de control (mapeada en memoria).")
+else:
+    with metricas.etapa("muestreo", modo=modo_muestreo) as metrica:
+        if modo_muestreo == "conteos":
+            rng = np.random.RandomState(np.random.SeedSequence(entropia).generate_state(4))
+            asignacion_bloque = asignar_muestras_por_bloque(conteos_bloque, porcentaje, rng)
+            with rasterio.open(input_tif) as src:
+                muestras_clase, muestras_planas = muestrear_por_conteos(
+                    src, bandas_idx, chunk_size, nodata, asignacion_bloque, entropia,
+                    progreso=lambda bloques: tqdm(bloques, desc="Muestreo bloques"),
+                    omitir=bloques_completados
                 )
-            """), {"esquema": esquema, "tabla": tabla}).scalar()
-            
-            if not existe:
-                logging.warning(f"[!] La tabla '{tabla_completa}' no existe aún. Continuando sin filtrar UUIDs.")
-                return set()
-            
-            result = conn.execute(text(f"SELECT DISTINCT uuid_muestra FROM {tabla_completa}"))
-            return set(row[0] for row in result)
-        
-        except Exception as e:
-            logging.warning(f"[!] Error inesperado al consultar UUIDs existentes: {e}")
-            return set()
-
-def uuid_determinista(row, col):
-    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{row}_{col}"))
+            del conteos_bloque, asignacion_bloque
+        else:
+            # RandomState(semilla) conserva las muestras del escaneo por píxel original para semillas de 32 bits
+            usar_semilla = semilla is not None and semilla < 2**32
+            rng = np.random.RandomState(semilla if usar_semilla else np.random.SeedSequence(entropia).generate_state(4))
+            muestras_clase, muestras_planas = muestrear_estratificado(candidatos_por_clase, porcentaje, rng)
+            del candidatos_por_clase
+        metrica["filas"] = len(muestras_planas)
+    if puntos_control is not None:
+        # Ordenada por bloque, para que la extracción trabaje por rangos de la muestra
+        muestras_clase, muestras_planas = puntos_control.guardar_muestra(muestras_clase, muestras_planas, width,
+                                                                         chunk_size, n_bloques)
+muestras_row, muestras_col = np.divmod(muestras_planas, width)
+
+logging.info(f"[4/7] Total puntos muestreados: {len(muestras_planas):,}")
 
-logging.info("[4.5/7] Consultando UUIDs ya insertados...")
-uuids_existentes = obtener_uuids_existentes(engine, output_table)
-logging.info(f"[4.5/7] UUIDs encontrados en BD: {len(uuids_existentes):,}")
+# ==========================
+# [4.5] MUESTRAS YA INSERTADAS
+# ==========================
 
-logging.info("[4.6/7] Filtrando muestras ya insertadas...")
+logging.info("[4.5/7] Filtrando muestras de bloques completados y píxeles ya insertados...")
 
-muestras_filtradas = []
-for clase, row, col in muestras_idx:
-    uid = uuid_determinista(row, col)
-    if uid not in uuids_existentes:
-        muestras_filtradas.append((clase, row, col, uid))
+nuevas = ~bloques_completados[indice_bloque(muestras_row, muestras_col, width, chunk_size)]
+nuevas &= filtrar_nuevos(muestras_planas, pixeles_existentes)
+posiciones = np.flatnonzero(nuevas)  # fila de cada punto nuevo en la muestra completa (puntos de control)
+muestras_clase, muestras_planas, muestras_row, muestras_col = (
+    muestras_clase[nuevas], muestras_planas[nuevas], muestras_row[nuevas], muestras_col[nuevas]
+)
 
-logging.info(f"[4.6/7] Puntos nuevos a procesar: {len(muestras_filtradas):,}")
+logging.info(f"[4.5/7] Puntos nuevos a procesar: {len(muestras_planas):,}")
 
 # ==========================
 # [5/7] EXTRACCIÓN E INSERCIÓN POR BLOQUES
 # ==========================
 
-logging.info("[5/7] Extrayendo valores multitemporales e insertando por bloques...")
-
-registros = []
+logging.info("[5/7] Extrayendo valores multitemporales e insertando por bloques con COPY...")
+
+def insertar_lote(conexion, lote):
+    """
+    Inserta con COPY los puntos extraídos en `lote` (lista de (bloque, idx, valores, xs, ys))
+    y registra sus bloques como completados en la misma transacción.
+    """
+    idx = np.concatenate([l[1] for l in lote])
+    columnas = columnas_muestreo(
+        formato_salida, muestras_planas[idx], uuids_deterministas(muestras_row[idx], muestras_col[idx]),
+        muestras_clase[idx], np.concatenate([l[2] for l in lote], axis=1),
+        np.concatenate([l[3] for l in lote]), np.concatenate([l[4] for l in lote]),
+        anios, epsg, nombres_clase, geometria=(metodo_geometria == "ewkb")
+    )
+    with metricas.etapa("insercion") as metrica:
+        try:
+            filas = copiar_muestras(conexion, output_table, columnas, epsg, metodo_geometria, confirmar=False)
+            registrar_bloques(conexion, output_table, chunk_size, [l[0] for l in lote], [len(l[1]) for l in lote])
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+        metrica["filas"] = filas
+    return filas
+
+
+lote = []
+filas_lote = 0
+filas_por_punto = 1 if formato_salida == "compacto" else len(anios)
 contador_insertados = 0
 
-with rasterio.open(input_tif) as src:
-    for idx, (clase_id, row, col, uuid_m) in enumerate(tqdm(muestras_filtradas, desc="Procesando puntos")):
-        try:
-            x, y = src.xy(row, col, offset="center")
-            clase_nombre = pixel_class_map.get(clase_id, f"Clase {clase_id}")
-
-            for i, anio in enumerate(anios):
-                val = src.read(i + 1, window=Window(col, row, 1, 1))[0, 0]
-                registros.append({
-                    "uuid_muestra": uuid_m,
-                    "year": anio,
-                    "clase_referencia": clase_nombre,
-                    "valor": int(val),
-                    "x": float(x),
-                    "y": float(y),
-                    "geometria": Point(float(x), float(y))
-                })
-
-        except Exception as e:
-            logging.warning(f"[!] Error extrayendo punto ({row}, {col}) o banda {i + 1}: {e}")
-            continue
-
-        if len(registros) >= bloque_insercion:
-            gdf_bloque = gpd.GeoDataFrame(registros, geometry="geometria", crs=crs)
-            gdf_bloque.to_postgis("muestreo_humedales_giz", engine,
-                                  schema="ecos_acuatico_continental",
-                                  if_exists="append", index=False)
-            contador_insertados += len(registros)
-            logging.info(f"[5/7] Insertados acumulados: {contador_insertados:,}")
-            registros.clear()
-
-# ==========================
-# [6/7] INSERTAR RESTANTES
-# ==========================
-
-logging.info("[6/7] Insertando registros restantes...")
-
-if registros:
-    gdf_final = gpd.GeoDataFrame(registros, geometry="geometria", crs=crs)
-    gdf_final.to_postgis("muestreo_humedales_giz", engine,
-                         schema="ecos_acuatico_continental",
-                         if_exists="append", index=False)
-    contador_insertados += len(registros)
-    logging.info(f"[6/7] Insertados acumulados (final): {contador_insertados:,}")
-    registros.clear()
+conexion = engine.raw_connection()
+try:
+    with rasterio.open(input_tif) as src, tqdm(total=len(muestras_planas), desc="Procesando puntos") as barra:
+        if puntos_control is not None:
+            valores_ventanas = puntos_control.iterar_valores(src, posiciones, bandas_idx, chunk_size)
+        else:
+            valores_ventanas = iterar_valores_por_ventana(src, muestras_row, muestras_col, bandas_idx, chunk_size)
+        # Sólo el tiempo de lectura de ventanas; las inserciones se miden aparte en insertar_lote
+        ventanas = metricas.medir_iterador("extraccion_valores", valores_ventanas, filas=lambda item: len(item[1]))
+        for bloque, idx, valores in ventanas:
+            xs, ys = coordenadas_centro(src.transform, muestras_row[idx], muestras_col[idx])
+            lote.append((bloque, idx, valores, xs, ys))
+            filas_lote += len(idx) * filas_por_punto
+            barra.update(len(idx))
+
+            if filas_lote >= bloque_insercion:
+                contador_insertados += insertar_lote(conexion, lote)
+                logging.info(f"[5/7] Insertados acumulados: {contador_insertados:,}")
+                lote.clear()
+                filas_lote = 0
+
+    # ==========================
+    # [6/7] INSERTAR RESTANTES
+    # ==========================
+
+    logging.info("[6/7] Insertando registros restantes...")
+
+    if lote:
+        contador_insertados += insertar_lote(conexion, lote)
+        logging.info(f"[6/7] Insertados acumulados (final): {contador_insertados:,}")
+        lote.clear()
+finally:
+    conexion.close()
 
 # ==========================
 # [7/7] CIERRE
 # ==========================
 
+indexar_salida()
 logging.info(f"[7/7] Muestreo completo. Total registros insertados: {contador_insertados:,}")
-logging.info("[7/7] Proceso finalizado exitosamente.")
\ No newline at end of file
+logging.info("[7/7] Proceso finalizado exitosamente.")
+metricas.cerrar()
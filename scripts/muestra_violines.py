@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Muestra estratificada de hasta N filas válidas por año y clase para los
+violines, resuelta en el servidor con una sola consulta (rand_key indexado o
+TABLESAMPLE), y conteos (year, clase, valor) agregados en SQL.
+"""
+
+import os
+
+import pandas as pd
+
+COLUMNAS = ["year", "clase_referencia", "valor"]
+
+
+def tiene_clave_aleatoria(conexion, tabla):
+    with conexion.cursor() as cursor:
+        cursor.execute("""
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attname = 'rand_key' AND NOT attisdropped;
+        """, (tabla,))
+        existe = cursor.fetchone() is not None
+    conexion.commit()
+    return existe
+
+
+def anios_disponibles(conexion, tabla):
+    """Años distintos de la tabla larga con un recorrido por saltos sobre el índice (year, ...)."""
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            WITH RECURSIVE anios AS (
+                SELECT min(year) AS year FROM {tabla}
+                UNION ALL
+                SELECT (SELECT min(year) FROM {tabla} WHERE year > anios.year)
+                FROM anios WHERE anios.year IS NOT NULL
+            )
+            SELECT year FROM anios WHERE year IS NOT NULL ORDER BY year;
+        """)
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def porcentaje_tablesample(conexion, tabla, n_estratos, n, sobremuestreo=20):
+    """Porcentaje de páginas para TABLESAMPLE SYSTEM que cubre n × estratos × sobremuestreo filas."""
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass;", (tabla,))
+        filas = float(cursor.fetchone()[0])
+    if filas <= 0:
+        return 100.0
+    return min(100.0, 100.0 * n * n_estratos * sobremuestreo / filas)
+
+
+def consulta_clave_larga(tabla, anios, clases, n):
+    sql = f"""
+        SELECT a.year, c.clase_referencia, s.valor
+        FROM unnest(%(anios)s::BIGINT[]) AS a(year)
+        CROSS JOIN unnest(%(clases)s::TEXT[]) AS c(clase_referencia)
+        CROSS JOIN LATERAL (
+            SELECT m.valor
+            FROM {tabla} m
+            WHERE m.year = a.year AND m.clase_referencia = c.clase_referencia
+              AND m.valor BETWEEN 1 AND 13
+            ORDER BY m.rand_key
+            LIMIT %(n)s
+        ) s
+    """
+    return sql, {"anios": list(anios), "clases": list(clases), "n": n}
+
+
+def consulta_clave_compacta(tabla, tabla_clases, anios, n):
+    # El filtro de valor va dentro del LIMIT, como en la tabla larga: N filas válidas por año y clase
+    sql = f"""
+        SELECT a.year::BIGINT AS year, c.nombre AS clase_referencia, s.valor::BIGINT AS valor
+        FROM {tabla_clases} c
+        CROSS JOIN unnest(%(anios)s::BIGINT[]) WITH ORDINALITY AS a(year, i)
+        CROSS JOIN LATERAL (
+            SELECT m.valores[a.i] AS valor
+            FROM {tabla} m
+            WHERE m.clase = c.codigo AND m.valores[a.i] BETWEEN 1 AND 13
+            ORDER BY m.rand_key
+            LIMIT %(n)s
+        ) s
+    """
+    return sql, {"anios": list(anios), "n": n}
+
+
+def consulta_tablesample_larga(tabla, porcentaje, n):
+    sql = f"""
+        SELECT year, clase_referencia, valor
+        FROM (
+            SELECT year, clase_referencia, valor,
+                   ROW_NUMBER() OVER (PARTITION BY year, clase_referencia ORDER BY random()) AS rn
+            FROM {tabla} TABLESAMPLE SYSTEM (%(porcentaje)s)
+            WHERE valor BETWEEN 1 AND 13
+        ) s
+        WHERE rn <= %(n)s
+    """
+    return sql, {"porcentaje": porcentaje, "n": n}
+
+
+def consulta_tablesample_compacta(tabla, tabla_clases, anios, porcentaje, n):
+    sql = f"""
+        SELECT year, clase_referencia, valor
+        FROM (
+            SELECT a.year::BIGINT AS year, c.nombre AS clase_referencia, a.valor::BIGINT AS valor,
+                   ROW_NUMBER() OVER (PARTITION BY s.clase, a.year ORDER BY s.orden) AS rn
+            FROM (
+                SELECT clase, valores, random() AS orden
+                FROM {tabla} TABLESAMPLE SYSTEM (%(porcentaje)s)
+            ) s
+            JOIN {tabla_clases} c ON c.codigo = s.clase
+            CROSS JOIN LATERAL unnest(%(anios)s::BIGINT[], s.valores) AS a(year, valor)
+            WHERE a.valor BETWEEN 1 AND 13
+        ) t
+        WHERE rn <= %(n)s
+    """
+    return sql, {"anios": list(anios), "porcentaje": porcentaje, "n": n}
+
+
+def consulta_muestra(conexion, tabla, n, clases, anios=None, metodo="clave", tabla_clases=None):
+    """
+    (sql, params) de la muestra estratificada con hasta `n` filas por año y clase.
+    Con `tabla_clases` se trata `tabla` como compacta. `anios` es obligatorio
+    salvo en la tabla larga con método clave, donde se detectan en el índice.
+    """
+    compacta = tabla_clases is not None
+    if metodo == "clave":
+        if compacta:
+            return consulta_clave_compacta(tabla, tabla_clases, anios, n)
+        anios = anios or anios_disponibles(conexion, tabla)
+        return consulta_clave_larga(tabla, anios, clases, n)
+    if metodo == "tablesample":
+        if anios is None:
+            raise ValueError("El método tablesample requiere `anios` para dimensionar el sobremuestreo")
+        n_estratos = len(clases) if compacta else len(clases) * len(anios)
+        porcentaje = porcentaje_tablesample(conexion, tabla, n_estratos, n)
+        if compacta:
+            return consulta_tablesample_compacta(tabla, tabla_clases, anios, porcentaje, n)
+        return consulta_tablesample_larga(tabla, porcentaje, n)
+    raise ValueError(f"Método de muestreo desconocido: {metodo}")
+
+
+def consulta_conteos_poblacion(tabla, anios=None, tabla_clases=None):
+    """(sql, params) de los conteos por (year, clase_referencia, valor) sobre toda la tabla."""
+    if tabla_clases is None:
+        sql = f"""
+            SELECT year, clase_referencia, valor, count(*) AS conteo
+            FROM {tabla}
+            WHERE valor BETWEEN 1 AND 13
+            GROUP BY year, clase_referencia, valor
+        """
+        return sql, {}
+    sql = f"""
+        SELECT a.year::BIGINT AS year, c.nombre AS clase_referencia, a.valor::BIGINT AS valor, count(*) AS conteo
+        FROM {tabla} m
+        JOIN {tabla_clases} c ON c.codigo = m.clase
+        CROSS JOIN LATERAL unnest(%(anios)s::BIGINT[], m.valores) AS a(year, valor)
+        WHERE a.valor BETWEEN 1 AND 13
+        GROUP BY 1, 2, 3
+    """
+    return sql, {"anios": list(anios)}
+
+
+def _ejecutar(conexion, sql, params, columnas):
+    with conexion.cursor() as cursor:
+        cursor.execute(sql, params)
+        df = pd.DataFrame(cursor.fetchall(), columns=columnas)
+    conexion.commit()
+    return df
+
+
+def muestra_estratificada(conexion, tabla, n, clases, anios=None, metodo="clave", tabla_clases=None):
+    """DataFrame (year, clase_referencia, valor) con hasta `n` filas por año y clase (ver `consulta_muestra`)."""
+    sql, params = consulta_muestra(conexion, tabla, n, clases, anios, metodo, tabla_clases)
+    return _ejecutar(conexion, sql, params, COLUMNAS)
+
+
+def conteos_estratificados(conexion, tabla, clases, anios=None, n=None, metodo="clave", tabla_clases=None):
+    """
+    DataFrame (year, clase_referencia, valor, conteo) agregado en el servidor: a
+    lo sumo 13 filas por año y clase, cualquiera sea `n`. Con `n` se agrega la
+    muestra estratificada; sin él, toda la tabla.
+    """
+    if n is None:
+        sql, params = consulta_conteos_poblacion(tabla, anios, tabla_clases)
+    else:
+        sql_muestra, params = consulta_muestra(conexion, tabla, n, clases, anios, metodo, tabla_clases)
+        sql = f"""
+            SELECT year, clase_referencia, valor, count(*) AS conteo
+            FROM ({sql_muestra}) s
+            GROUP BY year, clase_referencia, valor
+        """
+    return _ejecutar(conexion, sql, params, COLUMNAS + ["conteo"])
+
+
+def ruta_cache(directorio, tabla, metodo, n):
+    return os.path.join(directorio, f"violines_{tabla.split('.')[-1]}_{metodo}_{n}.parquet")
+
+
+def leer_cache(ruta):
+    """DataFrame guardado en `ruta`, o None si no existe o falta el motor Parquet."""
+    if not os.path.exists(ruta):
+        return None
+    try:
+        return pd.read_parquet(ruta)
+    except ImportError:
+        return None
+
+
+def guardar_cache(df, ruta):
+    """Guarda la muestra en Parquet; devuelve False si no hay motor Parquet (pyarrow/fastparquet)."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    try:
+        df.to_parquet(ruta, index=False)
+    except ImportError:
+        return False
+    return True
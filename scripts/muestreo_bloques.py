@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Escaneo vectorizado por bloques y muestreo estratificado del stack de humedales.
+
+Los candidatos se guardan como índices planos int64 (fila * ancho + columna)
+agrupados por clase, en el mismo orden en que los recorría el escaneo por
+píxel original, para que una misma semilla entregue las mismas muestras.
+"""
+
+import uuid
+from collections import defaultdict
+
+import numpy as np
+from rasterio.windows import Window
+
+
+def uuid_determinista(row, col):
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{row}_{col}"))
+
+
+def uuids_deterministas(filas, columnas):
+    return np.array([uuid_determinista(r, c) for r, c in zip(filas.tolist(), columnas.tolist())], dtype=object)
+
+
+def indice_bloque(filas, columnas, width, chunk_size):
+    """Índice global del bloque chunk_size×chunk_size que contiene cada píxel (orden de `iterar_ventanas`)."""
+    return (filas // chunk_size) * -(-width // chunk_size) + (columnas // chunk_size)
+
+
+def rng_bloque(entropia, bloque):
+    """RandomState propio de un bloque: su muestra no depende de qué otros bloques se procesen."""
+    return np.random.RandomState(np.random.SeedSequence(entropia, spawn_key=(int(bloque),)).generate_state(4))
+
+
+def iterar_ventanas(width, height, chunk_size, row_start=0, row_stop=None):
+    """Ventanas chunk_size×chunk_size en orden fila-columna, recortadas al borde."""
+    row_stop = height if row_stop is None else row_stop
+    for row_off in range(row_start, row_stop, chunk_size):
+        for col_off in range(0, width, chunk_size):
+            yield Window(col_off, row_off,
+                         min(chunk_size, width - col_off),
+                         min(chunk_size, row_stop - row_off))
+
+
+def mascara_validez_bandas(stack, nodata, valor_min=1, valor_max=13):
+    """Validez de cada píxel en cada banda de un bloque (bandas, filas, columnas)."""
+    return (stack != nodata) & np.isfinite(stack) & (stack >= valor_min) & (stack <= valor_max)
+
+
+def mascara_validez(stack, nodata, valor_min=1, valor_max=13):
+    """Píxeles válidos en todas las bandas de un bloque (bandas, filas, columnas)."""
+    return mascara_validez_bandas(stack, nodata, valor_min, valor_max).all(axis=0)
+
+
+def candidatos_bloque(stack, nodata, row_off, col_off, width):
+    """Clase de referencia (banda 1) e índice plano de cada píxel válido del bloque."""
+    validez = mascara_validez(stack, nodata)
+    rows, cols = np.nonzero(validez)
+    clases = stack[0][rows, cols].astype(np.int64)
+    planos = (rows.astype(np.int64) + row_off) * width + (cols.astype(np.int64) + col_off)
+    return clases, planos
+
+
+def agregar_candidatos(candidatos_por_clase, clases, planos):
+    """
+    Reparte los índices planos de un bloque en `candidatos_por_clase`
+    (clase -> lista de arrays). Las clases nuevas se insertan según su primera
+    aparición en el bloque para conservar el orden del escaneo por píxel.
+    """
+    if clases.size == 0:
+        return
+    conteos = np.bincount(clases)
+    orden = np.argsort(clases, kind="stable")
+    grupos = np.split(planos[orden], np.cumsum(conteos)[:-1])
+    presentes, primera = np.unique(clases, return_index=True)
+    for clase in presentes[np.argsort(primera)]:
+        candidatos_por_clase[int(clase)].append(grupos[clase])
+
+
+def escanear_candidatos(src, bandas_idx, chunk_size, nodata, progreso=None, con_datos=None):
+    """
+    Recorre el stack por ventanas y devuelve {clase: array int64 de índices planos}.
+    `progreso` envuelve el iterador de filas (p. ej. tqdm). `con_datos` (bool por
+    bloque, p. ej. del índice de clases) evita leer bloques sin píxeles válidos.
+    """
+    width, height = src.width, src.height
+    bloques_por_fila = -(-width // chunk_size)
+    candidatos_por_clase = defaultdict(list)
+    filas = range(0, height, chunk_size)
+    for row_off in (progreso(filas) if progreso else filas):
+        ventanas = iterar_ventanas(width, height, chunk_size, row_off, min(row_off + chunk_size, height))
+        for j, win in enumerate(ventanas):
+            if con_datos is not None and not con_datos[(row_off // chunk_size) * bloques_por_fila + j]:
+                continue
+            stack = src.read(bandas_idx, window=win)
+            clases, planos = candidatos_bloque(stack, nodata, win.row_off, win.col_off, width)
+            agregar_candidatos(candidatos_por_clase, clases, planos)
+    return {clase: np.concatenate(partes) for clase, partes in candidatos_por_clase.items()}
+
+
+def muestrear_estratificado(candidatos_por_clase, porcentaje, rng):
+    """
+    Selecciona round(total * porcentaje) índices por clase sin reemplazo.
+    Devuelve (clases, índices planos) en el orden clase por clase.
+    """
+    clases, planos = [], []
+    for clase, indices in candidatos_por_clase.items():
+        total = len(indices)
+        if total == 0:
+            continue
+        n_sample = max(1, int(round(total * porcentaje)))
+        seleccion = rng.choice(total, size=n_sample, replace=False)
+        clases.append(np.full(n_sample, clase, dtype=np.int16))
+        planos.append(indices[seleccion])
+    if not planos:
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int64)
+    return np.concatenate(clases), np.concatenate(planos)
+
+
+# ==========================
+# MUESTREO EN DOS PASADAS (CONTEOS POR BLOQUE)
+# ==========================
+
+def contar_por_bloque(src, bandas_idx, chunk_size, nodata, n_clases=13, progreso=None,
+                      row_start=0, row_stop=None):
+    """
+    Primera pasada: píxeles válidos por bloque y clase, sin guardar candidatos.
+    Devuelve una matriz int64 (bloques, n_clases + 1) en el orden de `iterar_ventanas`,
+    restringida opcionalmente a la franja de filas [row_start, row_stop).
+    """
+    ventanas = list(iterar_ventanas(src.width, src.height, chunk_size, row_start, row_stop))
+    conteos = np.zeros((len(ventanas), n_clases + 1), dtype=np.int64)
+    for i, win in enumerate(progreso(ventanas) if progreso else ventanas):
+        stack = src.read(bandas_idx, window=win)
+        validez = mascara_validez(stack, nodata)
+        conteos[i] = np.bincount(stack[0][validez].astype(np.int64), minlength=n_clases + 1)
+    return conteos
+
+
+def asignar_muestras_por_bloque(conteos, porcentaje, rng):
+    """
+    Reparte round(total * porcentaje) muestras de cada clase entre los bloques
+    con hipergeométricas sucesivas, equivalente a elegir sin reemplazo sobre
+    todos los candidatos de la clase.
+    """
+    asignacion = np.zeros_like(conteos)
+    for clase in range(conteos.shape[1]):
+        columna = conteos[:, clase]
+        total = int(columna.sum())
+        if total == 0:
+            continue
+        restantes = max(1, int(round(total * porcentaje)))
+        poblacion = total
+        for b in np.flatnonzero(columna):
+            if restantes == 0:
+                break
+            c = int(columna[b])
+            k = rng.hypergeometric(c, poblacion - c, restantes) if poblacion > c else restantes
+            asignacion[b, clase] = k
+            restantes -= k
+            poblacion -= c
+    return asignacion
+
+
+def muestrear_por_conteos(src, bandas_idx, chunk_size, nodata, asignacion, entropia, progreso=None,
+                          row_start=0, row_stop=None, omitir=None):
+    """
+    Segunda pasada: relee solo los bloques con muestras asignadas y elige dentro
+    de cada uno con `rng_bloque(entropia, bloque)`. Devuelve (clases, índices
+    planos) ordenados por bloque. `asignacion` corresponde a los bloques de la
+    franja [row_start, row_stop); `omitir` (bool por bloque global) salta bloques
+    ya completados sin alterar la muestra de los demás.
+    """
+    width = src.width
+    ventanas = list(iterar_ventanas(src.width, src.height, chunk_size, row_start, row_stop))
+    primer_bloque = (row_start // chunk_size) * -(-width // chunk_size)
+    bloques = np.flatnonzero(asignacion.sum(axis=1))
+    if omitir is not None:
+        bloques = bloques[~omitir[primer_bloque + bloques]]
+    clases, planos = [], []
+    for b in (progreso(bloques) if progreso else bloques):
+        win = ventanas[b]
+        rng = rng_bloque(entropia, primer_bloque + b)
+        stack = src.read(bandas_idx, window=win)
+        clases_b, planos_b = candidatos_bloque(stack, nodata, win.row_off, win.col_off, width)
+        for clase in np.flatnonzero(asignacion[b]):
+            k = int(asignacion[b, clase])
+            planos_clase = planos_b[clases_b == clase]
+            seleccion = np.sort(rng.choice(len(planos_clase), size=k, replace=False))
+            clases.append(np.full(k, clase, dtype=np.int16))
+            planos.append(planos_clase[seleccion])
+    if not planos:
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int64)
+    return np.concatenate(clases), np.concatenate(planos)
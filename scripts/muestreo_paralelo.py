@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Muestreo estratificado paralelo por franjas de filas del stack de humedales:
+un pool cuenta, muestrea y extrae por franja y uno o más escritores COPY vacían
+una cola acotada. Cada bloque usa su propio generador, así que la muestra no
+depende de la cantidad de procesos.
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+
+import numpy as np
+import rasterio
+from sqlalchemy import create_engine
+
+from muestreo_bloques import contar_por_bloque, asignar_muestras_por_bloque, muestrear_por_conteos, uuids_deterministas
+from extraccion_valores import iterar_valores_por_ventana, coordenadas_centro
+from carga_copy import columnas_muestreo, copiar_muestras
+from progreso_muestreo import registrar_bloques, filtrar_nuevos
+
+FRANJAS_POR_PROCESO = 4
+# Espera máxima por el total de cada escritor al cerrar (un COPY en curso puede tardar)
+TIMEOUT_ESCRITORES = 600
+
+# Estado de cada proceso trabajador, fijado por _iniciar_trabajador
+_src = None
+_cola = None
+_config = None
+_abortar = None
+
+
+def dividir_franjas(height, chunk_size, n_franjas):
+    """Franjas (row_start, row_stop) alineadas a chunk_size que cubren todas las filas."""
+    filas_bloque = -(-height // chunk_size)
+    n_franjas = max(1, min(n_franjas, filas_bloque))
+    cortes = np.linspace(0, filas_bloque, n_franjas + 1).round().astype(int) * chunk_size
+    return [(int(a), int(min(b, height))) for a, b in zip(cortes[:-1], cortes[1:])]
+
+
+def _iniciar_trabajador(input_tif, cola, config, abortar):
+    global _src, _cola, _config, _abortar
+    _src = rasterio.open(input_tif)
+    _cola = cola
+    _config = config
+    _abortar = abortar
+
+
+def _contar_franja(franja):
+    row_start, row_stop = franja
+    return contar_por_bloque(_src, _config["bandas_idx"], _config["chunk_size"], _config["nodata"],
+                             row_start=row_start, row_stop=row_stop)
+
+
+def _unir_lote(lote):
+    """Une ventanas (bloque, ids, clases, valores, xs, ys) en ((ids, uuids, clases, valores, xs, ys), bloques, puntos)."""
+    bloques, ids, clases, valores, xs, ys = zip(*lote)
+    puntos = [len(i) for i in ids]
+    ids = np.concatenate(ids)
+    filas, columnas = np.divmod(ids, _src.width)
+    datos = (ids, uuids_deterministas(filas, columnas), np.concatenate(clases),
+             np.concatenate(valores, axis=1), np.concatenate(xs), np.concatenate(ys))
+    return datos, list(bloques), puntos
+
+
+def _muestrear_franja(tarea):
+    """Muestrea, filtra y extrae una franja; envía lotes a la cola y devuelve los puntos enviados."""
+    (row_start, row_stop), asignacion = tarea
+    if _abortar.is_set():
+        return 0
+    bandas_idx, chunk_size = _config["bandas_idx"], _config["chunk_size"]
+
+    clases, planos = muestrear_por_conteos(_src, bandas_idx, chunk_size, _config["nodata"], asignacion,
+                                           _config["entropia"], row_start=row_start, row_stop=row_stop,
+                                           omitir=_config["bloques_completados"])
+    nuevos = filtrar_nuevos(planos, _config["pixeles_existentes"])
+    clases, planos = clases[nuevos], planos[nuevos]
+    filas, columnas = np.divmod(planos, _src.width)
+
+    filas_por_punto = 1 if _config["formato"] == "compacto" else len(bandas_idx)
+    lote, filas_lote, enviados = [], 0, 0
+    for bloque, idx, valores in iterar_valores_por_ventana(_src, filas, columnas, bandas_idx, chunk_size):
+        if _abortar.is_set():
+            return enviados
+        xs, ys = coordenadas_centro(_src.transform, filas[idx], columnas[idx])
+        lote.append((bloque, planos[idx], clases[idx], valores, xs, ys))
+        filas_lote += len(idx) * filas_por_punto
+        enviados += len(idx)
+        if filas_lote >= _config["bloque_insercion"]:
+            _cola.put(_unir_lote(lote))
+            lote, filas_lote = [], 0
+    if lote:
+        _cola.put(_unir_lote(lote))
+    return enviados
+
+
+def _escribir_lotes(cola, totales, pg_url, tabla, srid, config, metodo_geometria, abortar):
+    """
+    Escritor COPY: vacía la cola hasta recibir None. Cada lote y el registro de
+    sus bloques en la tabla de progreso se confirman juntos. Si falla una carga
+    o se pide abortar sigue vaciando (sin escribir) para no bloquear a los
+    trabajadores y reporta el error.
+    """
+    insertados, error, conexion = 0, None, None
+    try:
+        conexion = create_engine(pg_url).raw_connection()
+    except Exception as e:
+        logging.error(f"[!] Escritor {os.getpid()} no pudo conectarse: {e}")
+        error = str(e)
+
+    try:
+        while True:
+            lote = cola.get()
+            if lote is None:
+                break
+            if error is not None or abortar.is_set():
+                continue
+            datos, bloques, puntos = lote
+            try:
+                columnas = columnas_muestreo(config["formato"], *datos, config["anios"], srid,
+                                             config["nombres_clase"], geometria=(metodo_geometria == "ewkb"))
+                filas = copiar_muestras(conexion, tabla, columnas, srid, metodo_geometria, confirmar=False)
+                registrar_bloques(conexion, tabla, config["chunk_size"], bloques, puntos)
+                conexion.commit()
+                insertados += filas
+                logging.info(f"[5/7] Escritor {os.getpid()}: insertados acumulados {insertados:,}")
+            except Exception as e:
+                logging.error(f"[!] Escritor {os.getpid()} falló al insertar: {e}")
+                error = str(e)
+                conexion.close()  # descarta la transacción abierta
+                conexion = None
+    finally:
+        if conexion is not None:
+            conexion.close()
+        totales.put((insertados, error))
+
+
+def _cerrar_escritores(cola, totales, procesos):
+    """Envía el fin a cada escritor y recoge sus (insertados, error); los que no responden se terminan."""
+    resultados = []
+    try:
+        for _ in procesos:
+            cola.put(None, timeout=TIMEOUT_ESCRITORES)
+        for _ in procesos:
+            resultados.append(totales.get(timeout=TIMEOUT_ESCRITORES))
+    except (queue.Full, queue.Empty):
+        logging.error(f"[!] {len(procesos) - len(resultados)} escritor(es) COPY sin respuesta "
+                      f"tras {TIMEOUT_ESCRITORES} s; se terminan")
+        resultados += [(0, "sin respuesta")] * (len(procesos) - len(resultados))
+    for proceso in procesos:
+        proceso.join(timeout=TIMEOUT_ESCRITORES)
+        if proceso.is_alive():
+            proceso.terminate()
+            proceso.join()
+    return resultados
+
+
+def ejecutar_muestreo_paralelo(input_tif, pg_url, tabla, srid, config, porcentaje,
+                               workers, escritores=1, metodo_geometria="ewkb", progreso=None, conteos=None):
+    """
+    Ejecuta conteo, asignación, muestreo, extracción e inserción en paralelo.
+    `config` incluye bandas_idx, chunk_size, nodata, anios, bloque_insercion,
+    formato, nombres_clase, entropia, bloques_completados y pixeles_existentes.
+    Con `conteos` (p. ej. del índice de clases) se omite la pasada de conteo.
+    Devuelve el total de filas insertadas.
+    """
+    ctx = mp.get_context("fork")
+    with rasterio.open(input_tif) as src:
+        width, height = src.width, src.height
+    chunk_size = config["chunk_size"]
+    franjas = dividir_franjas(height, chunk_size, workers * FRANJAS_POR_PROCESO)
+    bloques_por_fila = -(-width // chunk_size)
+    rng_asignacion = np.random.RandomState(np.random.SeedSequence(config["entropia"]).generate_state(4))
+
+    cola = ctx.Queue(maxsize=2 * escritores)
+    totales = ctx.Queue()
+    abortar = ctx.Event()
+    procesos_escritores = [
+        ctx.Process(target=_escribir_lotes,
+                    args=(cola, totales, pg_url, tabla, srid, config, metodo_geometria, abortar))
+        for _ in range(escritores)
+    ]
+    for proceso in procesos_escritores:
+        proceso.start()
+
+    pool = ctx.Pool(workers, initializer=_iniciar_trabajador, initargs=(input_tif, cola, config, abortar))
+    try:
+        if conteos is None:
+            logging.info(f"[3/7] Contando píxeles válidos en {len(franjas)} franjas con {workers} procesos...")
+            conteos = np.concatenate(pool.map(_contar_franja, franjas))
+        logging.info(f"[3/7] Píxeles válidos contados: {int(conteos.sum()):,}")
+
+        asignacion = asignar_muestras_por_bloque(conteos, porcentaje, rng_asignacion)
+        logging.info(f"[4/7] Total puntos asignados: {int(asignacion.sum()):,}")
+
+        tareas, inicio = [], 0
+        for row_start, row_stop in franjas:
+            n_bloques = -(-(row_stop - row_start) // chunk_size) * bloques_por_fila
+            tareas.append(((row_start, row_stop), asignacion[inicio:inicio + n_bloques]))
+            inicio += n_bloques
+
+        resultados = pool.imap_unordered(_muestrear_franja, tareas)
+        puntos = 0
+        for _ in (progreso(range(len(tareas))) if progreso else range(len(tareas))):
+            puntos += next(resultados)
+        logging.info(f"[5/7] Puntos extraídos y encolados: {puntos:,}")
+    except BaseException:
+        # Las franjas pendientes terminan sin muestrear y los escritores descartan lo que quede en la cola
+        abortar.set()
+        raise
+    finally:
+        # close/join en vez de terminate: los trabajadores deben vaciar su búfer de la cola
+        pool.close()
+        pool.join()
+        resultados_escritores = _cerrar_escritores(cola, totales, procesos_escritores)
+
+    errores = [error for _, error in resultados_escritores if error is not None]
+    if errores:
+        raise RuntimeError(f"Fallaron {len(errores)} escritor(es) COPY: {errores[0]}")
+    return sum(insertados for insertados, _ in resultados_escritores)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Reanudación del muestreo de humedales: bloques insertados (`<tabla>_progreso`,
+en la misma transacción que el COPY), entropía por tamaño de bloque
+(`<tabla>_progreso_semilla`) y deduplicación por id_pixel.
+"""
+
+import numpy as np
+
+
+def tabla_progreso(tabla):
+    return f"{tabla}_progreso"
+
+
+def tabla_semilla(tabla):
+    return f"{tabla}_progreso_semilla"
+
+
+def crear_tabla_progreso(conexion, tabla):
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabla_progreso(tabla)} (
+                tamano_bloque INTEGER NOT NULL,
+                bloque INTEGER NOT NULL,
+                puntos INTEGER NOT NULL,
+                registrado TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (tamano_bloque, bloque)
+            );
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabla_semilla(tabla)} (
+                tamano_bloque INTEGER PRIMARY KEY,
+                entropia TEXT NOT NULL,
+                registrado TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+    conexion.commit()
+
+
+def obtener_entropia(conexion, tabla, chunk_size, entropia):
+    """Entropía registrada para este tamaño de bloque o, si no hay, `entropia` (que queda registrada)."""
+    with conexion.cursor() as cursor:
+        # Como texto: la entropía de SeedSequence puede superar 64 bits
+        cursor.execute(f"""
+            INSERT INTO {tabla_semilla(tabla)} (tamano_bloque, entropia) VALUES (%s, %s)
+            ON CONFLICT (tamano_bloque) DO NOTHING;
+        """, (chunk_size, str(entropia)))
+        cursor.execute(f"SELECT entropia FROM {tabla_semilla(tabla)} WHERE tamano_bloque = %s;", (chunk_size,))
+        registrada = cursor.fetchone()[0]
+    conexion.commit()
+    return int(registrada)
+
+
+def cargar_bloques_completados(conexion, tabla, chunk_size, n_bloques):
+    """Array bool (n_bloques) con True en los bloques ya insertados para este tamaño de bloque."""
+    completados = np.zeros(n_bloques, dtype=bool)
+    with conexion.cursor() as cursor:
+        cursor.execute(f"SELECT bloque FROM {tabla_progreso(tabla)} WHERE tamano_bloque = %s;", (chunk_size,))
+        bloques = np.array([fila[0] for fila in cursor.fetchall()], dtype=np.int64)
+    completados[bloques[bloques < n_bloques]] = True
+    return completados
+
+
+def registrar_bloques(conexion, tabla, chunk_size, bloques, puntos):
+    """Marca bloques como completados; el commit queda a cargo del llamador (junto con el COPY)."""
+    with conexion.cursor() as cursor:
+        cursor.executemany(f"""
+            INSERT INTO {tabla_progreso(tabla)} (tamano_bloque, bloque, puntos) VALUES (%s, %s, %s)
+            ON CONFLICT (tamano_bloque, bloque) DO UPDATE SET puntos = EXCLUDED.puntos, registrado = now();
+        """, [(chunk_size, int(b), int(p)) for b, p in zip(bloques, puntos)])
+
+
+def cargar_pixeles_existentes(conexion, tabla, anio=None, lote=1_000_000):
+    """
+    id_pixel ya presentes en `tabla` como array int64 ordenado y sin repetidos.
+    Con `anio` (formato largo) se lee una sola fila por punto. Usa un cursor del
+    lado del servidor para no traer todo de una vez.
+    """
+    filtro = f"AND year = {int(anio)}" if anio is not None else ""
+    partes = []
+    with conexion.cursor(name="pixeles_existentes") as cursor:
+        cursor.itersize = lote
+        cursor.execute(f"SELECT id_pixel FROM {tabla} WHERE id_pixel IS NOT NULL {filtro};")
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            partes.append(np.fromiter((fila[0] for fila in filas), dtype=np.int64, count=len(filas)))
+    conexion.commit()
+    if not partes:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(partes))
+
+
+def filtrar_nuevos(ids, existentes):
+    """Máscara de los ids que no están en `existentes` (array ordenado)."""
+    if existentes.size == 0:
+        return np.ones(len(ids), dtype=bool)
+    return np.isin(ids, existentes, assume_unique=True, invert=True)
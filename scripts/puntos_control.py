@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Puntos de control en disco entre las etapas del muestreo de humedales.
+
+Cada etapa (escaneo, muestreo, extracción) deja columnas .npy en un directorio
+registrado en `manifiesto.json`; al reejecutar se abren mapeadas en memoria y
+la extracción sigue desde los puntos pendientes.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from rasterio.windows import Window
+
+from indice_clases import firma_archivo
+from muestreo_bloques import indice_bloque
+
+VERSION_PUNTOS_CONTROL = 2
+# Columnas que escribe PuntosControl; son los únicos .npy que borra al descartar el directorio
+COLUMNAS = ("conteos", "candidatos", "candidatos_clases", "candidatos_cortes", "planos", "clases", "cortes",
+            "valores", "extraidos")
+
+
+def directorio_puntos_control(input_tif):
+    return f"{input_tif}.puntos_control"
+
+
+def guardar_npy(ruta, array):
+    """Escribe el .npy en un temporal y lo renombra, para no dejar columnas a medias."""
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as archivo:
+        np.save(archivo, np.asarray(array))
+    os.replace(temporal, ruta)
+
+
+class PuntosControl:
+    """Directorio de columnas .npy con su manifiesto; `parametros` debe ser serializable a JSON."""
+
+    def __init__(self, directorio, input_tif, parametros):
+        self.directorio = directorio
+        self.ruta_manifiesto = os.path.join(directorio, "manifiesto.json")
+        mtime_ns, tamano = firma_archivo(input_tif)
+        referencia = {"version": VERSION_PUNTOS_CONTROL, "mtime_ns": mtime_ns, "tamano": tamano,
+                      "parametros": parametros}
+        self.manifiesto = None
+        if not os.path.exists(self.ruta_manifiesto) and os.path.isdir(directorio) and os.listdir(directorio):
+            raise ValueError(f"{directorio} no está vacío y no tiene manifiesto; elija otro --puntos-control")
+        if os.path.exists(self.ruta_manifiesto):
+            with open(self.ruta_manifiesto, encoding="utf-8") as archivo:
+                manifiesto = json.load(archivo)
+            if all(manifiesto.get(clave) == valor for clave, valor in referencia.items()):
+                self.manifiesto = manifiesto
+            else:
+                logging.info(f"[i] Puntos de control desactualizados, se descartan: {directorio}")
+        if self.manifiesto is None:
+            os.makedirs(directorio, exist_ok=True)
+            self._descartar()
+            self.manifiesto = {**referencia, "etapas": {}}
+            self._guardar_manifiesto()
+        self._valores = None
+        self._extraidos = None
+
+    def _descartar(self):
+        """Borra las columnas de esta clase, sus temporales y, al final, el manifiesto; nada más del directorio."""
+        for nombre in tuple(f"{columna}.npy" for columna in COLUMNAS) + ("manifiesto.json",):
+            for ruta in (os.path.join(self.directorio, nombre), os.path.join(self.directorio, f"{nombre}.tmp")):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+
+    def _guardar_manifiesto(self):
+        temporal = f"{self.ruta_manifiesto}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(self.manifiesto, archivo, indent=2, sort_keys=True)
+        os.replace(temporal, self.ruta_manifiesto)
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, f"{nombre}.npy")
+
+    def completa(self, etapa):
+        return etapa in self.manifiesto["etapas"]
+
+    def guardar(self, etapa, **columnas):
+        """Guarda las columnas de una etapa y la registra como completa."""
+        for nombre, array in columnas.items():
+            guardar_npy(self._ruta(nombre), array)
+        self.manifiesto["etapas"][etapa] = {
+            nombre: {"dtype": str(np.asarray(array).dtype), "forma": list(np.shape(array))}
+            for nombre, array in columnas.items()
+        }
+        self._guardar_manifiesto()
+
+    def abrir(self, etapa):
+        """{columna: array de sólo lectura mapeado en memoria} de una etapa completa."""
+        return {nombre: np.load(self._ruta(nombre), mmap_mode="r") for nombre in self.manifiesto["etapas"][etapa]}
+
+    # ---- candidatos por clase (modo candidatos) ----
+
+    def guardar_candidatos(self, candidatos_por_clase):
+        clases = list(candidatos_por_clase)
+        cortes = np.cumsum([0] + [len(candidatos_por_clase[clase]) for clase in clases])
+        planos = (np.concatenate([candidatos_por_clase[clase] for clase in clases]) if clases
+                  else np.empty(0, dtype=np.int64))
+        self.guardar("escaneo", candidatos=planos, candidatos_clases=np.asarray(clases, dtype=np.int64),
+                     candidatos_cortes=cortes.astype(np.int64))
+
+    def abrir_candidatos(self):
+        """{clase: vista del array mapeado} en el orden en que se guardaron (el muestreo depende de él)."""
+        columnas = self.abrir("escaneo")
+        cortes = columnas["candidatos_cortes"]
+        return {int(clase): columnas["candidatos"][cortes[i]:cortes[i + 1]]
+                for i, clase in enumerate(columnas["candidatos_clases"])}
+
+    # ---- muestra ordenada por bloque ----
+
+    def guardar_muestra(self, clases, planos, width, chunk_size, n_bloques):
+        """
+        Ordena la muestra por bloque (estable) y la guarda con `cortes`, el
+        inicio de cada bloque en la muestra; devuelve (clases, planos) ordenados.
+        """
+        bloques = indice_bloque(*np.divmod(planos, width), width, chunk_size)
+        orden = np.argsort(bloques, kind="stable")
+        clases, planos = np.asarray(clases)[orden], np.asarray(planos)[orden]
+        cortes = np.searchsorted(bloques[orden], np.arange(n_bloques + 1)).astype(np.int64)
+        self.guardar("muestreo", planos=planos, clases=clases, cortes=cortes)
+        return clases, planos
+
+    # ---- extracción por puntos ----
+
+    def abrir_extraccion(self, n_puntos, n_bandas, dtype):
+        """Abre (o crea) valores (bandas, puntos) y extraidos (un bool por punto) como memmap de lectura y escritura."""
+        ruta_valores, ruta_extraidos = self._ruta("valores"), self._ruta("extraidos")
+        if not (os.path.exists(ruta_valores) and os.path.exists(ruta_extraidos)):
+            np.lib.format.open_memmap(ruta_valores, mode="w+", dtype=dtype, shape=(n_bandas, n_puntos)).flush()
+            np.lib.format.open_memmap(ruta_extraidos, mode="w+", dtype=bool, shape=(n_puntos,)).flush()
+        return (np.lib.format.open_memmap(ruta_valores, mode="r+"),
+                np.lib.format.open_memmap(ruta_extraidos, mode="r+"))
+
+    def iterar_valores(self, src, posiciones, bandas_idx, chunk_size):
+        """
+        Como `iterar_valores_por_ventana` para los puntos de la muestra en
+        `posiciones` (crecientes): genera (bloque, idx, valores) con `idx` los
+        índices dentro de `posiciones`. Cada bloque trabaja sobre su rango de la
+        muestra; sólo se lee la ventana si le quedan puntos sin extraer, que se
+        escriben y se marcan antes de entregarlos.
+        """
+        width, height = src.width, src.height
+        bloques_fila = -(-width // chunk_size)
+        muestreo = self.abrir("muestreo")
+        planos, cortes = muestreo["planos"], muestreo["cortes"]
+        valores, extraidos = self.abrir_extraccion(len(planos), len(bandas_idx), src.dtypes[0])
+        limites = np.searchsorted(posiciones, cortes)
+        hechos = 0
+        for bloque in np.flatnonzero(np.diff(limites)):
+            inicio, fin = int(cortes[bloque]), int(cortes[bloque + 1])
+            a, b = int(limites[bloque]), int(limites[bloque + 1])
+            locales = np.asarray(posiciones[a:b]) - inicio
+            valores_bloque, extraidos_bloque = valores[:, inicio:fin], extraidos[inicio:fin]
+            pendientes = locales[~extraidos_bloque[locales]]
+            hechos += len(locales) - len(pendientes)
+            if pendientes.size:
+                row_off, col_off = (int(v) * chunk_size for v in divmod(bloque, bloques_fila))
+                win = Window(col_off, row_off, min(chunk_size, width - col_off), min(chunk_size, height - row_off))
+                try:
+                    datos = src.read(bandas_idx, window=win)
+                except Exception as e:
+                    logging.warning(f"[!] Error leyendo ventana ({row_off}, {col_off}) "
+                                    f"con {pendientes.size:,} puntos: {e}")
+                    continue
+                filas, columnas = np.divmod(planos[inicio + pendientes], width)
+                valores_bloque[:, pendientes] = datos[:, filas - row_off, columnas - col_off]
+                valores.flush()
+                extraidos_bloque[pendientes] = True
+                extraidos.flush()
+            yield int(bloque), np.arange(a, b), valores_bloque[:, locales]
+        if hechos:
+            logging.info(f"[5/7] {hechos:,} puntos con valores tomados de los puntos de control.")
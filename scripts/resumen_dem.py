@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Overviews (ST_CreateOverview, un factor por conexión) y resumen por comuna
+(`medio_fisico.dem_resumen_comunas`) de las tablas DEM ya cargadas.
+
+    python scripts/resumen_dem.py --comuna 2101 --comuna 2102
+    python scripts/resumen_dem.py --refrescar medio_fisico.dem_antofagasta --overviews --entorno P
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FACTORES_OVERVIEW = (4, 16, 64)
+ALGORITMO_OVERVIEW = "Bilinear"
+TABLA_RESUMEN = "medio_fisico.dem_resumen_comunas"
+COLUMNAS_RESUMEN = ("tabla_dem", "id_comuna", "teselas", "pixeles", "suma", "media", "desviacion",
+                    "minimo", "maximo", "actualizado")
+
+
+def _partes(tabla):
+    esquema, _, nombre = tabla.rpartition(".")
+    return esquema or "public", nombre
+
+
+def tabla_overview(tabla, factor):
+    """Nombre que ST_CreateOverview da al overview `factor` de `tabla`."""
+    esquema, nombre = _partes(tabla)
+    return f"{esquema}.o_{factor}_{nombre}"
+
+
+def _crear_overview(conectar, tabla, columna, factor, algoritmo):
+    overview = tabla_overview(tabla, factor)
+    inicio = time.perf_counter()
+    conexion = conectar()
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {overview};")
+            cursor.execute("SELECT ST_CreateOverview(%s::regclass, %s, %s, %s);", (tabla, columna, factor, algoritmo))
+            cursor.execute(f"CREATE INDEX ON {overview} USING GIST (ST_ConvexHull({columna}));")
+            cursor.execute(f"ANALYZE {overview};")
+        conexion.commit()
+    finally:
+        conexion.close()
+    segundos = time.perf_counter() - inicio
+    print(f"[overviews] {overview} (factor {factor}) en {segundos:,.1f} s")
+    return overview
+
+
+def crear_overviews(conectar, tabla, factores=FACTORES_OVERVIEW, columna="geometria_raster",
+                    algoritmo=ALGORITMO_OVERVIEW, workers=None):
+    """
+    (Re)crea los overviews de `tabla`, uno por factor y cada uno con su propia
+    conexión de `conectar()`. Devuelve los nombres de las tablas creadas.
+    """
+    with ThreadPoolExecutor(max_workers=workers or len(factores)) as pool:
+        return list(pool.map(lambda factor: _crear_overview(conectar, tabla, columna, factor, algoritmo), factores))
+
+
+def crear_tabla_resumen(conexion, tabla_resumen=TABLA_RESUMEN):
+    with conexion.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabla_resumen} (
+                tabla_dem TEXT NOT NULL,
+                id_comuna INTEGER NOT NULL,
+                teselas BIGINT NOT NULL,
+                pixeles BIGINT NOT NULL,
+                suma DOUBLE PRECISION,
+                media DOUBLE PRECISION,
+                desviacion DOUBLE PRECISION,
+                minimo DOUBLE PRECISION,
+                maximo DOUBLE PRECISION,
+                actualizado TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (tabla_dem, id_comuna)
+            );
+        """)
+    conexion.commit()
+
+
+def actualizar_resumen(conexion, tabla, columna="geometria_raster", tabla_resumen=TABLA_RESUMEN):
+    """Reemplaza en una transacción las filas de `tabla` en el resumen; devuelve las comunas resumidas."""
+    inicio = time.perf_counter()
+    crear_tabla_resumen(conexion, tabla_resumen)
+    with conexion.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {tabla_resumen} WHERE tabla_dem = %s;", (tabla,))
+        cursor.execute(f"""
+            INSERT INTO {tabla_resumen} (tabla_dem, id_comuna, teselas, pixeles, suma, media, desviacion,
+                                         minimo, maximo)
+            SELECT %s, id_comuna, teselas, (s).count, (s).sum, (s).mean, (s).stddev, (s).min, (s).max
+            FROM (
+                SELECT id_comuna, count(*) AS teselas, ST_SummaryStatsAgg({columna}, 1, TRUE, 1.0) AS s
+                FROM {tabla}
+                WHERE id_comuna IS NOT NULL
+                GROUP BY id_comuna
+            ) t;
+        """, (tabla,))
+        comunas = cursor.rowcount
+    conexion.commit()
+    print(f"[resumen] {tabla}: {comunas:,} comunas en {time.perf_counter() - inicio:,.1f} s")
+    return comunas
+
+
+def estadisticas_comunas(conexion, comunas=None, tablas=None, tabla_resumen=TABLA_RESUMEN):
+    """Filas del resumen (dicts con COLUMNAS_RESUMEN), filtradas opcionalmente por id_comuna y tabla DEM."""
+    filtros, parametros = [], []
+    if comunas:
+        filtros.append("id_comuna = ANY(%s)")
+        parametros.append(list(comunas))
+    if tablas:
+        filtros.append("tabla_dem = ANY(%s)")
+        parametros.append(list(tablas))
+    donde = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    with conexion.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM {tabla_resumen} {donde} "
+                       "ORDER BY tabla_dem, id_comuna;", parametros)
+        filas = [dict(zip(COLUMNAS_RESUMEN, fila)) for fila in cursor.fetchall()]
+    conexion.commit()
+    return filas
+
+
+def estadisticas_region(conexion, tabla, tabla_resumen=TABLA_RESUMEN):
+    """Estadísticas de toda la tabla DEM combinando sus comunas, sin leer teselas."""
+    filas = [f for f in estadisticas_comunas(conexion, tablas=[tabla], tabla_resumen=tabla_resumen) if f["pixeles"]]
+    if not filas:
+        return None
+    pixeles = sum(f["pixeles"] for f in filas)
+    media = sum(f["suma"] for f in filas) / pixeles
+    # Varianza combinada a partir de la media y la desviación (poblacional) de cada comuna
+    cuadrados = sum(f["pixeles"] * (f["desviacion"] ** 2 + f["media"] ** 2) for f in filas)
+    return {
+        "tabla_dem": tabla, "comunas": len(filas), "teselas": sum(f["teselas"] for f in filas),
+        "pixeles": pixeles, "media": media, "desviacion": max(cuadrados / pixeles - media ** 2, 0.0) ** 0.5,
+        "minimo": min(f["minimo"] for f in filas), "maximo": max(f["maximo"] for f in filas),
+        "actualizado": max(f["actualizado"] for f in filas),
+    }
+
+
+def main():
+    import psycopg2
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Overviews y estadísticas por comuna de las tablas DEM.")
+    parser.add_argument("--comuna", type=int, action="append", help="id_comuna a consultar (repetible)")
+    parser.add_argument("--tabla", action="append", help="Tabla DEM a consultar (repetible)")
+    parser.add_argument("--region", help="Estadísticas combinadas de una tabla DEM")
+    parser.add_argument("--refrescar", metavar="TABLA", help="Recalcular el resumen de una tabla DEM recargada")
+    parser.add_argument("--overviews", action="store_true", help="Con --refrescar, recrear también los overviews")
+    parser.add_argument("--entorno", choices=("", "P"), default="",
+                        help="Claves DB_*_<entorno> del .env: vacío como dem_multi_etl.py, P como dem_etl.py")
+    args = parser.parse_args()
+
+    config = dotenv_values("/home/dps_chanar/.env")
+    sufijo = f"_{args.entorno}" if args.entorno else ""
+
+    def conectar():
+        return psycopg2.connect(dbname=config[f'DB_NAME{sufijo}'], user=config[f'DB_USER{sufijo}'],
+                                password=config[f'DB_PASSWORD{sufijo}'], host=config[f'DB_HOST{sufijo}'])
+
+    conexion = conectar()
+    try:
+        if args.refrescar:
+            if args.overviews:
+                crear_overviews(conectar, args.refrescar)
+            actualizar_resumen(conexion, args.refrescar)
+        if args.region:
+            region = estadisticas_region(conexion, args.region)
+            print(region if region else f"{args.region} no tiene filas en {TABLA_RESUMEN}")
+        if args.comuna or args.tabla or not (args.refrescar or args.region):
+            print(f"{'tabla':<32} {'comuna':>7} {'teselas':>8} {'píxeles':>12} {'media':>9} {'desv.':>8} "
+                  f"{'mín.':>8} {'máx.':>8}")
+            for f in estadisticas_comunas(conexion, args.comuna, args.tabla):
+                print(f"{f['tabla_dem']:<32} {f['id_comuna']:>7} {f['teselas']:>8,} {f['pixeles']:>12,} "
+                      f"{f['media'] or 0:>9.1f} {f['desviacion'] or 0:>8.1f} {f['minimo'] or 0:>8.0f} "
+                      f"{f['maximo'] or 0:>8.0f}")
+    finally:
+        conexion.close()
+
+
+if __name__ == "__main__":
+    main()
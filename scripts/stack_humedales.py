@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Construcción del stack multibanda de humedales (un año por banda) desde los
+GeoTIFF anuales, validando cabeceras y una muestra de bloques en vez de cada
+raster completo; no se reescribe si la huella de las entradas no cambió.
+
+    python scripts/stack_humedales.py --formato tif --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from muestreo_bloques import iterar_ventanas
+
+DIRECTORIO = "/home/dps_chanar/raster_data/humedales_giz"
+RASTERS_ANUALES = {
+    2015: "bb97bc4d-3490-4d50-9de4-2409a160c48e.tif", 2016: "3b342275-80e1-41dc-b10b-bbfec3d959d3.tif",
+    2017: "2770a8a2-612c-4e00-b3f2-b8b48bd7d4f6.tif", 2018: "cfb82bc7-a213-4958-af4d-4a7bbf49230c.tif",
+    2019: "abf4e94b-abb4-4937-a1a6-cf5be31d7619.tif", 2020: "efbde6dd-0e3e-49a2-99a9-9e84ea09b06e.tif",
+    2021: "e75459aa-5d85-4a82-b566-12819c8f3412.tif", 2022: "af2683cb-f449-487c-bda7-9cae9ff67086.tif",
+    2023: "a781d13a-f64e-426a-894b-b30724f88bc0.tif", 2024: "3f25ffed-3c4b-4901-9b63-5a58d45300c9.tif",
+}
+FORMATOS = {"tif": ".tif", "nc": ".nc", "zarr": ".zarr"}
+VERSION_HUELLA = 1
+CAMPOS_CABECERA = ("crs", "transform", "width", "height", "count", "dtype", "nodata")
+
+
+def leer_cabecera(ruta):
+    """Metadatos del archivo sin leer píxeles."""
+    with rasterio.open(ruta) as src:
+        return {
+            "crs": src.crs.to_string() if src.crs else None,
+            "transform": list(src.transform)[:6],
+            "width": src.width, "height": src.height, "count": src.count,
+            "dtype": src.dtypes[0], "nodata": src.nodata,
+            "bloque": list(src.block_shapes[0]),
+            "overviews": src.overviews(1),
+        }
+
+
+def validar_cabeceras(cabeceras):
+    """Lanza ValueError si alguna cabecera difiere de la primera en CAMPOS_CABECERA."""
+    etiquetas = list(cabeceras)
+    referencia = cabeceras[etiquetas[0]]
+    diferencias = [
+        f"{etiqueta}: {campo} = {cabecera[campo]!r} (esperado {referencia[campo]!r})"
+        for etiqueta in etiquetas[1:] for campo in CAMPOS_CABECERA
+        if cabeceras[etiqueta][campo] != referencia[campo]
+    ]
+    if diferencias:
+        raise ValueError("Rasters no alineados:\n" + "\n".join(diferencias))
+    return referencia
+
+
+def ventanas_muestra(cabecera, n_bloques, semilla=0):
+    """Hasta `n_bloques` ventanas de bloques internos elegidas al azar (reproducible)."""
+    alto_bloque, ancho_bloque = cabecera["bloque"]
+    filas = -(-cabecera["height"] // alto_bloque)
+    columnas = -(-cabecera["width"] // ancho_bloque)
+    rng = np.random.default_rng(semilla)
+    indices = rng.choice(filas * columnas, size=min(n_bloques, filas * columnas), replace=False)
+    ventanas = []
+    for indice in np.sort(indices):
+        fila, columna = divmod(int(indice), columnas)
+        row_off, col_off = fila * alto_bloque, columna * ancho_bloque
+        ventanas.append(Window(col_off, row_off, min(ancho_bloque, cabecera["width"] - col_off),
+                               min(alto_bloque, cabecera["height"] - row_off)))
+    return ventanas
+
+
+def validar_contenido(ruta, cabecera, n_bloques=16, valores_validos=None, semilla=0):
+    """
+    Lee el overview más chico (si hay) y `n_bloques` bloques al azar. Lanza
+    ValueError con valores fuera de `valores_validos` (nodata se acepta).
+    Devuelve {sha256 de los bloques leídos, fracción nodata, valores vistos}.
+    """
+    nodata = cabecera["nodata"]
+    resumen = hashlib.sha256()
+    vistos, pixeles, nulos = set(), 0, 0
+    with rasterio.open(ruta) as src:
+        muestras = []
+        if cabecera["overviews"]:
+            factor = cabecera["overviews"][-1]
+            muestras.append(src.read(1, out_shape=(max(1, src.height // factor), max(1, src.width // factor))))
+        for ventana in ventanas_muestra(cabecera, n_bloques, semilla):
+            bloque = src.read(1, window=ventana)
+            resumen.update(bloque.tobytes())
+            muestras.append(bloque)
+    for muestra in muestras:
+        valores, conteos = np.unique(muestra, return_counts=True)
+        for valor, conteo in zip(valores.tolist(), conteos.tolist()):
+            pixeles += conteo
+            if nodata is not None and valor == nodata:
+                nulos += conteo
+            else:
+                vistos.add(valor)
+    if valores_validos is not None:
+        invalidos = sorted(vistos - set(valores_validos))
+        if invalidos:
+            raise ValueError(f"{ruta}: valores fuera de las clases válidas en la muestra: {invalidos[:20]}")
+    return {"sha256": resumen.hexdigest(), "fraccion_nodata": nulos / pixeles if pixeles else 1.0,
+            "valores": sorted(vistos)}
+
+
+def huella(rutas, cabeceras, contenidos, opciones):
+    """Huella de las entradas y de las opciones de escritura."""
+    entradas = []
+    for etiqueta, ruta in rutas.items():
+        estado = os.stat(ruta)
+        cabecera = {campo: cabeceras[etiqueta][campo] for campo in CAMPOS_CABECERA}
+        entradas.append({"etiqueta": str(etiqueta), "ruta": os.path.abspath(ruta), "tamano": estado.st_size,
+                         "mtime_ns": estado.st_mtime_ns, "cabecera": cabecera,
+                         "muestra_sha256": contenidos[etiqueta]["sha256"]})
+    texto = json.dumps({"version": VERSION_HUELLA, "entradas": entradas, "opciones": opciones}, sort_keys=True)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def ruta_huella(salida):
+    return f"{salida}.huella.json"
+
+
+def salida_vigente(salida, valor_huella):
+    ruta = ruta_huella(salida)
+    if not (os.path.exists(salida) and os.path.exists(ruta)):
+        return False
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo).get("huella") == valor_huella
+
+
+def guardar_huella(salida, valor_huella, etiquetas):
+    temporal = f"{ruta_huella(salida)}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump({"huella": valor_huella, "bandas": [str(e) for e in etiquetas]}, archivo, indent=2)
+    os.replace(temporal, ruta_huella(salida))
+
+
+def escribir_tif(rutas, cabecera, salida, chunk_size=1024, workers=4, compresion="DEFLATE", progreso=None):
+    """
+    Stack GeoTIFF teselado: cada hilo lee las bandas de un bloque (con su propio
+    handle por archivo) y el hilo principal escribe en orden; GDAL comprime con
+    NUM_THREADS. A lo sumo 2 × workers bloques quedan en memoria.
+    """
+    etiquetas = list(rutas)
+    locales = threading.local()
+    abiertas = []
+
+    def leer_bloque(ventana):
+        if not hasattr(locales, "fuentes"):
+            locales.fuentes = [rasterio.open(rutas[e]) for e in etiquetas]
+            abiertas.extend(locales.fuentes)
+        return ventana, np.stack([fuente.read(1, window=ventana) for fuente in locales.fuentes])
+
+    perfil = {
+        "driver": "GTiff", "width": cabecera["width"], "height": cabecera["height"], "count": len(etiquetas),
+        "dtype": cabecera["dtype"], "nodata": cabecera["nodata"], "crs": cabecera["crs"],
+        "transform": rasterio.Affine(*cabecera["transform"]), "tiled": True,
+        "blockxsize": min(chunk_size, 1024), "blockysize": min(chunk_size, 1024),
+        "compress": compresion, "predictor": 2 if compresion in ("DEFLATE", "LZW", "ZSTD") else 1,
+        "num_threads": "ALL_CPUS", "bigtiff": "IF_SAFER",
+    }
+    ventanas = list(iterar_ventanas(cabecera["width"], cabecera["height"], chunk_size))
+    temporal = f"{salida}.tmp.tif"
+    with rasterio.open(temporal, "w", **perfil) as dst, ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, etiqueta in enumerate(etiquetas, start=1):
+            dst.set_band_description(i, str(etiqueta))
+        pendientes = deque()
+        iterador = iter(progreso(ventanas) if progreso else ventanas)
+        for ventana in iterador:
+            pendientes.append(pool.submit(leer_bloque, ventana))
+            if len(pendientes) >= 2 * workers:
+                escrita, datos = pendientes.popleft().result()
+                dst.write(datos, window=escrita)
+        while pendientes:
+            escrita, datos = pendientes.popleft().result()
+            dst.write(datos, window=escrita)
+    for fuente in abiertas:
+        fuente.close()
+    os.replace(temporal, salida)
+    return salida
+
+
+def abrir_stack_xarray(rutas, chunk_size=1024):
+    """DataArray (banda, y, x) perezoso con dask, un chunk por bloque chunk_size×chunk_size y banda."""
+    import rioxarray  # noqa: F401  (registra el accesor .rio)
+    import xarray as xr
+
+    capas = [rioxarray.open_rasterio(ruta, chunks={"band": 1, "y": chunk_size, "x": chunk_size}, lock=False)
+             .squeeze("band", drop=True) for ruta in rutas.values()]
+    stack = xr.concat(capas, dim="banda").assign_coords(banda=[str(e) for e in rutas])
+    return stack.rename("clase")
+
+
+def escribir_xarray(rutas, salida, formato, chunk_size=1024, workers=4, nivel_compresion=4):
+    """NetCDF (zlib por chunk) o Zarr (Blosc zstd con hilos) calculado en paralelo por dask."""
+    import dask
+
+    stack = abrir_stack_xarray(rutas, chunk_size)
+    temporal = f"{salida}.tmp{FORMATOS[formato]}"
+    with dask.config.set(scheduler="threads", num_workers=workers):
+        if formato == "nc":
+            chunks = (1, min(chunk_size, stack.sizes["y"]), min(chunk_size, stack.sizes["x"]))
+            codificacion = {"clase": {"zlib": True, "complevel": nivel_compresion, "chunksizes": chunks}}
+            stack.to_netcdf(temporal, engine="netcdf4", encoding=codificacion)
+        else:
+            import shutil
+            from numcodecs import Blosc
+
+            Blosc.set_nthreads(workers)
+            compresor = Blosc(cname="zstd", clevel=nivel_compresion, shuffle=Blosc.BITSHUFFLE)
+            shutil.rmtree(temporal, ignore_errors=True)
+            stack.to_dataset().to_zarr(temporal, mode="w", encoding={"clase": {"compressor": compresor}})
+            shutil.rmtree(salida, ignore_errors=True)
+    os.replace(temporal, salida)
+    return salida
+
+
+def construir_stack(rutas, salida, formato="tif", chunk_size=1024, workers=4, n_bloques=16,
+                    valores_validos=None, forzar=False, progreso=None):
+    """
+    Valida las entradas ({etiqueta: ruta}, en orden de bandas) y escribe el
+    stack si su huella cambió. Devuelve (ruta de salida, reutilizada).
+    """
+    logging.info("[1/3] Validando cabeceras...")
+    cabeceras = {etiqueta: leer_cabecera(ruta) for etiqueta, ruta in rutas.items()}
+    cabecera = validar_cabeceras(cabeceras)
+
+    logging.info(f"[2/3] Validando contenido ({n_bloques} bloques por archivo)...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        resultados = pool.map(lambda e: validar_contenido(rutas[e], cabeceras[e], n_bloques, valores_validos),
+                              rutas)
+        contenidos = dict(zip(rutas, resultados))
+    for etiqueta, contenido in contenidos.items():
+        logging.info(f"    {etiqueta}: nodata en la muestra {contenido['fraccion_nodata']:.1%}, "
+                     f"valores {contenido['valores']}")
+
+    opciones = {"formato": formato, "chunk_size": chunk_size}
+    valor_huella = huella(rutas, cabeceras, contenidos, opciones)
+    if not forzar and salida_vigente(salida, valor_huella):
+        logging.info(f"[✓] Stack vigente en {salida}, se reutiliza.")
+        return salida, True
+
+    logging.info(f"[3/3] Escribiendo stack {formato} en {salida}...")
+    if formato == "tif":
+        escribir_tif(rutas, cabecera, salida, chunk_size, workers, progreso=progreso)
+    else:
+        escribir_xarray(rutas, salida, formato, chunk_size, workers)
+    guardar_huella(salida, valor_huella, rutas)
+    return salida, False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el stack multibanda de humedales desde los TIFF anuales.")
+    parser.add_argument("--directorio", default=DIRECTORIO)
+    parser.add_argument("--formato", choices=list(FORMATOS), default="tif")
+    parser.add_argument("--salida", default=None, help="Por defecto, <directorio>/stack_humedales.<formato>")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=4, help="Hilos de lectura / dask")
+    parser.add_argument("--bloques-muestra", type=int, default=16, help="Bloques leídos por archivo al validar")
+    parser.add_argument("--n-clases", type=int, default=13)
+    parser.add_argument("--forzar", action="store_true", help="Reescribir aunque la huella coincida")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from tqdm import tqdm
+
+    rutas = {anio: os.path.join(args.directorio, nombre) for anio, nombre in sorted(RASTERS_ANUALES.items())}
+    salida = args.salida or os.path.join(args.directorio, f"stack_humedales{FORMATOS[args.formato]}")
+    construir_stack(rutas, salida, args.formato, args.chunk_size, args.workers, args.bloques_muestra,
+                    valores_validos=range(1, args.n_clases + 1), forzar=args.forzar,
+                    progreso=lambda ventanas: tqdm(ventanas, desc="Escribiendo bloques"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import argparse
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -7,6 +8,12 @@ import matplotlib.patches as mpatches
 from dotenv import dotenv_values
 from sqlalchemy import create_engine
 from tqdm import tqdm
+from muestra_violines import (
+    muestra_estratificada, conteos_estratificados, tiene_clave_aleatoria, ruta_cache, leer_cache, guardar_cache
+)
+from violines_ponderados import estadisticas_violines, dibujar_violines
+from esquema_muestreo import agregar_clave_aleatoria
+from instrumentacion import agregar_argumentos, crear_instrumentacion
 
 # ======================
 # [1/4] CONFIGURACIÓN
@@ -14,53 +21,98 @@ from tqdm import tqdm
 
 print("[1/4] Cargando configuración...")
 
-N_PUNTOS_POR_CLASE_ANIO = 500  # ← PARAMETRIZABLE
+parser = argparse.ArgumentParser(description="Violines por clase y año desde la muestra de humedales.")
+parser.add_argument("--n", type=int, default=500, help="Puntos por clase/año")
+parser.add_argument("--metodo", choices=["clave", "tablesample"], default="clave",
+                    help="clave: primeras N filas por rand_key indexado; "
+                         "tablesample: TABLESAMPLE SYSTEM con sobremuestreo, sin DDL")
+parser.add_argument("--formato", choices=["largo", "compacto"], default="largo",
+                    help="Tabla de salida del muestreo a consultar")
+parser.add_argument("--preparar-clave", action="store_true",
+                    help="Agregar rand_key y su índice (reescribe la tabla una vez)")
+parser.add_argument("--agregado", choices=["muestra", "poblacion", "ninguno"], default="muestra",
+                    help="muestra: conteos por (año, clase, valor) de la muestra, agregados en SQL; "
+                         "poblacion: conteos de toda la tabla; ninguno: traer las filas crudas")
+parser.add_argument("--refrescar", action="store_true", help="Ignorar la muestra guardada en Parquet")
+agregar_argumentos(parser)
+args = parser.parse_args()
+metricas = crear_instrumentacion("violinplot_test", args)
+
+N_PUNTOS_POR_CLASE_ANIO = args.n
+TABLA_MUESTREO = "ecos_acuatico_continental.muestreo_humedales_giz"
+TABLA_COMPACTA = "ecos_acuatico_continental.muestreo_humedales_giz_compacto"
+TABLA_CLASES = "ecos_acuatico_continental.clases_humedales_giz"
+ANIOS = list(range(2015, 2025))
+DIRECTORIO_CACHE = "/home/dps_chanar/etl_raster/cache"
+
+# Mapeo de clases (etiquetas de clase_referencia)
+pixel_class_map = {
+    1: "Superficie agrícola", 2: "Superficie arbórea", 3: "Superficie herbácea",
+    4: "Superficie arbustiva y estepas leñosas", 5: "Superficies artificiales",
+    6: "Vegetación dispersa", 7: "Suelo desnudo", 8: "Hielo y nieve",
+    9: "Mares y océanos", 10: "Turberas Sphagnosas",
+    11: "Turberas Sphagnosas y/o Pulvinadas", 12: "Vegas y mallines",
+    13: "Cuerpos de agua continental"
+}
+clases_ordenadas = [pixel_class_map[i] for i in range(1, 14)]
+
+compacta = args.formato == "compacto"
+tabla = TABLA_COMPACTA if compacta else TABLA_MUESTREO
 
 env = dotenv_values(os.path.expanduser("/home/dps_chanar/.env"))
 pg_url = f"postgresql://{env['DB_USER_P']}:{env['DB_PASSWORD_P']}@{env['DB_HOST_P']}/{env['DB_NAME_P']}"
 engine = create_engine(pg_url)
 
 # ======================
-# [2/4] CONSULTA SQL POR AÑO
+# [2/4] MUESTRA ESTRATIFICADA EN EL SERVIDOR
 # ======================
 
-print("[2/4] Consultando años disponibles...")
-with engine.connect() as conn:
-    years = pd.read_sql("""
-        SELECT DISTINCT year
-        FROM ecos_acuatico_continental.muestreo_humedales_giz
-        WHERE valor BETWEEN 1 AND 13
-        ORDER BY year
-    """, conn)["year"].tolist()
-
-print(f"[2/4] Años detectados: {years}")
-print("[2/4] Ejecutando muestreo estratificado por clase y año...")
-
-df_total = pd.DataFrame()
-
-for year in tqdm(years, desc="Procesando años"):
-    query_year = f"""
-        WITH datos_ordenados AS (
-            SELECT
-                year,
-                clase_referencia,
-                valor,
-                ROW_NUMBER() OVER (
-                    PARTITION BY clase_referencia
-                    ORDER BY RANDOM()
-                ) AS rn
-            FROM ecos_acuatico_continental.muestreo_humedales_giz
-            WHERE valor BETWEEN 1 AND 13 AND year = {year}
-        )
-        SELECT year, clase_referencia, valor
-        FROM datos_ordenados
-        WHERE rn <= {N_PUNTOS_POR_CLASE_ANIO}
-    """
-    with engine.connect() as conn:
-        df_chunk = pd.read_sql(query_year, conn)
-        df_total = pd.concat([df_total, df_chunk], ignore_index=True)
-
-print(f"[2/4] Total registros cargados: {len(df_total):,}")
+agregado = args.agregado != "ninguno"
+if args.agregado == "poblacion":
+    archivo_cache = ruta_cache(DIRECTORIO_CACHE, tabla, "conteos", "poblacion")
+elif agregado:
+    archivo_cache = ruta_cache(DIRECTORIO_CACHE, tabla, f"{args.metodo}_conteos", N_PUNTOS_POR_CLASE_ANIO)
+else:
+    archivo_cache = ruta_cache(DIRECTORIO_CACHE, tabla, args.metodo, N_PUNTOS_POR_CLASE_ANIO)
+df_total = None if args.refrescar else leer_cache(archivo_cache)
+
+if df_total is not None:
+    print(f"[2/4] Muestra leída desde {archivo_cache}")
+else:
+    print(f"[2/4] Muestreo estratificado por clase y año ({args.metodo}, agregado: {args.agregado}) "
+          "en una sola consulta...")
+    with metricas.etapa("consulta", metodo=args.metodo, agregado=args.agregado) as metrica:
+        conexion = engine.raw_connection()
+        try:
+            if args.metodo == "clave" and args.agregado != "poblacion":
+                if args.preparar_clave:
+                    print("[2/4] Agregando rand_key e índice (puede tardar en tablas grandes)...")
+                    agregar_clave_aleatoria(conexion, tabla, compacta=compacta)
+                elif not tiene_clave_aleatoria(conexion, tabla):
+                    raise SystemExit(f"{tabla} no tiene rand_key: ejecutar con --preparar-clave o usar --metodo tablesample")
+            anios_consulta = ANIOS if compacta or args.metodo == "tablesample" else None
+            tabla_clases = TABLA_CLASES if compacta else None
+            if agregado:
+                df_total = conteos_estratificados(
+                    conexion, tabla, clases_ordenadas, anios=anios_consulta,
+                    n=None if args.agregado == "poblacion" else N_PUNTOS_POR_CLASE_ANIO,
+                    metodo=args.metodo, tabla_clases=tabla_clases
+                )
+            else:
+                df_total = muestra_estratificada(conexion, tabla, N_PUNTOS_POR_CLASE_ANIO, clases_ordenadas,
+                                                 anios=anios_consulta, metodo=args.metodo, tabla_clases=tabla_clases)
+        finally:
+            conexion.close()
+        metrica["filas"] = len(df_total)
+    if guardar_cache(df_total, archivo_cache):
+        print(f"[2/4] Muestra guardada en {archivo_cache}")
+    else:
+        print("[2/4] Sin motor Parquet (pyarrow); la muestra no se guardó")
+
+if agregado:
+    print(f"[2/4] Conteos cargados: {len(df_total):,} filas que representan {int(df_total['conteo'].sum()):,} registros")
+else:
+    print(f"[2/4] Total registros cargados: {len(df_total):,}")
 
 # ======================
 # [3/4] GRAFICAR VIOLINPLOTS
@@ -68,77 +120,87 @@ print(f"[2/4] Total registros cargados: {len(df_total):,}")
 
 print("[3/4] Generando gráfico de violines...")
 
-df_total["year"] = df_total["year"].astype(str)
-ordered_years = sorted(df_total["year"].unique())
-
-# Mapeo de colores por clase
-pixel_class_map = {
-    1: "Superficie agrícola", 2: "Superficie arbórea", 3: "Superficie herbácea",
-    4: "Superficie arbustiva y estepas leñosas", 5: "Superficies artificiales",
-    6: "Vegetación dispersa", 7: "Suelo desnudo", 8: "Hielo y nieve",
-    9: "Mares y océanos", 10: "Turberas Sphagnosas",
-    11: "Turberas Sphagnosas y/o Pulvinadas", 12: "Vegas y mallines",
-    13: "Cuerpos de agua continental"
-}
-clases_ordenadas = [pixel_class_map[i] for i in range(1, 14)]
-
-palette = sns.color_palette("tab20", n_colors=13)
-color_dict = {clase: palette[i] for i, clase in enumerate(clases_ordenadas)}
-
-fig, axes = plt.subplots(nrows=1, ncols=len(ordered_years), figsize=(5 * len(ordered_years), 6), sharey=True)
-
-# Asegurar que axes sea iterable
-if len(ordered_years) == 1:
-    axes = [axes]
-
-for i, year in enumerate(tqdm(ordered_years, desc="Graficando subplots")):
-    ax = axes[i]
-    data_year = df_total[df_total["year"] == year]
-
-    if data_year.empty:
-        ax.set_title(f"Año {year} (sin datos)")
-        ax.axis("off")
-        continue
-
-    sns.violinplot(
-        data=data_year,
-        x="clase_referencia",
-        y="valor",
-        ax=ax,
-        scale="width",
-        inner="box",
-        linewidth=1,
-        hue="clase_referencia",
-        palette=color_dict,
-        order=clases_ordenadas
+with metricas.etapa("grafico", agregado=args.agregado) as metrica:
+    df_total["year"] = df_total["year"].astype(str)
+    ordered_years = sorted(df_total["year"].unique())
+
+    # Mapeo de colores por clase
+    palette = sns.color_palette("tab20", n_colors=13)
+    color_dict = {clase: palette[i] for i, clase in enumerate(clases_ordenadas)}
+
+    if agregado:
+        # Con la muestra el ancho de banda usa n=N para suavizar como un violín de N filas crudas;
+        # con la población, el total de píxeles de cada grupo
+        n_ancho = None if args.agregado == "poblacion" else N_PUNTOS_POR_CLASE_ANIO
+        violines = estadisticas_violines(df_total, n_ancho=n_ancho)
+
+    fig, axes = plt.subplots(nrows=1, ncols=len(ordered_years), figsize=(5 * len(ordered_years), 6), sharey=True)
+
+    # Asegurar que axes sea iterable
+    if len(ordered_years) == 1:
+        axes = [axes]
+
+    for i, year in enumerate(tqdm(ordered_years, desc="Graficando subplots")):
+        ax = axes[i]
+        data_year = df_total[df_total["year"] == year]
+
+        if data_year.empty:
+            ax.set_title(f"Año {year} (sin datos)")
+            ax.axis("off")
+            continue
+
+        if agregado:
+            dibujar_violines(ax, {clase: violines[(year, clase)] for clase in clases_ordenadas
+                                  if (year, clase) in violines},
+                             clases_ordenadas, color_dict)
+        else:
+            sns.violinplot(
+                data=data_year,
+                x="clase_referencia",
+                y="valor",
+                ax=ax,
+                scale="width",
+                inner="box",
+                linewidth=1,
+                hue="clase_referencia",
+                palette=color_dict,
+                order=clases_ordenadas
+            )
+
+        ax.set_title(f"Año {year}", fontsize=12)
+        ax.set_xlabel("")
+        ax.set_xticks([])  # Quitar etiquetas del eje x
+
+        if i == 0:
+            ax.set_ylabel("Valor de clase observada")
+        else:
+            ax.set_ylabel("")
+
+    # Crear leyenda global
+    handles = [mpatches.Patch(color=color_dict[clase], label=clase) for clase in clases_ordenadas]
+    fig.legend(handles=handles, title="Clase de cobertura", loc="lower center", ncol=5, bbox_to_anchor=(0.5, -0.05))
+
+    # Título general y ajuste de layout
+    plt.tight_layout(rect=(0, 0.05, 1, 0.93))
+    descripcion_muestra = ("población completa" if args.agregado == "poblacion"
+                           else f"{N_PUNTOS_POR_CLASE_ANIO} puntos por clase/año")
+    fig.suptitle(
+        f"Distribución por clase y año Muestra: {descripcion_muestra}",
+        fontsize=14,
+        bbox=dict(facecolor="white", edgecolor="black", boxstyle="round,pad=0.3")
     )
 
-    ax.set_title(f"Año {year}", fontsize=12)
-    ax.set_xlabel("")
-    ax.set_xticks([])  # Quitar etiquetas del eje x
-
-    if i == 0:
-        ax.set_ylabel("Valor de clase observada")
-    else:
-        ax.set_ylabel("")
-
-# Crear leyenda global
-handles = [mpatches.Patch(color=color_dict[clase], label=clase) for clase in clases_ordenadas]
-fig.legend(handles=handles, title="Clase de cobertura", loc="lower center", ncol=5, bbox_to_anchor=(0.5, -0.05))
-
-# Título general y ajuste de layout
-plt.tight_layout(rect=(0, 0.05, 1, 0.93))
-fig.suptitle(
-    f"Distribución por clase y año Muestra: {N_PUNTOS_POR_CLASE_ANIO} puntos por clase/año",
-    fontsize=14,
-    bbox=dict(facecolor="white", edgecolor="black", boxstyle="round,pad=0.3")
-)
+    metrica["filas"] = int(df_total["conteo"].sum()) if agregado else len(df_total)
 
 # ======================
 # [4/4] GUARDAR FIGURA
 # ======================
 
-output_path = f"/home/dps_chanar/etl_raster/figures/violinplot_muestreo_sql_{N_PUNTOS_POR_CLASE_ANIO}.png"
+sufijo = "poblacion" if args.agregado == "poblacion" else N_PUNTOS_POR_CLASE_ANIO
+output_path = f"/home/dps_chanar/etl_raster/figures/violinplot_muestreo_sql_{sufijo}.png"
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
-plt.savefig(output_path, dpi=600)
+with metricas.etapa("guardado_figura"):
+    plt.savefig(output_path, dpi=600)
 print(f"[4/4] Gráfico guardado en: {output_path}")
+
+metricas.cerrar()
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Los módulos de scripts/ se importan entre sí por nombre, como al ejecutarlos desde esa carpeta."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import shapely
+
+from carga_copy import buffer_csv, columnas_formato_compacto, columnas_formato_largo, ewkb_hex_puntos
+
+
+def test_ewkb_hex_puntos_igual_a_shapely():
+    xs, ys = np.array([350123.5, -12.25]), np.array([7412345.0, 0.5])
+    esperado = [shapely.to_wkb(shapely.set_srid(shapely.Point(x, y), 32719), hex=True, include_srid=True,
+                               byte_order=1)
+                for x, y in zip(xs, ys)]
+    assert ewkb_hex_puntos(xs, ys, 32719).tolist() == esperado
+
+
+def test_formato_largo_una_fila_por_punto_y_anio():
+    valores = np.array([[1, 2], [3, 4], [5, 6]])  # (años, puntos)
+    columnas = columnas_formato_largo(np.array([10, 11]), np.array(["a", "b"], dtype=object),
+                                      np.array(["X", "Y"], dtype=object), valores, np.array([0.0, 1.0]),
+                                      np.array([2.0, 3.0]), [2018, 2019, 2020], 32719)
+    assert columnas["year"].tolist() == [2018, 2019, 2020] * 2
+    assert columnas["valor"].tolist() == [1, 3, 5, 2, 4, 6]
+    assert columnas["id_pixel"].tolist() == [10] * 3 + [11] * 3
+
+
+def test_formato_compacto_csv():
+    columnas = columnas_formato_compacto(np.array([7]), np.array(["u"], dtype=object), np.array([3]),
+                                         np.array([[1], [13]]), np.array([1.5]), np.array([2.5]), 32719,
+                                         geometria=False)
+    buffer, filas = buffer_csv(columnas)
+    assert filas == 1
+    assert buffer.getvalue() == 'u,7,3,"{1,13}",1.5,2.5\n'
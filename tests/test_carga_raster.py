@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import itertools
+import struct
+
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+
+from carga_raster import TIENE_NODATA, TIPOS_PIXEL, cargar_raster, mascara_valores, tesela_wkb, valor_nodata
+
+
+def test_tesela_wkb_cabecera_y_bandas():
+    transform = Affine(12.5, 0.0, 300000.0, 0.0, -12.5, 7500000.0)
+    datos = np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4)
+    nodatas = [valor_nodata(datos.dtype, -9999)] * 2
+    wkb = tesela_wkb(datos, nodatas, transform, col_off=256, row_off=512, srid=32719)
+
+    cabecera = struct.unpack_from("<BHHddddddiHH", wkb)
+    assert cabecera == (1, 0, 2, 12.5, -12.5, 300000.0 + 256 * 12.5, 7500000.0 - 512 * 12.5, 0.0, 0.0, 32719, 4, 3)
+    posicion = struct.calcsize("<BHHddddddiHH")
+    for banda in datos:
+        assert wkb[posicion] == TIPOS_PIXEL[np.dtype("int16")] | TIENE_NODATA
+        assert struct.unpack_from("<h", wkb, posicion + 1)[0] == -9999
+        pixeles = np.frombuffer(wkb, dtype="<i2", count=banda.size, offset=posicion + 3).reshape(banda.shape)
+        assert (pixeles == banda).all()
+        posicion += 3 + banda.nbytes
+    assert posicion == len(wkb)
+
+
+def test_tesela_wkb_big_endian_se_escribe_little_endian():
+    datos = np.array([[[1.5, -2.0]]], dtype=">f4")
+    wkb = tesela_wkb(datos, [valor_nodata(np.dtype("float32"), np.nan)], Affine.identity(), 0, 0, 4326)
+    assert np.frombuffer(wkb[-8:], dtype="<f4").tolist() == [1.5, -2.0]
+
+
+def test_valor_nodata_recorta_enteros():
+    assert valor_nodata(np.dtype("uint8"), -9999) == 0
+    assert valor_nodata(np.dtype("int16"), 40000) == 32767
+
+
+def test_mascara_valores_nodata_nan():
+    datos = np.array([[[np.nan, 1.0], [np.nan, np.nan]],
+                      [[np.nan, np.nan], [2.0, np.nan]]], dtype=np.float32)
+    nodatas = [valor_nodata(datos.dtype, np.nan)] * 2
+    assert mascara_valores(datos, nodatas).tolist() == [[False, True], [True, False]]
+
+
+class _Conexion:
+    """Conexión falsa: registra el SQL y falla en el COPY número `fallar_en`."""
+
+    def __init__(self, registro, copias, fallar_en):
+        self.registro, self.copias, self.fallar_en, self.autocommit = registro, copias, fallar_en, False
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.registro.append(sql)
+
+    def copy_expert(self, sql, archivo):
+        if next(self.copias) == self.fallar_en:
+            raise RuntimeError("COPY fallido")
+
+    def commit(self):
+        self.registro.append("COMMIT")
+
+    def close(self):
+        pass
+
+
+def test_cargar_raster_borra_tabla_si_falla_un_copy(tmp_path):
+    ruta = tmp_path / "dem.tif"
+    with rasterio.open(ruta, "w", driver="GTiff", width=8, height=8, count=1, dtype="float32", crs="EPSG:32719",
+                       transform=Affine(30, 0, 0, 0, -30, 240), nodata=-9999) as dst:
+        dst.write(np.arange(64, dtype="float32").reshape(1, 8, 8))
+    registro, copias = [], itertools.count(1)
+    with pytest.raises(RuntimeError, match="COPY"):
+        cargar_raster(str(ruta), "esquema.dem", lambda: _Conexion(registro, copias, fallar_en=2), 32719,
+                      tamano_tesela=2, workers=1, conexiones=2, vacuum=False)
+    assert registro[-2:] == ["DROP TABLE IF EXISTS esquema.dem;", "COMMIT"]
+    assert not any("CREATE INDEX" in sql for sql in registro)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from descargas import Manifiesto, crear_sesion, descargar, descargar_reanudando, descargar_todos
+
+
+class Servidor:
+    """Servidor HTTP local con ETag, Range e If-Range; `cortes[ruta]` corta la próxima respuesta tras n bytes."""
+
+    def __init__(self):
+        self.archivos = {}
+        self.cortes = {}
+        self.rangos = []
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _cabeceras(self, codigo, datos, etag, inicio=0):
+                self.send_response(codigo)
+                self.send_header("ETag", etag)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(len(datos) - inicio))
+                if codigo == 206:
+                    self.send_header("Content-Range", f"bytes {inicio}-{len(datos) - 1}/{len(datos)}")
+                self.end_headers()
+
+            def do_HEAD(self):
+                datos, etag = servidor.archivos[self.path]
+                self._cabeceras(200, datos, etag)
+
+            def do_GET(self):
+                datos, etag = servidor.archivos[self.path]
+                rango = self.headers.get("Range")
+                servidor.rangos.append((self.path, rango))
+                inicio = 0
+                if rango and self.headers.get("If-Range", etag) == etag:
+                    inicio = int(rango.split("=")[1].rstrip("-"))
+                    if inicio >= len(datos):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(datos)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                self._cabeceras(206 if inicio else 200, datos, etag, inicio)
+                corte = servidor.cortes.pop(self.path, None)
+                if corte is not None:
+                    self.wfile.write(datos[inicio:inicio + corte])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(datos[inicio:])
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.hilo = threading.Thread(target=self.http.serve_forever, daemon=True)
+        self.hilo.start()
+
+    def url(self, ruta):
+        return f"http://127.0.0.1:{self.http.server_address[1]}{ruta}"
+
+    def cerrar(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+
+@pytest.fixture
+def servidor():
+    servidor = Servidor()
+    yield servidor
+    servidor.cerrar()
+
+
+@pytest.fixture
+def sesion():
+    return crear_sesion(4, reintentos=0, espera=0)
+
+
+def _datos(n, semilla=0):
+    return bytes((i * 31 + semilla) % 251 for i in range(n))
+
+
+def test_corte_a_mitad_se_retoma_desde_el_parcial(servidor, sesion, tmp_path):
+    datos = _datos(200_000)
+    servidor.archivos["/dem.rar"] = (datos, '"v1"')
+    servidor.cortes["/dem.rar"] = 64 * 1024
+    destino = str(tmp_path / "dem.rar")
+    manifiesto = Manifiesto(str(tmp_path / "manifiesto.json"))
+
+    descargar_reanudando(servidor.url("/dem.rar"), destino, sesion, manifiesto, intentos=2, tamano_bloque=4096)
+
+    with open(destino, "rb") as archivo:
+        assert archivo.read() == datos
+    assert not os.path.exists(f"{destino}.part")
+    rango = servidor.rangos[-1][1]
+    assert rango is not None and int(rango.split("=")[1].rstrip("-")) > 0
+    assert manifiesto.obtener(servidor.url("/dem.rar"))["sha256"] == hashlib.sha256(datos).hexdigest()
+
+
+def test_se_omite_si_el_manifiesto_coincide(servidor, sesion, tmp_path):
+    servidor.archivos["/a.rar"] = (_datos(5000), '"v1"')
+    destino = str(tmp_path / "a.rar")
+    manifiesto = Manifiesto(str(tmp_path / "manifiesto.json"))
+    descargar(servidor.url("/a.rar"), destino, sesion, manifiesto)
+    servidor.rangos.clear()
+    descargar(servidor.url("/a.rar"), destino, sesion, manifiesto)
+    assert servidor.rangos == []
+
+
+@pytest.mark.parametrize("cambio", ["archivo_corrupto", "etag_nuevo"])
+def test_se_descarga_de_nuevo_si_cambia(servidor, sesion, tmp_path, cambio):
+    servidor.archivos["/a.rar"] = (_datos(5000), '"v1"')
+    destino = str(tmp_path / "a.rar")
+    manifiesto = Manifiesto(str(tmp_path / "manifiesto.json"))
+    descargar(servidor.url("/a.rar"), destino, sesion, manifiesto)
+    if cambio == "archivo_corrupto":
+        with open(destino, "r+b") as archivo:
+            archivo.write(b"\xff\xff")
+        esperado = _datos(5000)
+    else:
+        esperado = _datos(5000, semilla=7)
+        servidor.archivos["/a.rar"] = (esperado, '"v2"')
+    servidor.rangos.clear()
+    descargar(servidor.url("/a.rar"), destino, sesion, manifiesto)
+    assert len(servidor.rangos) == 1
+    with open(destino, "rb") as archivo:
+        assert archivo.read() == esperado
+
+
+def test_parcial_completo_sin_renombrar(servidor, sesion, tmp_path):
+    datos = _datos(8000)
+    url = servidor.url("/a.rar")
+    servidor.archivos["/a.rar"] = (datos, '"v1"')
+    destino = str(tmp_path / "a.rar")
+    manifiesto = Manifiesto(str(tmp_path / "manifiesto.json"))
+    manifiesto.actualizar(url, etag_parcial='"v1"')
+    with open(f"{destino}.part", "wb") as archivo:
+        archivo.write(datos)
+
+    descargar(url, destino, sesion, manifiesto)
+
+    assert servidor.rangos == [("/a.rar", "bytes=8000-")]
+    with open(destino, "rb") as archivo:
+        assert archivo.read() == datos
+    assert manifiesto.obtener(url)["sha256"] == hashlib.sha256(datos).hexdigest()
+
+
+def test_parcial_mas_largo_que_el_recurso_se_descarta(servidor, sesion, tmp_path):
+    datos = _datos(3000)
+    url = servidor.url("/a.rar")
+    servidor.archivos["/a.rar"] = (datos, '"v1"')
+    destino = str(tmp_path / "a.rar")
+    manifiesto = Manifiesto(str(tmp_path / "manifiesto.json"))
+    manifiesto.actualizar(url, etag_parcial='"v1"')
+    with open(f"{destino}.part", "wb") as archivo:
+        archivo.write(_datos(5000))
+
+    descargar(url, destino, sesion, manifiesto)
+
+    assert [rango for _, rango in servidor.rangos] == ["bytes=5000-", None]
+    with open(destino, "rb") as archivo:
+        assert archivo.read() == datos
+
+
+def test_descargar_todos_en_paralelo(servidor, tmp_path):
+    tareas = []
+    for i in range(5):
+        servidor.archivos[f"/r{i}.rar"] = (_datos(20_000 + i, semilla=i), f'"e{i}"')
+        tareas.append((servidor.url(f"/r{i}.rar"), str(tmp_path / f"r{i}.rar")))
+    servidor.cortes["/r2.rar"] = 1000
+
+    resultados = descargar_todos(tareas, str(tmp_path), workers=3)
+
+    assert resultados == {url: destino for url, destino in tareas}
+    for i, (_, destino) in enumerate(tareas):
+        with open(destino, "rb") as archivo:
+            assert archivo.read() == _datos(20_000 + i, semilla=i)
+    assert os.path.exists(tmp_path / "descargas_manifest.json")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from etapas_etl import ejecutar_etapas
+
+
+def _etapas(llamadas, falla=()):
+    def descargar(trabajo):
+        llamadas.append(("descarga", trabajo["id"]))
+        return {"archivo": f"{trabajo['id']}.rar"}
+
+    def cargar(trabajo):
+        llamadas.append(("carga", trabajo["id"]))
+        if trabajo["id"] in falla:
+            raise RuntimeError("sin conexión")
+        return {"tabla": trabajo["archivo"].replace(".rar", "")}
+
+    return [{"nombre": "descarga", "funcion": descargar, "concurrencia": 2},
+            {"nombre": "carga", "funcion": cargar, "concurrencia": 1}]
+
+
+def test_reanudacion_omite_etapas_completadas(tmp_path):
+    ruta = str(tmp_path / "estado.json")
+    trabajos = [{"id": "a"}, {"id": "b"}]
+    llamadas = []
+    tiempos = ejecutar_etapas(trabajos, _etapas(llamadas, falla={"b"}), ruta, clave=lambda t: t["id"])
+    assert {(t["clave"], t["etapa"]): t["estado"] for t in tiempos}[("b", "carga")] == "error"
+
+    llamadas.clear()
+    tiempos = ejecutar_etapas(trabajos, _etapas(llamadas), ruta, clave=lambda t: t["id"])
+    assert llamadas == [("carga", "b")]
+    estados = {(t["clave"], t["etapa"]): t["estado"] for t in tiempos}
+    assert estados == {("a", "descarga"): "omitida", ("b", "descarga"): "omitida",
+                       ("a", "carga"): "omitida", ("b", "carga"): "ok"}
+
+
+def test_trabajo_fallido_no_sigue_a_la_etapa_siguiente(tmp_path):
+    llamadas = []
+    etapas = _etapas(llamadas)
+    etapas[0]["funcion"] = lambda trabajo: 1 / 0
+    ejecutar_etapas([{"id": "a"}], etapas, str(tmp_path / "estado.json"), clave=lambda t: t["id"])
+    assert llamadas == []
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("osgeo")
+
+from extraccion_archivos import parsear_listado_slt  # noqa: E402
+
+SALIDA_SLT = """
+7-Zip [64] 16.02 : Copyright (c) 1999-2016 Igor Pavlov : 2016-05-21
+
+Listing archive: dem.rar
+
+--
+Path = dem.rar
+Type = Rar5
+Physical Size = 1048576
+
+----------
+Path = DEM
+Folder = +
+Size = 0
+Attributes = D
+
+Path = DEM/antofagasta.jp2
+Folder = -
+Size = 734003200
+Attributes = A
+
+Path = DEM/leeme.txt
+Size =
+Attributes = A
+"""
+
+
+def test_parsear_listado_slt():
+    assert parsear_listado_slt(SALIDA_SLT) == [
+        {"ruta": "DEM", "carpeta": True, "tamano": 0},
+        {"ruta": "DEM/antofagasta.jp2", "carpeta": False, "tamano": 734003200},
+        {"ruta": "DEM/leeme.txt", "carpeta": False, "tamano": None},
+    ]
+
+
+def test_parsear_listado_slt_sin_miembros():
+    assert parsear_listado_slt("Listing archive: vacio.7z\n\n--\nPath = vacio.7z\n") == []
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from finalizacion_dem import consulta_tabla_final
+
+
+def test_cte_de_teselas_sin_rast_ni_orden():
+    sql = consulta_tabla_final("medio_fisico.dem_carga", "medio_fisico.dem_nueva", extension_cargada=True)
+    cte = sql.split("WITH teselas AS (", 1)[1].split("FROM", 1)[0]
+    assert cte.split() == ["SELECT", "rid,", "ST_ConvexHull(rast)", "AS", "tile_extent,", "raster_valued_extent",
+                           "AS", "raster_valued_extent"]
+    assert "c.rast AS geometria_raster" in sql and "FROM medio_fisico.dem_carga c" in sql
+    assert "ORDER BY t.rid" not in sql and "ORDER BY c.rid" not in sql
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import uuid
+
+import numpy as np
+
+from muestreo_bloques import asignar_muestras_por_bloque, indice_bloque, iterar_ventanas, uuids_deterministas
+
+
+def test_asignacion_respeta_totales_y_conteos():
+    rng = np.random.RandomState(0)
+    conteos = rng.randint(0, 50, size=(40, 14))
+    conteos[:, 0] = 0
+    conteos[::3, 5] = 0
+    asignacion = asignar_muestras_por_bloque(conteos, 0.1, np.random.RandomState(1))
+    assert (asignacion <= conteos).all()
+    assert (asignacion[:, 0] == 0).all()
+    esperado = [max(1, int(round(total * 0.1))) if total else 0 for total in conteos.sum(axis=0)]
+    assert asignacion.sum(axis=0).tolist() == esperado
+
+
+def test_asignacion_clase_rara_recibe_al_menos_una_muestra():
+    conteos = np.zeros((5, 3), dtype=np.int64)
+    conteos[3, 2] = 2
+    asignacion = asignar_muestras_por_bloque(conteos, 0.01, np.random.RandomState(0))
+    assert asignacion[3, 2] == 1 and asignacion.sum() == 1
+
+
+def test_asignacion_reproducible_con_la_misma_semilla():
+    conteos = np.random.RandomState(2).randint(0, 100, size=(30, 4))
+    a = asignar_muestras_por_bloque(conteos, 0.3, np.random.RandomState(7))
+    b = asignar_muestras_por_bloque(conteos, 0.3, np.random.RandomState(7))
+    assert (a == b).all()
+
+
+def test_indice_bloque_sigue_el_orden_de_iterar_ventanas():
+    width, height, chunk_size = 70, 45, 16
+    for i, win in enumerate(iterar_ventanas(width, height, chunk_size)):
+        filas = np.array([win.row_off, win.row_off + win.height - 1])
+        columnas = np.array([win.col_off, win.col_off + win.width - 1])
+        assert (indice_bloque(filas, columnas, width, chunk_size) == i).all()
+
+
+def test_uuids_deterministas():
+    uuids = uuids_deterministas(np.array([0, 12]), np.array([3, 4]))
+    assert uuids.tolist() == [str(uuid.uuid5(uuid.NAMESPACE_DNS, "0_3")), str(uuid.uuid5(uuid.NAMESPACE_DNS, "12_4"))]
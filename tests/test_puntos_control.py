@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from extraccion_valores import extraer_valores
+from puntos_control import PuntosControl
+
+ANCHO, ALTO, CHUNK = 70, 50, 16
+N_BLOQUES = -(-ALTO // CHUNK) * -(-ANCHO // CHUNK)
+
+
+@pytest.fixture
+def stack(tmp_path):
+    ruta = str(tmp_path / "stack.tif")
+    datos = np.random.RandomState(0).randint(1, 14, size=(3, ALTO, ANCHO)).astype(np.uint8)
+    with rasterio.open(ruta, "w", driver="GTiff", width=ANCHO, height=ALTO, count=3, dtype="uint8",
+                       crs="EPSG:32719", transform=from_origin(0, 0, 30, 30)) as destino:
+        destino.write(datos)
+    return ruta
+
+
+def _muestra(puntos_control):
+    rng = np.random.RandomState(1)
+    planos = rng.choice(ALTO * ANCHO, size=300, replace=False)
+    return puntos_control.guardar_muestra(rng.randint(1, 14, size=300), planos, ANCHO, CHUNK, N_BLOQUES)
+
+
+def test_extraccion_reanudada_igual_a_completa(stack, tmp_path):
+    directorio = str(tmp_path / "pc")
+    puntos_control = PuntosControl(directorio, stack, {"p": 1})
+    _, planos = _muestra(puntos_control)
+    posiciones = np.flatnonzero(np.random.RandomState(2).rand(len(planos)) < 0.8)
+
+    with rasterio.open(stack) as src:
+        interrumpida = puntos_control.iterar_valores(src, posiciones, [1, 2, 3], CHUNK)
+        for _ in zip(range(3), interrumpida):
+            pass
+        interrumpida.close()
+
+        puntos_control = PuntosControl(directorio, stack, {"p": 1})
+        assert puntos_control.completa("muestreo")
+        valores = np.zeros((3, len(posiciones)), dtype=np.uint8)
+        for _, idx, valores_bloque in puntos_control.iterar_valores(src, posiciones, [1, 2, 3], CHUNK):
+            valores[:, idx] = valores_bloque
+        filas, columnas = np.divmod(planos[posiciones], ANCHO)
+        assert (valores == extraer_valores(src, filas, columnas, [1, 2, 3], CHUNK)).all()
+
+
+def test_parametros_distintos_borran_solo_archivos_propios(stack, tmp_path):
+    directorio = str(tmp_path / "pc")
+    _muestra(PuntosControl(directorio, stack, {"p": 1}))
+    with open(os.path.join(directorio, "notas.txt"), "w") as archivo:
+        archivo.write("ajeno")
+    puntos_control = PuntosControl(directorio, stack, {"p": 2})
+    assert not puntos_control.completa("muestreo")
+    assert sorted(os.listdir(directorio)) == ["manifiesto.json", "notas.txt"]
+
+
+def test_rechaza_directorio_ajeno(stack, tmp_path):
+    directorio = tmp_path / "ajeno"
+    directorio.mkdir()
+    (directorio / "datos.csv").write_text("1")
+    with pytest.raises(ValueError):
+        PuntosControl(str(directorio), stack, {})
+    assert (directorio / "datos.csv").exists()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from resumen_dem import COLUMNAS_RESUMEN, estadisticas_region
+
+
+class ConexionResumen:
+    """Conexión falsa que devuelve filas fijas del resumen para cualquier SELECT."""
+
+    def __init__(self, filas):
+        self.filas = filas
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, parametros=None):
+        pass
+
+    def fetchall(self):
+        return [tuple(fila[c] for c in COLUMNAS_RESUMEN) for fila in self.filas]
+
+    def commit(self):
+        pass
+
+
+def _fila(comuna, valores):
+    return {"tabla_dem": "medio_fisico.dem", "id_comuna": comuna, "teselas": 1, "pixeles": len(valores),
+            "suma": float(np.sum(valores)), "media": float(np.mean(valores)) if len(valores) else None,
+            "desviacion": float(np.std(valores)) if len(valores) else None,
+            "minimo": float(np.min(valores)) if len(valores) else None,
+            "maximo": float(np.max(valores)) if len(valores) else None, "actualizado": comuna}
+
+
+def test_estadisticas_region_combina_comunas():
+    rng = np.random.RandomState(0)
+    partes = [rng.normal(1000, 300, 500), rng.normal(3500, 50, 2000), np.array([])]
+    region = estadisticas_region(ConexionResumen([_fila(i, p) for i, p in enumerate(partes)]), "medio_fisico.dem")
+    todos = np.concatenate(partes)
+    assert region["comunas"] == 2 and region["pixeles"] == len(todos)
+    assert region["media"] == pytest.approx(todos.mean())
+    assert region["desviacion"] == pytest.approx(todos.std())
+    assert (region["minimo"], region["maximo"]) == (todos.min(), todos.max())
+
+
+def test_estadisticas_region_sin_filas():
+    assert estadisticas_region(ConexionResumen([]), "medio_fisico.dem") is None
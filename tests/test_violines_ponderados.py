@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from violines_ponderados import cuantiles_ponderados, densidad_ponderada, estadisticas_violines
+
+
+def test_cuantiles_ponderados_igual_a_filas_repetidas():
+    valores, pesos = np.array([1.0, 2.0, 5.0, 9.0]), np.array([3, 1, 4, 2])
+    crudos = np.repeat(valores, pesos)
+    esperado = np.quantile(crudos, [0.25, 0.5, 0.75], method="inverted_cdf")
+    assert cuantiles_ponderados(valores, pesos, [0.25, 0.5, 0.75]).tolist() == esperado.tolist()
+
+
+def test_densidad_ponderada_integra_uno():
+    grilla, densidad = densidad_ponderada(np.array([1.0, 4.0, 6.0]), np.array([10.0, 5.0, 1.0]))
+    integral = np.sum(np.diff(grilla) * (densidad[1:] + densidad[:-1]) / 2)
+    # cut=2 (como seaborn) deja fuera las colas más allá de 2 anchos de banda de los extremos
+    assert integral == pytest.approx(1.0, abs=0.03)
+
+
+def test_n_ancho_fija_el_suavizado():
+    valores, pesos = np.array([1.0, 4.0, 6.0]), np.array([1000.0, 500.0, 100.0])
+    grilla_n, _ = densidad_ponderada(valores, pesos, n_ancho=20)
+    grilla_total, _ = densidad_ponderada(valores, pesos)
+    assert np.ptp(grilla_n) > np.ptp(grilla_total)
+
+
+def test_estadisticas_violines_por_anio_y_clase():
+    conteos = pd.DataFrame({"year": ["2018"] * 3 + ["2019"], "clase_referencia": ["A"] * 3 + ["B"],
+                            "valor": [3, 1, 2, 7], "conteo": [2, 5, 1, 4]})
+    violines = estadisticas_violines(conteos)
+    assert set(violines) == {("2018", "A"), ("2019", "B")}
+    assert violines[("2018", "A")]["n"] == 8
+    assert (violines[("2018", "A")]["minimo"], violines[("2018", "A")]["mediana"]) == (1, 1)